@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the `dbcache` hot paths, using the models of the test project.
+
+Run from the project root::
+
+    $ python benchmarks/run.py
+    $ python benchmarks/run.py hit miss --output results.json
+    $ python benchmarks/run.py --compare results.json
+
+See `benchmarks/settings.py` to run the benchmarks against another database.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+# The number of times each measurement is repeated, the fastest one is used.
+REPEAT = 5
+
+
+def measure(func, number, setup=None):
+    """
+    Returns the fastest time of a call to `func` in microseconds.
+
+    :param func:
+        The callable to measure.
+    :param number:
+        The number of calls per measurement.
+    :param setup:
+        A callable that is called before each call, outside of the
+        measurement.
+    """
+    best = None
+    for i in range(REPEAT):
+        total = 0
+        for j in range(number):
+            if setup is not None:
+                setup()
+            start = timeit.default_timer()
+            func()
+            total += timeit.default_timer() - start
+        if best is None or total < best:
+            best = total
+    return best / number * 1e6
+
+
+def bench_hit(number, sizes):
+    """
+    Compare calling a decorated method that returns its cached value with
+    reading the cached value directly.
+    """
+    from tests.proj.myapp.models import Drink
+
+    drink = Drink(pk=1, name='coffee', base_price=Decimal('2.00'), _get_price_cached=Decimal('2.00'))
+
+    attribute = min(timeit.repeat(lambda: drink._get_price_cached, number=number * 100, repeat=REPEAT))
+    method = min(timeit.repeat(lambda: drink.get_price(), number=number * 100, repeat=REPEAT))
+    return {
+        'attribute_us': attribute / (number * 100) * 1e6,
+        'method_us': method / (number * 100) * 1e6,
+        'ratio': method / attribute,
+    }
+
+
+def bench_miss(number, sizes):
+    """
+    Call a decorated method without a cached value, so the value is
+    calculated and written back to the database.
+    """
+    from django_dbcache_fields.utils import clear_memo
+    from tests.proj.myapp.models import Drink
+
+    drink = Drink.objects.create(name='coffee', base_price=Decimal('2.00'))
+
+    def invalidate():
+        drink._get_price_cached = None
+        # Otherwise, the memoized value is returned without a write-back.
+        clear_memo(drink)
+
+    return {
+        'method_us': measure(drink.get_price, number, setup=invalidate),
+    }
+
+
+def bench_save(number, sizes):
+    """
+    Save an instance with `dbcache` fields, and run only the receiver that
+    recalculates the fields after the save.
+    """
+    from django_dbcache_fields.receivers import update_dbcache_fields
+    from tests.proj.myapp.models import Drink
+
+    drink = Drink.objects.create(name='coffee', base_price=Decimal('2.00'))
+
+    return {
+        'save_us': measure(drink.save, number),
+        'receiver_us': measure(lambda: update_dbcache_fields(Drink, drink, created=False), number),
+    }
+
+
+def bench_invalidation(number, sizes):
+    """
+    Save instances that invalidate the rows of another model, with a growing
+    number of rows in that model: `WrapType` invalidates the rows that refer
+    to it (always 10 rows), `Ingredient` invalidates all `WrapDeluxe` rows.
+    """
+    from django_dbcache_fields.decorators import dbcache
+    from tests.proj.myapp.models import Ingredient, Wrap, WrapDeluxe, WrapType
+
+    wrap_type = WrapType.objects.create(type_name='hot', price=Decimal('1.00'))
+    other_type = WrapType.objects.create(type_name='cold', price=Decimal('1.00'))
+    ingredient = Ingredient.objects.create(name='tomato', price=Decimal('0.50'))
+
+    with dbcache.suspended():
+        Wrap.objects.bulk_create([Wrap(name='wrap', base_price=Decimal('5.00'), wrap_type=wrap_type)] * 10)
+
+    result = {}
+    count = 0
+    for size in sizes:
+        # Grow the tables up to the size.
+        with dbcache.suspended():
+            Wrap.objects.bulk_create(
+                [Wrap(name='wrap', base_price=Decimal('5.00'), wrap_type=other_type)] * (size - count))
+            WrapDeluxe.objects.bulk_create([WrapDeluxe(name='wrap', base_price=Decimal('5.00'))] * (size - count))
+        count = size
+
+        result['lookup_{}_us'.format(size)] = measure(wrap_type.save, number)
+        result['model_{}_us'.format(size)] = measure(ingredient.save, number)
+    return result
+
+
+BENCHMARKS = {
+    'hit': bench_hit,
+    'miss': bench_miss,
+    'save': bench_save,
+    'invalidation': bench_invalidation,
+}
+
+
+def run(names, number, sizes):
+    """
+    Run the benchmarks on a test database. The changes of each benchmark are
+    rolled back afterwards.
+
+    :return:
+        A `dict` of the benchmark names and their results.
+    """
+    from django.db import connection, transaction
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        results = {}
+        for name in names:
+            with transaction.atomic():
+                results[name] = BENCHMARKS[name](number, sizes)
+                transaction.set_rollback(True)
+        return results
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions compared to the results of an earlier run.
+
+    :return:
+        A `list` of messages, one for each timing that is more than the
+        tolerance slower than in the baseline.
+    """
+    regressions = []
+    for name, values in sorted(results.items()):
+        for key, value in sorted(values.items()):
+            old_value = baseline.get(name, {}).get(key)
+            if old_value and key.endswith('_us') and value > old_value * (1 + tolerance):
+                regressions.append('{}: {} increased from {:.3f} to {:.3f}.'.format(name, key, old_value, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the dbcache benchmarks.')
+    parser.add_argument(
+        'benchmarks', nargs='*', metavar='benchmark',
+        help='The benchmarks to run (default: all). Choices: {}.'.format(', '.join(sorted(BENCHMARKS))))
+    parser.add_argument(
+        '--number', type=int, default=1000,
+        help='The number of calls per measurement (default: 1000).')
+    parser.add_argument(
+        '--sizes', default='100,1000,10000',
+        help='The comma separated numbers of rows to measure the invalidation with (default: 100,1000,10000).')
+    parser.add_argument(
+        '--output', default=None,
+        help='Write the results as JSON to this file.')
+    parser.add_argument(
+        '--compare', default=None,
+        help='Fail if a timing is slower than in the JSON results of an earlier run.')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='The allowed slowdown compared to the earlier run (default: 0.2).')
+    parser.add_argument(
+        '--max-ratio', type=float, default=None,
+        help='Fail if the cached hit is more than this many times slower than an attribute read.')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark "{}".'.format(name))
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    import django
+    django.setup()
+    from django.db import connection
+
+    results = run(args.benchmarks or sorted(BENCHMARKS), args.number, sizes)
+
+    output = {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'number': args.number,
+        'results': results,
+    }
+    for name, values in sorted(results.items()):
+        print('{}: {}'.format(name, ', '.join('{}={:.3f}'.format(k, v) for k, v in sorted(values.items()))))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    failed = []
+    if args.max_ratio is not None and 'hit' in results and results['hit']['ratio'] > args.max_ratio:
+        failed.append('hit: the ratio exceeds {}.'.format(args.max_ratio))
+    if args.compare:
+        with open(args.compare) as f:
+            failed.extend(compare(results, json.load(f)['results'], args.tolerance))
+    for message in failed:
+        print(message)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""
+Settings to run the benchmarks with. The database can be configured with the
+`BENCHMARK_DB_*` environment variables, for example to use PostgreSQL::
+
+    $ BENCHMARK_DB_ENGINE=django.db.backends.postgresql BENCHMARK_DB_NAME=dbcache \\
+        python benchmarks/run.py
+
+The benchmarks run on a test database (like `test_dbcache`) that is created
+and destroyed by the runner.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+from tests.proj.settings import *  # noqa
+
+# Don't keep track of the executed queries.
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': os.environ.get('BENCHMARK_DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.environ.get('BENCHMARK_DB_NAME', 'benchmarks.sqlite3'),
+        'USER': os.environ.get('BENCHMARK_DB_USER', ''),
+        'PASSWORD': os.environ.get('BENCHMARK_DB_PASSWORD', ''),
+        'HOST': os.environ.get('BENCHMARK_DB_HOST', ''),
+        'PORT': os.environ.get('BENCHMARK_DB_PORT', ''),
+    }
+}
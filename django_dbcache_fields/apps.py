@@ -1,10 +1,14 @@
 from __future__ import absolute_import, unicode_literals
 
-from django.apps import AppConfig
-from django.db.models.signals import class_prepared, m2m_changed, post_delete, post_save
+from django.apps import AppConfig, apps
+from django.core.signals import request_finished
+from django.db.models.signals import class_prepared, m2m_changed, post_delete, post_init, post_save, pre_delete
 from django.utils.translation import ugettext_lazy as _
 
-from .receivers import invalidate_dbcache_fields_by_fks, invalidate_dbcache_fields_by_m2m, update_models
+from . import register
+from .receivers import (invalidate_dbcache_fields_by_fks, invalidate_dbcache_fields_by_m2m,
+                        refresh_eager_dbcache_fields, remember_foreign_keys, update_models)
+from .writeback import flush_on_request_finished
 
 __all__ = ['DBCacheFieldsConfig']
 
@@ -17,15 +21,42 @@ class DBCacheFieldsConfig(AppConfig):
     verbose_name = _('DBCache Fields')
 
     def ready(self):
-        post_save.connect(
-            invalidate_dbcache_fields_by_fks,
-            dispatch_uid='django_dbcache_fields.receivers.invalidate_dbcache_fields_by_fks__post_save')
-        post_delete.connect(
-            invalidate_dbcache_fields_by_fks,
-            dispatch_uid='django_dbcache_fields.receivers.invalidate_dbcache_fields_by_fks__post_delete')
-        m2m_changed.connect(
-            invalidate_dbcache_fields_by_m2m,
-            dispatch_uid='django_dbcache_fields.receivers.invalidate_dbcache_fields_by_m2m__m2m_changed')
+        # All models are loaded, so relation paths can be resolved.
+        register.resolve_relations()
+
+        # Only connect the invalidation receivers for models that invalidate
+        # other models, so saving any other model isn't affected at all.
+        for model in apps.get_models():
+            plan = register.get_plan(model)
+            if not plan.dependents:
+                continue
+
+            # Changing a foreign key also affects the rows that referenced
+            # the instance before.
+            if plan.moved_dependents:
+                post_init.connect(
+                    remember_foreign_keys, sender=model,
+                    dispatch_uid='django_dbcache_fields.receivers.remember_foreign_keys__post_init')
+            post_save.connect(
+                invalidate_dbcache_fields_by_fks, sender=model,
+                dispatch_uid='django_dbcache_fields.receivers.invalidate_dbcache_fields_by_fks__post_save')
+            # Invalidate before deletion, since relations to the deleted
+            # instance are gone (or nulled) afterwards.
+            pre_delete.connect(
+                invalidate_dbcache_fields_by_fks, sender=model,
+                dispatch_uid='django_dbcache_fields.receivers.invalidate_dbcache_fields_by_fks__pre_delete')
+            # Eager fields can only be recalculated once the instance is gone.
+            post_delete.connect(
+                refresh_eager_dbcache_fields, sender=model,
+                dispatch_uid='django_dbcache_fields.receivers.refresh_eager_dbcache_fields__post_delete')
+            for through in plan.get_through_models():
+                m2m_changed.connect(
+                    invalidate_dbcache_fields_by_m2m, sender=through,
+                    dispatch_uid='django_dbcache_fields.receivers.invalidate_dbcache_fields_by_m2m__m2m_changed')
+
+        request_finished.connect(
+            flush_on_request_finished,
+            dispatch_uid='django_dbcache_fields.writeback.flush_on_request_finished')
 
 
 # Connect before this app is ready.
@@ -0,0 +1,159 @@
+from __future__ import absolute_import, unicode_literals
+
+import uuid
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import connections, router, transaction
+
+from .utils import get_dbcache_entries, get_model_name, is_cached
+
+# The prefix of all cache keys.
+KEY_PREFIX = 'dbcache'
+
+
+def get_version_key(model_name, field_name):
+    return '{}:{}:{}:version'.format(KEY_PREFIX, model_name, field_name)
+
+
+def get_version(cache, model_name, field_name):
+    """
+    Returns the current version of the cached values of a `dbcache` field.
+    Invalidating all rows of a model changes the version, instead of removing
+    every cached value. A new random version is used if the version is
+    missing, so values of a lost version are never used again.
+
+    :param cache:
+        The Django cache.
+    :param model_name:
+        The model name in the form `{app label}.{model name}`.
+    :param field_name:
+        The field name.
+    :return:
+        The version.
+    """
+    key = get_version_key(model_name, field_name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def make_key(model_name, field_name, version, pk):
+    """
+    Returns the cache key of a cached value, from the model, the primary key,
+    the field and the version.
+    """
+    return '{}:{}:{}:{}:{}'.format(KEY_PREFIX, model_name, field_name, version, pk)
+
+
+def on_commit(model, func):
+    """
+    Call a function when the current transaction of the database of the
+    model is committed, or right away outside of a transaction.
+    """
+    transaction.on_commit(func, using=router.db_for_write(model))
+
+
+def store_value(model, pk, field_name, alias, value, ttl=None):
+    """
+    Store a (re)calculated value of a `dbcache` field in the cache, once the
+    transaction is committed.
+
+    :param model:
+        The `Model` class.
+    :param pk:
+        The primary key of the row.
+    :param field_name:
+        The field name.
+    :param alias:
+        The alias of the cache, as given by the `cache` argument of `dbcache`.
+    :param value:
+        The value.
+    :param ttl:
+        The `ttl` of the `dbcache` field, if any. The value expires from the
+        cache as well.
+    """
+    timeout = DEFAULT_TIMEOUT if ttl is None else ttl.total_seconds()
+
+    def store():
+        cache = caches[alias]
+        model_name = get_model_name(model)
+        # Wrapped in a tuple, to tell a cached `None` from a missing value.
+        version = get_version(cache, model_name, field_name)
+        cache.set(make_key(model_name, field_name, version, pk), (value,), timeout)
+
+    on_commit(model, store)
+
+
+def purge_values(model, entries, pks=None):
+    """
+    Remove the cached values of `dbcache` fields from the cache. The values
+    are removed right away and again when the transaction is committed, so
+    a value that was cached by another process in the meantime is removed as
+    well.
+
+    :param model:
+        The `Model` class.
+    :param entries:
+        The register entries, only entries with a `cache` are used.
+    :param pks:
+        The primary keys of the rows, or `None` to remove the values of all
+        rows.
+    """
+    entries = [entry for entry in entries if entry.cache is not None]
+    if not entries or (pks is not None and not pks):
+        return
+
+    model_name = get_model_name(model)
+
+    def purge():
+        for entry in entries:
+            cache = caches[entry.cache]
+            if pks is None:
+                # Remove the values of all rows by using a new version, also
+                # when purging again on commit.
+                cache.set(get_version_key(model_name, entry.field_name), uuid.uuid4().hex, None)
+            else:
+                version = get_version(cache, model_name, entry.field_name)
+                cache.delete_many([make_key(model_name, entry.field_name, version, pk) for pk in pks])
+
+    purge()
+    if connections[router.db_for_write(model)].in_atomic_block:
+        on_commit(model, purge)
+
+
+def get_cached_value(model, pk, name):
+    """
+    Returns the value of a decorated method for a row, from the cache given
+    by the `cache` argument of `dbcache` if possible. Otherwise, the instance
+    is fetched and the decorated method is called, which stores the value in
+    the cache.
+
+    :param model:
+        The `Model` class.
+    :param pk:
+        The primary key of the row.
+    :param name:
+        The decorated method name or field name.
+    :return:
+        The value.
+    :raises model.DoesNotExist:
+        If the value is not cached and the row does not exist.
+    """
+    entry = get_dbcache_entries(model, [name])[0]
+    if entry.cache is not None:
+        cache = caches[entry.cache]
+        model_name = get_model_name(model)
+        version = get_version(cache, model_name, entry.field_name)
+        cached = cache.get(make_key(model_name, entry.field_name, version, pk))
+        if cached is not None:
+            return cached[0]
+
+    instance = model._default_manager.get(pk=pk)
+    stale = entry.stale_field_name is not None and getattr(instance, entry.stale_field_name) is not None
+    if entry.cache is not None and is_cached(instance, entry) and not stale:
+        # The decorated method only stores values it calculates itself.
+        store_value(model, pk, entry.field_name, entry.cache, getattr(instance, entry.field_name), ttl=entry.ttl)
+    return getattr(instance, entry.decorated_method.__name__)()
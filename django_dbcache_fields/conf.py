@@ -0,0 +1,67 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+from django.test.signals import setting_changed
+
+WRITE_MODE_IMMEDIATE = 'immediate'
+WRITE_MODE_DEFERRED = 'deferred'
+WRITE_MODE_READONLY = 'readonly'
+
+DEFAULTS = {
+    # How a cached value that was (re)calculated when calling a dbcache
+    # decorated method is stored in the database.
+    'WRITE_MODE': WRITE_MODE_IMMEDIATE,
+    # The maximum number of deferred rows to keep outside of a transaction
+    # before they are written to the database.
+    'WRITE_BUFFER_SIZE': 1000,
+    # Calculate cached values before an instance is saved, so they are
+    # stored by the save itself instead of an additional update query.
+    'PRE_SAVE': False,
+    # The queue to recalculate invalidated cached values in the background:
+    # The dotted path to a queue class (like
+    # `django_dbcache_fields.queues.ThreadQueue`) or to a callable.
+    'QUEUE': None,
+    # The keyword arguments to construct the queue class with.
+    'QUEUE_OPTIONS': {},
+    # Collect the invalidations within a transaction and perform them with a
+    # single update query per model when the transaction is committed.
+    'COALESCE_INVALIDATIONS': False,
+    # Keep hit, miss and recalculation metrics per field and send the
+    # signals in `django_dbcache_fields.signals`.
+    'METRICS': False,
+    # The maximum number of seconds to wait for another process to calculate
+    # a missing value of a field with `single_flight`, before calculating it
+    # without storing it.
+    'SINGLE_FLIGHT_WAIT': 1.0,
+}
+
+
+_cache = {}
+
+
+def get_setting(name):
+    """
+    Returns the value of a `DBCACHE_FIELDS_{name}` setting or its default.
+    The value is cached, since the settings are read on every save.
+
+    :param name:
+        The setting name without the `DBCACHE_FIELDS_` prefix.
+    :return:
+        The setting value.
+    """
+    try:
+        return _cache[name]
+    except KeyError:
+        value = _cache[name] = getattr(settings, 'DBCACHE_FIELDS_{}'.format(name), DEFAULTS[name])
+        return value
+
+
+def clear_cache(sender, setting, **kwargs):
+    """
+    Read the settings again when they are changed, like in tests.
+    """
+    if setting.startswith('DBCACHE_FIELDS_'):
+        _cache.clear()
+
+
+setting_changed.connect(clear_cache, dispatch_uid='django_dbcache_fields.conf.clear_cache')
@@ -1,24 +1,55 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
+from datetime import timedelta
+from timeit import default_timer
 
+from django.conf import settings
 from django.core.exceptions import FieldError
 from django.db.models import Field
-from django.utils.six import string_types
+from django.utils import timezone
+from django.utils.six import integer_types, string_types
 from qualname import qualname
 
-from . import register
+from . import metrics, register
+from .cache import store_value
+from .conf import WRITE_MODE_IMMEDIATE, get_setting
+from .locks import acquire_lock, holding, wait_for_value
+from .profiling import track
+from .queues import schedule_refresh
+from .receivers import Batch
+from .refresh import DEFAULT_BATCH_SIZE
+from .utils import MEMO_ATTR, is_expired, is_expression
+from .writeback import get_write_mode, write_values
 
 logger = logging.getLogger(__name__)
 
 
+def get_timedelta(value, argument):
+    """
+    Returns a `dbcache` argument that is a `timedelta` or number of seconds as
+    `timedelta`.
+    """
+    if value is None or isinstance(value, timedelta):
+        return value
+    if isinstance(value, integer_types + (float,)):
+        return timedelta(seconds=value)
+    raise TypeError('The dbcache {} argument should be a timedelta or a number of seconds.'.format(argument))
+
+
 class dbcache(object):
     """
     Decorate a class method on a Django `Model` to store the result of that
     method in the database.
+
+    The calculated value is memoized on the instance as well, so calling the
+    method again (with `use_dbcache=False` or if the value is `None`) does
+    not calculate it again. The memoized value is removed when the instance
+    is saved, reloaded or its cached fields are invalidated.
     """
 
-    def __init__(self, field, field_name=None, dirty_func=None, invalidated_by=None):
+    def __init__(self, field, field_name=None, dirty_func=None, invalidated_by=None, requires_pk=False,
+                 cache_none=False, bulk=None, eager=False, cache=None, max_stale=None, ttl=None, single_flight=False):
         """
         Constructor.
 
@@ -31,8 +62,65 @@ class dbcache(object):
             field name) that should return `True` if the field value should
             be recalculated using the original method.
         :param invalidated_by:
-            A list of model names in the form `{app_label}.{model name}` that
-            when updated, invalidate this field.
+            A list of relation paths (like `ingredients` or `wrappromo_set`)
+            or model names in the form `{app_label}.{model name}` that when
+            updated, invalidate this field. A relation path only invalidates
+            the rows that reference the updated instance, a model name
+            invalidates all rows.
+        :param requires_pk:
+            Whether the method requires the instance to be saved, for example
+            because it uses a many-to-many relation. Such fields are always
+            calculated after the instance is saved, also when the
+            `DBCACHE_FIELDS_PRE_SAVE` setting is enabled.
+        :param cache_none:
+            Whether `None` is a valid result of the method that should be
+            cached. If `True`, a `BooleanField` named `{field_name}_valid` is
+            added to the model to indicate whether the cached value is valid.
+            Invalidation then sets this field to `False` instead of setting
+            the cached value to `None`.
+        :param bulk:
+            An optional set-based implementation of the method, used to
+            (re)calculate the values of many rows at once, for example by
+            `refresh_dbcache` and `DBCacheQuerySet.with_dbcache`. Either an
+            ORM expression that calculates the value per row (like
+            `F('base_price') + Coalesce(Sum('ingredients__price'), 0)`) or a
+            function that takes a `QuerySet` and returns a `dict` of primary
+            keys and values. The result should be the same as the result of
+            the method itself.
+        :param eager:
+            Whether to recalculate the field in the database on invalidation,
+            instead of clearing the cached value. Requires an expression as
+            `bulk` argument. This keeps the field up to date for queries that
+            filter or aggregate on it.
+        :param cache:
+            The alias of a Django cache (like `default`) to store the values
+            in as well, so `get_cached_value` can return them without a
+            query. The values are stored when they are (re)calculated and
+            removed when the field is invalidated.
+        :param max_stale:
+            How long an invalidated value can still be used, as `timedelta`
+            or number of seconds. If given, a `DateTimeField` named
+            `{field_name}_stale_since` is added to the model and invalidation
+            sets it instead of clearing the cached value. Calling the method
+            returns the stale value and schedules its recalculation in the
+            queue of the `DBCACHE_FIELDS_QUEUE` setting, until the value is
+            stale for longer than `max_stale`.
+        :param ttl:
+            How long a calculated value can be used, as `timedelta` or number
+            of seconds, for methods that depend on the time rather than on
+            other models. If given, an indexed `DateTimeField` named
+            `{field_name}_computed_at` is added to the model. Calling the
+            method calculates an expired value again. Use `refresh_expired`
+            (or `dbcache_rebuild --expired`) to refresh all expired rows.
+        :param single_flight:
+            Whether only one process at a time should calculate a missing
+            value of a row. Other processes wait for the value to be stored,
+            see the `DBCACHE_FIELDS_SINGLE_FLIGHT_WAIT` setting, or calculate
+            it without storing it. The lock is kept in the cache given by the
+            `cache` argument or the `default` cache, that should be shared by
+            all processes. The value is only stored if the row did not change
+            in the meantime. Ignored unless the `DBCACHE_FIELDS_WRITE_MODE`
+            setting is `immediate`.
         """
         if isinstance(field, string_types):
             if field_name is not None:
@@ -46,6 +134,20 @@ class dbcache(object):
             elif not field.blank or not field.null:
                 raise FieldError('The dbcache field should have blank=True and null=True.')
 
+        if bulk is not None and not (is_expression(bulk) or callable(bulk)):
+            raise TypeError('The dbcache bulk argument should be an expression or a callable.')
+        if eager and not is_expression(bulk):
+            raise ValueError('The dbcache eager argument requires an expression as bulk argument.')
+
+        max_stale = get_timedelta(max_stale, 'max_stale')
+        ttl = get_timedelta(ttl, 'ttl')
+        if max_stale is not None and eager:
+            raise ValueError('The dbcache max_stale argument cannot be combined with eager, eager fields are never '
+                             'stale.')
+
+        if cache is not None and cache not in settings.CACHES:
+            raise ValueError('The dbcache cache argument "{}" is not a configured cache.'.format(cache))
+
         if dirty_func and dirty_func.__code__.co_argcount < 2:
             raise TypeError('The dirty function "{}" should accept at least 2 arguments.'.format(dirty_func.__name__))
 
@@ -53,6 +155,45 @@ class dbcache(object):
         self.field_name = field_name
         self.dirty_func = dirty_func
         self.invalidated_by = invalidated_by
+        self.requires_pk = requires_pk
+        self.cache_none = cache_none
+        self.bulk = bulk
+        self.eager = eager
+        self.cache = cache
+        self.max_stale = max_stale
+        self.ttl = ttl
+        self.single_flight = single_flight
+
+    @classmethod
+    def batch(cls, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Context manager that suspends the calculation and invalidation of
+        `dbcache` fields on save in the current thread, for example during an
+        import. When the context manager exits, all collected invalidations
+        are performed and the `dbcache` fields of all saved instances are
+        recalculated in batches, also if an exception is raised. Within a
+        transaction, this happens when the transaction is committed. Dirty
+        functions are not used.
+
+        :param batch_size:
+            The number of rows to recalculate per query.
+        :return:
+            A `Batch` instance.
+        """
+        return Batch(batch_size=batch_size)
+
+    @classmethod
+    def suspended(cls):
+        """
+        Context manager that disables the calculation and invalidation of
+        `dbcache` fields on save in the current thread. Nothing is
+        recalculated afterwards, use `refresh_dbcache` or the
+        `dbcache_rebuild` management command instead.
+
+        :return:
+            A `Batch` instance.
+        """
+        return Batch(replay=False)
 
     def __call__(self, f):
         # If there are decorator arguments, __call__() is only called once, as
@@ -72,56 +213,148 @@ class dbcache(object):
         class_name = qualname(f).split('.')[0]
         class_path = '{}.{}'.format(f.__module__, class_name)
 
-        register.add(
-            class_path, f, self.field, field_name, self.dirty_func, self.invalidated_by
+        valid_field_name = '{}_valid'.format(field_name) if self.cache_none else None
+        stale_field_name = '{}_stale_since'.format(field_name) if self.max_stale is not None else None
+        computed_field_name = '{}_computed_at'.format(field_name) if self.ttl is not None else None
+
+        entry = register.add(
+            class_path, f, self.field, field_name, self.dirty_func, self.invalidated_by,
+            requires_pk=self.requires_pk, valid_field_name=valid_field_name,
+            bulk=self.bulk, eager=self.eager, cache=self.cache,
+            stale_field_name=stale_field_name, max_stale=self.max_stale,
+            computed_field_name=computed_field_name, ttl=self.ttl
         )
+        cache = self.cache
+        max_stale = self.max_stale
+        ttl = self.ttl
+        single_flight = self.single_flight
 
         # Also run on initialization of code
-        def wrapped_f(*args, **kwargs):
-            if 'use_dbcache' in kwargs:
-                use_dbcache = kwargs.pop('use_dbcache')
-            else:
-                use_dbcache = True
-
-            instance = args[0]
+        def wrapped_f(instance, *args, **kwargs):
+            use_dbcache = kwargs.pop('use_dbcache', True)
 
             # If `None` is an actual valid value, this causes the decorated
-            # method to always call the original method.
+            # method to always call the original method, unless the validity
+            # is stored separately.
             cached_value = getattr(instance, field_name, None)
-            if not use_dbcache or cached_value is None:
+            if valid_field_name is None:
+                is_cached = cached_value is not None
+            else:
+                is_cached = getattr(instance, valid_field_name, False)
+
+            # A stale value can still be used for a while, see `max_stale`.
+            # An expired value is not used at all, see `ttl`. Neither is the
+            # value that was memoized when it was calculated.
+            stale_since = None if stale_field_name is None else getattr(instance, stale_field_name, None)
+            expired = stale_since is not None and is_cached and timezone.now() - stale_since > max_stale
+            if not expired and ttl is not None and is_cached:
+                expired = is_expired(getattr(instance, computed_field_name, None), ttl)
+            if expired:
+                is_cached = False
+
+            # Keep the path that returns the cached value as short as possible.
+            if use_dbcache and is_cached:
+                if stale_since is not None:
+                    # Recalculate the value in the background, once per
+                    # instance.
+                    scheduled = instance.__dict__.setdefault('_dbcache_stale_scheduled', set())
+                    if field_name not in scheduled and instance.pk:
+                        scheduled.add(field_name)
+                        schedule_refresh(instance.__class__, [instance.pk], [field_name])
+                    if metrics.is_enabled():
+                        metrics.record_stale_hit(instance, field_name)
+                elif metrics.is_enabled():
+                    metrics.record_hit(instance, field_name)
+                logger.debug('%s.%s returned dbcache field ("%s") value: %s', class_path, func_name, field_name,
+                             cached_value)
+                return cached_value
+
+            # Only calls without arguments are memoized, the value may depend
+            # on the arguments otherwise.
+            memoize = not args and not kwargs
+            if memoize and not expired:
+                memo = instance.__dict__.get(MEMO_ATTR)
+                if memo is not None and field_name in memo:
+                    if metrics.is_enabled():
+                        metrics.record_memo_hit(instance, field_name)
+                    return memo[field_name]
+
+            # The lock is only taken if the value is stored right away, other
+            # processes would wait for nothing otherwise.
+            lock = conditions = None
+            if single_flight and use_dbcache and instance.pk and get_write_mode() == WRITE_MODE_IMMEDIATE:
+                # Only store the value if the row is still in the state it
+                # was read in.
+                conditions = {field_name: cached_value}
+                if valid_field_name is not None:
+                    conditions[valid_field_name] = getattr(instance, valid_field_name, False)
+                if stale_field_name is not None:
+                    conditions[stale_field_name] = stale_since
+                if computed_field_name is not None:
+                    conditions[computed_field_name] = getattr(instance, computed_field_name, None)
+
+                # Wait for the process that calculates the value, if any.
+                lock = acquire_lock(instance.__class__, instance.pk, field_name, cache)
+                if lock is None and wait_for_value(instance, entry, get_setting('SINGLE_FLIGHT_WAIT'), cache):
+                    if metrics.is_enabled():
+                        metrics.record_lock_wait(instance, field_name)
+                    return getattr(instance, field_name)
+
+            # Leave storing the value to the process that holds the lock with
+            # `single_flight`.
+            store = lock is not None or conditions is None
+
+            with track('method', instance, func_name), holding(lock):
+                record_metrics = metrics.is_enabled()
+                if record_metrics:
+                    if not is_cached:
+                        metrics.record_miss(instance, field_name)
+                    start = default_timer()
+
                 # Call original method.
-                value = f(*args, **kwargs)
+                value = f(instance, *args, **kwargs)
 
-                logger.debug('{}.{} call returned: {}'.format(
-                    class_path, func_name, value
-                ))
+                if record_metrics:
+                    metrics.record_recompute(instance, field_name, value, default_timer() - start)
+                if cache is not None and instance.pk and store:
+                    store_value(instance.__class__, instance.pk, field_name, cache, value, ttl=ttl)
+                if memoize:
+                    instance.__dict__.setdefault(MEMO_ATTR, {})[field_name] = value
 
+                logger.debug('%s.%s call returned: %s', class_path, func_name, value)
+
+                update_kwargs = {}
                 if value != cached_value:
+                    update_kwargs[field_name] = value
+                if valid_field_name is not None and not getattr(instance, valid_field_name, False):
+                    update_kwargs[valid_field_name] = True
+                if stale_since is not None:
+                    update_kwargs[stale_field_name] = None
+                if computed_field_name is not None:
+                    update_kwargs[computed_field_name] = timezone.now()
+
+                if update_kwargs:
                     # Update database field for next call and to store when saved.
-                    setattr(instance, field_name, value)
-                    logger.debug('{}.{} updated and returned dbcache field ("{}") value: {}'.format(
-                        class_path, func_name, field_name, value
-                    ))
+                    for name, new_value in update_kwargs.items():
+                        setattr(instance, name, new_value)
+                    logger.debug('%s.%s updated and returned dbcache field ("%s") value: %s', class_path, func_name,
+                                 field_name, value)
 
                     # TODO: Not sure if this is the right approach. Saving
                     # when calling a method is not really nice design.
 
                     # Update the database only if the instance already has a PK.
-                    if instance.pk:
-                        logger.debug('{}.{} updated dbcache field ("{}") in the database: {}'.format(
-                            class_path, func_name, field_name, value
-                        ))
+                    if instance.pk and store:
+                        logger.debug('%s.%s updated dbcache field ("%s") in the database: %s', class_path, func_name,
+                                     field_name, value)
                         # WARNING: This causes a database update query when
                         # calling a method that most likely does not imply
-                        # such behaviour (like: Model.get_FOO).
-                        #
-                        # Bypass triggers by using update
-                        instance.__class__.objects.filter(pk=instance.pk).update(**{field_name: value})
-            else:
-                value = cached_value
-                logger.debug('{}.{} returned dbcache field ("{}") value: {}'.format(
-                    class_path, func_name, field_name, value
-                ))
+                        # such behaviour (like: Model.get_FOO), unless the
+                        # write is deferred or disabled by the
+                        # DBCACHE_FIELDS_WRITE_MODE setting.
+                        written = write_values(instance, update_kwargs, conditions)
+                        if record_metrics and written:
+                            metrics.record_write_back(instance, field_name)
 
             return value
         return wrapped_f
@@ -0,0 +1,115 @@
+from __future__ import absolute_import, unicode_literals
+
+import time
+import uuid
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+from .utils import get_model_name, is_cached
+
+# The number of seconds after which a lock is released, if the process that
+# holds it does not release it, for example because it crashed.
+LOCK_TIMEOUT = 30
+
+# The number of seconds to wait between checking whether another process
+# stored the value.
+POLL_INTERVAL = 0.05
+
+
+def get_lock_key(model, pk, field_name):
+    return 'dbcache:{}:{}:{}:lock'.format(get_model_name(model), field_name, pk)
+
+
+def acquire_lock(model, pk, field_name, alias=None):
+    """
+    Acquire the lock to calculate the value of a `dbcache` field for a row,
+    see the `single_flight` argument of `dbcache`. The lock is kept in a
+    Django cache, that should be shared by all processes.
+
+    :param model:
+        The `Model` class.
+    :param pk:
+        The primary key of the row.
+    :param field_name:
+        The field name.
+    :param alias:
+        The alias of the cache, defaults to the `default` cache.
+    :return:
+        A `tuple` to release the lock with, see `release_lock`, or `None` if
+        another process holds the lock.
+    """
+    cache = caches[alias or DEFAULT_CACHE_ALIAS]
+    key = get_lock_key(model, pk, field_name)
+    token = uuid.uuid4().hex
+    if not cache.add(key, token, LOCK_TIMEOUT):
+        return None
+    return cache, key, token
+
+
+def release_lock(lock):
+    """
+    Release a lock that was acquired by `acquire_lock`, unless it expired
+    and was acquired by another process in the meantime.
+    """
+    cache, key, token = lock
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+@contextmanager
+def holding(lock):
+    """
+    Context manager that releases a lock (if any) when it exits.
+    """
+    try:
+        yield
+    finally:
+        if lock is not None:
+            release_lock(lock)
+
+
+def wait_for_value(instance, entry, timeout, alias=None):
+    """
+    Wait for another process to store the value of a `dbcache` field of an
+    instance, while it holds the lock. The fields of the entry are updated on
+    the instance when the value is stored.
+
+    :param instance:
+        The `Model` instance.
+    :param entry:
+        The register entry.
+    :param timeout:
+        The maximum number of seconds to wait.
+    :param alias:
+        The alias of the cache of the lock, defaults to the `default` cache.
+    :return:
+        `True` if the value was stored, `False` if it was not stored before
+        the lock was released or the timeout passed.
+    """
+    field_names = [
+        name for name in (entry.field_name, entry.valid_field_name, entry.stale_field_name, entry.computed_field_name)
+        if name is not None
+    ]
+    queryset = instance.__class__._base_manager.filter(pk=instance.pk)
+    cache = caches[alias or DEFAULT_CACHE_ALIAS]
+    key = get_lock_key(instance.__class__, instance.pk, entry.field_name)
+
+    deadline = default_timer() + timeout
+    while default_timer() < deadline:
+        time.sleep(POLL_INTERVAL)
+        # The lock is checked before the row, a value that is stored before
+        # the lock is released is read then.
+        released = cache.get(key) is None
+        row = queryset.values(*field_names).first()
+        if row is None:
+            return False
+
+        for name, value in row.items():
+            setattr(instance, name, value)
+        if is_cached(instance, entry) and (entry.stale_field_name is None or row[entry.stale_field_name] is None):
+            return True
+        if released:
+            return False
+    return False
@@ -0,0 +1,29 @@
+from __future__ import absolute_import, unicode_literals
+
+import argparse
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from ...profiling import profile
+
+
+class Command(BaseCommand):
+    help = 'Run a management command and report the database queries of the dbcache operations it caused.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('command_name', help='The management command to run.')
+        parser.add_argument(
+            'command_args', nargs=argparse.REMAINDER,
+            help='The arguments of the management command.')
+
+    def handle(self, *args, **options):
+        with profile() as profiler:
+            call_command(
+                options['command_name'], *options['command_args'], stdout=self.stdout, stderr=self.stderr)
+
+        lines = profiler.report()
+        if not lines:
+            self.stdout.write('No queries were executed by dbcache operations.')
+        for line in lines:
+            self.stdout.write(line)
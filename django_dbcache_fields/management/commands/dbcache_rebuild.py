@@ -0,0 +1,164 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from ...refresh import DEFAULT_BATCH_SIZE, refresh_dbcache, refresh_dbcache_parallel, refresh_expired
+from ...utils import get_dbcache_entries, get_model_name, get_uncached_filter
+
+
+class Checkpoint(object):
+    """
+    Keeps track of the last processed primary key per rebuild in a JSON file,
+    so an interrupted rebuild can be resumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, pk):
+        self.data[key] = pk
+        self.save()
+
+    def clear(self, key):
+        self.data.pop(key, None)
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        if not self.data:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        # Write to a temporary file first, so an interruption never leaves a
+        # corrupt checkpoint.
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, default=str)
+        os.rename(tmp_path, self.path)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the cached values of dbcache decorated methods.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels', metavar='app_label.ModelName[.method]', nargs='*',
+            help='Restrict the rebuild to the given models or decorated methods. Defaults to all.')
+        parser.add_argument(
+            '--only-null', action='store_true', dest='only_null', default=False,
+            help='Only rebuild rows where a cached value is missing.')
+        parser.add_argument(
+            '--expired', action='store_true', dest='expired', default=False,
+            help='Only rebuild the expired values of decorated methods with a ttl, in the order they expired. '
+                 'Rebuilt rows are no longer expired, so no checkpoint is needed to resume.')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=DEFAULT_BATCH_SIZE,
+            help='The number of rows to fetch and update per query (default: {}).'.format(DEFAULT_BATCH_SIZE))
+        parser.add_argument(
+            '--workers', type=int, dest='workers', default=1,
+            help='The number of worker processes. Requires integer primary keys if more than 1 (default: 1).')
+        parser.add_argument(
+            '--fail-silently', action='store_true', dest='fail_silently', default=False,
+            help='Skip rows that fail to rebuild instead of aborting.')
+        parser.add_argument(
+            '--checkpoint', dest='checkpoint', default=None,
+            help='A file to store the progress in. An interrupted rebuild resumes from this file.')
+
+    def handle(self, *args, **options):
+        if options['expired'] and options['workers'] > 1:
+            raise CommandError('The --expired option does not support multiple workers.')
+
+        checkpoint = Checkpoint(options['checkpoint'])
+
+        for model, fields in self.get_targets(options['labels']):
+            model_name = get_model_name(model)
+            key = model_name if fields is None else '{}.{}'.format(model_name, ','.join(fields))
+            entries = get_dbcache_entries(model, fields)
+
+            if options['expired']:
+                entries = [entry for entry in entries if entry.ttl is not None]
+                if entries:
+                    self.rebuild_expired(key, model, entries, options)
+                continue
+
+            queryset = model._default_manager.all()
+            if options['only_null']:
+                queryset = queryset.filter(get_uncached_filter(entries))
+
+            last_pk = checkpoint.get(key)
+            if last_pk is not None:
+                self.stdout.write('Resuming "{}" after pk {}.'.format(key, last_pk))
+                queryset = queryset.filter(pk__gt=last_pk)
+
+            kwargs = {
+                'fields': [entry.field_name for entry in entries],
+                'batch_size': options['batch_size'],
+                'callback': lambda result, last_pk: checkpoint.set(key, last_pk),
+                'fail_silently': options['fail_silently'],
+            }
+            if options['workers'] > 1:
+                try:
+                    result = refresh_dbcache_parallel(queryset, workers=options['workers'], **kwargs)
+                except ValueError as e:
+                    raise CommandError(str(e))
+            else:
+                result = refresh_dbcache(queryset, **kwargs)
+            checkpoint.clear(key)
+
+            self.stdout.write(
+                'Rebuilt "{}": {} rows processed, {} updated, {} failed in {:.2f}s ({:.1f} rows/s).'.format(
+                    key, result.processed, result.updated, result.failed, result.duration, result.rate))
+
+    def rebuild_expired(self, key, model, entries, options):
+        """
+        Rebuild the expired values of the given `dbcache` fields with a `ttl`.
+        """
+        result = refresh_expired(
+            model._default_manager.all(), fields=[entry.field_name for entry in entries],
+            batch_size=options['batch_size'], fail_silently=options['fail_silently'])
+
+        self.stdout.write(
+            'Rebuilt expired "{}": {} rows processed, {} updated, {} failed in {:.2f}s ({:.1f} rows/s).'.format(
+                key, result.processed, result.updated, result.failed, result.duration, result.rate))
+
+    def get_targets(self, labels):
+        """
+        Returns a `list` of `tuple` with the `Model` class and the `list` of
+        decorated method names (or `None` for all) to rebuild.
+        """
+        if not labels:
+            return [(model, None) for model in apps.get_models() if get_dbcache_entries(model)]
+
+        targets = []
+        for label in labels:
+            parts = label.split('.')
+            if len(parts) not in (2, 3):
+                raise CommandError('"{}" is not in the form app_label.ModelName[.method].'.format(label))
+
+            try:
+                model = apps.get_model(parts[0], parts[1])
+            except LookupError as e:
+                raise CommandError(str(e))
+
+            fields = parts[2:] or None
+            try:
+                if not get_dbcache_entries(model, fields):
+                    raise CommandError('"{}" has no dbcache decorated methods.'.format(label))
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            targets.append((model, fields))
+        return targets
@@ -0,0 +1,40 @@
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...queues import DatabaseQueue
+
+
+class Command(BaseCommand):
+    help = 'Recalculate invalidated cached values that are stored in the database queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=100,
+            help='The number of queued tasks to process at once (default: 100).')
+        parser.add_argument(
+            '--interval', type=float, dest='interval', default=1.0,
+            help='The number of seconds to wait when the queue is empty (default: 1).')
+        parser.add_argument(
+            '--once', action='store_true', dest='once', default=False,
+            help='Stop when the queue is empty instead of waiting for new tasks.')
+
+    def handle(self, *args, **options):
+        queue = DatabaseQueue()
+
+        processed = 0
+        while True:
+            count = queue.process(batch_size=options['batch_size'])
+            processed += count
+            if count:
+                if options['verbosity'] > 1:
+                    self.stdout.write('Processed {} queued tasks.'.format(count))
+                continue
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write('Processed {} queued tasks in total.'.format(processed))
@@ -0,0 +1,203 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+
+from django.db import models
+from django.db.models.query import ModelIterable
+
+from .receivers import calculate_dbcache_fields, get_batch, process_bulk_changes
+from .utils import calculate_bulk_values, get_dbcache_entries, get_model_name, is_cached, set_cached_value
+from .writeback import write_rows
+
+logger = logging.getLogger(__name__)
+
+
+class DBCacheQuerySetMixin(object):
+    """
+    `QuerySet` mixin that adds `dbcache` specific methods.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DBCacheQuerySetMixin, self).__init__(*args, **kwargs)
+        self._dbcache_entries = []
+
+    def _clone(self, *args, **kwargs):
+        clone = super(DBCacheQuerySetMixin, self)._clone(*args, **kwargs)
+        clone._dbcache_entries = list(self._dbcache_entries)
+        return clone
+
+    def with_dbcache(self, *fields):
+        """
+        Make sure the cached values of the given `dbcache` fields are loaded
+        and valid for all instances when the `QuerySet` is evaluated. Missing
+        values are calculated for all instances at once and stored with a
+        single update query (according to the `DBCACHE_FIELDS_WRITE_MODE`
+        setting).
+
+        :param fields:
+            The decorated method names or field names. If none are given,
+            all `dbcache` fields of the model are used.
+        :return:
+            A new `QuerySet`.
+        """
+        clone = self._clone()
+        for entry in get_dbcache_entries(self.model, fields or None):
+            if entry not in clone._dbcache_entries:
+                clone._dbcache_entries.append(entry)
+        return clone
+
+    def _get_dbcache_field_names(self):
+        """
+        Returns the names of all `dbcache` fields of the model, including
+        validity, staleness and calculation time fields.
+        """
+        field_names = set()
+        for entry in get_dbcache_entries(self.model):
+            field_names.add(entry.field_name)
+            if entry.valid_field_name is not None:
+                field_names.add(entry.valid_field_name)
+            if entry.stale_field_name is not None:
+                field_names.add(entry.stale_field_name)
+            if entry.computed_field_name is not None:
+                field_names.add(entry.computed_field_name)
+        return field_names
+
+    def update(self, **kwargs):
+        """
+        Update all rows like `QuerySet.update` and recalculate their `dbcache`
+        fields. The `dbcache` fields of related models are invalidated, like
+        when the instances are saved.
+        """
+        # Storing or invalidating cached values does not affect anything else.
+        if set(kwargs) <= self._get_dbcache_field_names():
+            return super(DBCacheQuerySetMixin, self).update(**kwargs)
+
+        # All rows are affected, so there is no need to fetch their primary
+        # keys.
+        if not self.query.where:
+            rows = super(DBCacheQuerySetMixin, self).update(**kwargs)
+            process_bulk_changes(self.model, None, all_rows=True)
+            return rows
+
+        # The rows could no longer match the filters after the update.
+        pks = list(self.values_list('pk', flat=True))
+        rows = super(DBCacheQuerySetMixin, self).update(**kwargs)
+        process_bulk_changes(self.model, pks)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create the instances like `QuerySet.bulk_create`, including their
+        `dbcache` fields. Fields that require a primary key are calculated
+        afterwards, if the database returns the primary keys. The `dbcache`
+        fields of related models are invalidated, like when the instances are
+        saved.
+        """
+        objs = list(objs)
+        entries = get_dbcache_entries(self.model)
+
+        # Calculate the fields that don't require a primary key, so they are
+        # stored by the create itself.
+        batch = get_batch()
+        if batch is None:
+            pre_save_entries = [entry for entry in entries if not entry.requires_pk]
+            for obj in objs:
+                calculate_dbcache_fields(obj, pre_save_entries, created=True)
+
+        result = super(DBCacheQuerySetMixin, self).bulk_create(objs, *args, **kwargs)
+
+        pks = [obj.pk for obj in objs]
+        if None in pks:
+            pks = None
+        fields = None if batch is not None else [entry.field_name for entry in entries if entry.requires_pk]
+        process_bulk_changes(self.model, pks, fields=fields)
+        return result
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """
+        Update the instances like `QuerySet.bulk_update` and recalculate
+        their `dbcache` fields. The `dbcache` fields of related models are
+        invalidated, like when the instances are saved.
+        """
+        objs = list(objs)
+        result = super(DBCacheQuerySetMixin, self).bulk_update(objs, fields, *args, **kwargs)
+
+        if not set(fields) <= self._get_dbcache_field_names():
+            process_bulk_changes(self.model, [obj.pk for obj in objs])
+        return result
+
+    def _fetch_all(self):
+        prefetch_dbcache = (
+            self._result_cache is None and self._dbcache_entries and issubclass(self._iterable_class, ModelIterable)
+        )
+        if prefetch_dbcache:
+            self._load_dbcache_fields()
+
+        super(DBCacheQuerySetMixin, self)._fetch_all()
+
+        if prefetch_dbcache:
+            self._prefetch_dbcache_values()
+
+    def _load_dbcache_fields(self):
+        """
+        Undo any `defer` or `only` of the cached fields, to prevent a query
+        per instance when the cached values are accessed.
+        """
+        field_names = set()
+        for entry in self._dbcache_entries:
+            field_names.add(entry.field_name)
+            if entry.valid_field_name is not None:
+                field_names.add(entry.valid_field_name)
+            if entry.stale_field_name is not None:
+                field_names.add(entry.stale_field_name)
+            if entry.computed_field_name is not None:
+                field_names.add(entry.computed_field_name)
+
+        existing, defer = self.query.deferred_loading
+        if defer:
+            self.query.deferred_loading = (frozenset(existing) - field_names, True)
+        elif existing:
+            self.query.deferred_loading = (frozenset(existing) | field_names, False)
+
+    def _prefetch_dbcache_values(self):
+        """
+        Calculate and store the missing cached values of all fetched
+        instances. Methods with a `bulk` implementation are calculated for
+        all instances with a single query.
+        """
+        rows = {}
+        for entry in self._dbcache_entries:
+            missing = [instance for instance in self._result_cache if not is_cached(instance, entry)]
+            if not missing:
+                continue
+
+            if entry.bulk is not None:
+                # Calculate the values of all instances with a single query.
+                bulk_values = calculate_bulk_values(
+                    self.model, entry, [instance.pk for instance in missing], using=self.db)
+                calculated = [(instance, bulk_values[instance.pk]) for instance in missing]
+            else:
+                calculated = [(instance, entry.decorated_method(instance)) for instance in missing]
+
+            for instance, value in calculated:
+                values = set_cached_value(instance, entry, value)
+                if values and instance.pk:
+                    rows.setdefault(instance.pk, {}).update(values)
+
+        if rows:
+            logger.debug('Prefetching dbcache fields updated %s "%s" rows.', len(rows), get_model_name(self.model))
+            write_rows(self.model, rows, using=self.db)
+
+
+class DBCacheQuerySet(DBCacheQuerySetMixin, models.QuerySet):
+    """
+    `QuerySet` with `dbcache` specific methods.
+    """
+    pass
+
+
+class DBCacheManager(models.Manager.from_queryset(DBCacheQuerySet)):
+    """
+    `Manager` with `dbcache` specific `QuerySet` methods.
+    """
+    pass
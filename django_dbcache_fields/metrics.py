@@ -0,0 +1,195 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+from bisect import bisect_left
+
+from django.test.signals import setting_changed
+
+from .conf import get_setting
+from .signals import dbcache_invalidated, dbcache_miss, dbcache_recomputed
+from .utils import get_model_name
+
+# The upper bounds (in seconds) of the buckets of the timing histograms.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_enabled = None
+
+
+class Histogram(object):
+    """
+    Counts observed durations per bucket, see `BUCKETS`.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def as_dict(self):
+        """
+        Returns the histogram as a `dict` with the `count`, the `total`
+        duration and the cumulative `buckets`, where each key is the upper
+        bound of the bucket (or `inf`).
+        """
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.buckets):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {'count': self.count, 'total': self.total, 'buckets': buckets}
+
+
+class MetricsRegistry(object):
+    """
+    In-process registry of counters and timing histograms per `dbcache`
+    field. The following metrics are kept:
+
+    * `hits`: Calls of the decorated method that returned the cached value.
+    * `stale_hits`: Calls of the decorated method that returned a stale cached
+      value, see the `max_stale` argument of `dbcache`.
+    * `lock_waits`: Misses that returned the value calculated by another
+      process, see the `single_flight` argument of `dbcache`.
+    * `memo_hits`: Calls of the decorated method that returned the value
+      memoized on the instance.
+    * `misses`: Calls of the decorated method without a cached value.
+    * `recomputes`: Calculations of the value, on a miss or on a save.
+    * `recompute_duration`: A histogram of the durations of the calculations.
+    * `write_backs`: Calculated values that were stored after a miss.
+    * `dirty_skips`: Saves where the dirty function skipped the calculation.
+    * `invalidated_rows`: Rows where the field was invalidated.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, model_name, field_name, name, value=1):
+        key = (model_name, field_name)
+        with self.lock:
+            counters = self.counters.setdefault(key, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def observe(self, model_name, field_name, name, value):
+        key = (model_name, field_name, name)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def get(self, model_name, field_name):
+        """
+        Returns the metrics of a `dbcache` field.
+
+        :param model_name:
+            The model name in the form `{app label}.{model name}`.
+        :param field_name:
+            The field name.
+        :return:
+            A `dict` of the metric names and their values. Counters are
+            integers and histograms are `dict`, see `Histogram.as_dict`.
+        """
+        return self.snapshot().get((model_name, field_name), {})
+
+    def snapshot(self):
+        """
+        Returns the metrics of all `dbcache` fields.
+
+        :return:
+            A `dict` where each key is a `tuple` of the model name and the
+            field name, and each value is a `dict`, see `get`.
+        """
+        with self.lock:
+            result = {}
+            for key, counters in self.counters.items():
+                result.setdefault(key, {}).update(counters)
+            for (model_name, field_name, name), histogram in self.histograms.items():
+                result.setdefault((model_name, field_name), {})[name] = histogram.as_dict()
+            return result
+
+    def reset(self):
+        """
+        Remove all metrics.
+        """
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+
+registry = MetricsRegistry()
+
+
+def is_enabled():
+    """
+    Returns whether the `DBCACHE_FIELDS_METRICS` setting is enabled. The
+    setting is only read once, to keep the cost of a disabled check low.
+    """
+    global _enabled
+
+    if _enabled is None:
+        _enabled = bool(get_setting('METRICS'))
+    return _enabled
+
+
+def reset_enabled(sender, setting, **kwargs):
+    """
+    Read the `DBCACHE_FIELDS_METRICS` setting again when it's changed, like
+    in tests.
+    """
+    global _enabled
+
+    if setting == 'DBCACHE_FIELDS_METRICS':
+        _enabled = None
+
+
+setting_changed.connect(reset_enabled, dispatch_uid='django_dbcache_fields.metrics.reset_enabled')
+
+
+def record_hit(instance, field_name):
+    registry.increment(get_model_name(instance), field_name, 'hits')
+
+
+def record_stale_hit(instance, field_name):
+    registry.increment(get_model_name(instance), field_name, 'stale_hits')
+
+
+def record_lock_wait(instance, field_name):
+    registry.increment(get_model_name(instance), field_name, 'lock_waits')
+
+
+def record_memo_hit(instance, field_name):
+    registry.increment(get_model_name(instance), field_name, 'memo_hits')
+
+
+def record_miss(instance, field_name):
+    registry.increment(get_model_name(instance), field_name, 'misses')
+    dbcache_miss.send(sender=instance.__class__, instance=instance, field_name=field_name)
+
+
+def record_recompute(instance, field_name, value, duration):
+    model_name = get_model_name(instance)
+    registry.increment(model_name, field_name, 'recomputes')
+    registry.observe(model_name, field_name, 'recompute_duration', duration)
+    dbcache_recomputed.send(
+        sender=instance.__class__, instance=instance, field_name=field_name, value=value, duration=duration)
+
+
+def record_write_back(instance, field_name):
+    registry.increment(get_model_name(instance), field_name, 'write_backs')
+
+
+def record_dirty_skip(instance, field_name):
+    registry.increment(get_model_name(instance), field_name, 'dirty_skips')
+
+
+def record_invalidation(model, field_names, rows):
+    model_name = get_model_name(model)
+    for field_name in field_names:
+        registry.increment(model_name, field_name, 'invalidated_rows', rows)
+    dbcache_invalidated.send(sender=model, field_names=field_names, rows=rows)
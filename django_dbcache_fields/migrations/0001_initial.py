@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_path', models.CharField(max_length=255, verbose_name='class path')),
+                ('object_pk', models.CharField(blank=True, help_text='Empty to recalculate all rows.', max_length=255, null=True, verbose_name='object primary key')),
+                ('field_names', models.TextField(verbose_name='field names')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+            ],
+            options={
+                'verbose_name': 'refresh task',
+                'verbose_name_plural': 'refresh tasks',
+            },
+        ),
+    ]
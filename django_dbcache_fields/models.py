@@ -0,0 +1,26 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+
+@python_2_unicode_compatible
+class RefreshTask(models.Model):
+    """
+    A pending recalculation of invalidated `dbcache` fields, stored by the
+    `DatabaseQueue` and processed by the `dbcache_worker` management command.
+    """
+    class_path = models.CharField(_('class path'), max_length=255)
+    object_pk = models.CharField(
+        _('object primary key'), max_length=255, blank=True, null=True,
+        help_text=_('Empty to recalculate all rows.'))
+    field_names = models.TextField(_('field names'))
+    created = models.DateTimeField(_('created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('refresh task')
+        verbose_name_plural = _('refresh tasks')
+
+    def __str__(self):
+        return '{} (pk={}): {}'.format(self.class_path, self.object_pk, self.field_names)
@@ -0,0 +1,176 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from .utils import get_model_name
+
+
+class ProfilingState(threading.local):
+    # A class attribute avoids a failing attribute lookup when profiling is
+    # not active.
+    profiler = None
+
+
+_local = ProfilingState()
+
+
+class Profiler(object):
+    """
+    Attributes the database queries that are executed while profiling to the
+    innermost tracked `dbcache` operation, see `track`. Installed as
+    execute wrapper on the database connections by `profile`.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.stack = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not self.stack:
+            return execute(sql, params, many, context)
+
+        stats = self.stats[self.stack[-1]]
+        start = default_timer()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats['queries'] += 1
+            stats['time'] += default_timer() - start
+
+    @contextmanager
+    def track(self, kind, label):
+        key = (kind, label)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = {'calls': 0, 'queries': 0, 'time': 0.0}
+        stats['calls'] += 1
+
+        self.stack.append(key)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+
+    def get(self, kind, label):
+        """
+        Returns the statistics of a tracked operation.
+
+        :param kind:
+            The kind of operation: `method` for calculating a `dbcache` field
+            (by calling the decorated method or on save), `save` for storing
+            the fields after a save, `invalidation` for the invalidations by
+            a save, delete or relation change, and `bulk` for bulk changes.
+        :param label:
+            The model name in the form `{app label}.{model name}` and, for
+            methods, the method name (like `myapp.Pizza.get_price`).
+        :return:
+            A `dict` with the number of `calls`, the number of `queries` and
+            the `time` spent on the queries in seconds.
+        """
+        return self.stats.get((kind, label), {'calls': 0, 'queries': 0, 'time': 0.0})
+
+    def report(self):
+        """
+        Returns a report of all tracked operations, most time consuming
+        first.
+
+        :return:
+            A `list` of lines.
+        """
+        lines = []
+        for (kind, label), stats in sorted(self.stats.items(), key=lambda item: (-item[1]['time'], item[0])):
+            lines.append('{:<12} {:<40} calls={:<6} queries={:<6} time={:.2f}ms'.format(
+                kind, label, stats['calls'], stats['queries'], stats['time'] * 1000))
+        return lines
+
+
+def get_profiler():
+    """
+    Returns the active `Profiler` of the current thread, if any.
+    """
+    return _local.profiler
+
+
+@contextmanager
+def profile():
+    """
+    Context manager that profiles the database queries of `dbcache`
+    operations in the current thread.
+
+    :return:
+        The `Profiler` instance, to get the statistics from when the context
+        manager exits.
+    """
+    profiler = Profiler()
+    wrapped = []
+    for connection in connections.all():
+        if not hasattr(connection, 'execute_wrappers'):
+            raise ImproperlyConfigured('Profiling dbcache operations requires Django 2.0 or later.')
+        wrapped.append(connection)
+
+    parent = get_profiler()
+    _local.profiler = profiler
+    for connection in wrapped:
+        connection.execute_wrappers.append(profiler)
+    try:
+        yield profiler
+    finally:
+        for connection in wrapped:
+            connection.execute_wrappers.remove(profiler)
+        _local.profiler = parent
+
+
+class NoopContext(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NOOP = NoopContext()
+
+
+def track(kind, model, name=None):
+    """
+    Returns a context manager that attributes the queries within to a
+    `dbcache` operation, if profiling is active.
+
+    :param kind:
+        The kind of operation, see `Profiler.get`.
+    :param model:
+        The `Model` class or instance.
+    :param name:
+        The method name, if any.
+    :return:
+        A context manager.
+    """
+    profiler = _local.profiler
+    if profiler is None:
+        return NOOP
+
+    label = get_model_name(model)
+    if name is not None:
+        label = '{}.{}'.format(label, name)
+    return profiler.track(kind, label)
+
+
+def profiled(kind):
+    """
+    Decorator for receivers (or other functions that get the model as first
+    argument) that attributes their queries to an operation of the given
+    kind, see `track`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(sender, *args, **kwargs):
+            with track(kind, sender):
+                return func(sender, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,311 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+from timeit import default_timer
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, router, transaction
+from django.utils.module_loading import import_string
+from django.utils.six import string_types
+
+from .conf import get_setting
+from .refresh import refresh_dbcache
+from .utils import get_class_path, get_dbcache_entries, get_transaction_buffer, get_uncached_filter
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_queue = None
+
+
+class TaskSet(object):
+    """
+    Collects recalculations of `dbcache` fields. Recalculations of the same
+    fields on the same model are coalesced into a single task.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, class_path, pks, field_names):
+        """
+        Add a recalculation.
+
+        :param class_path:
+            The `Model` class path.
+        :param pks:
+            The primary keys of the rows to recalculate, or `None` for all
+            rows.
+        :param field_names:
+            The field names to recalculate.
+        """
+        key = (class_path, frozenset(field_names))
+        if key in self.tasks and self.tasks[key] is None:
+            return
+        if pks is None:
+            self.tasks[key] = None
+        else:
+            self.tasks.setdefault(key, set()).update(pks)
+
+    def pop(self):
+        """
+        Remove and return a task.
+
+        :return:
+            A `tuple` of the class path, the `list` of primary keys (or `None`
+            for all rows) and the `list` of field names.
+        """
+        (class_path, field_names), pks = self.tasks.popitem()
+        return class_path, None if pks is None else sorted(pks), sorted(field_names)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def flush(self):
+        """
+        Enqueue all collected tasks in the configured queue.
+        """
+        queue = get_queue()
+        while self.tasks:
+            task = self.pop()
+            if queue is not None:
+                queue.enqueue(*task)
+
+
+def refresh_task(class_path, pks, field_names):
+    """
+    Recalculate the `dbcache` fields of a queued task. Rows that already have
+    a (valid) cached value again, for example because the decorated method
+    was called in the meantime, are skipped.
+
+    :param class_path:
+        The `Model` class path.
+    :param pks:
+        The primary keys of the rows to recalculate, or `None` for all rows.
+    :param field_names:
+        The field names to recalculate.
+    :return:
+        A `RefreshResult` instance.
+    """
+    model = import_string(class_path)
+    entries = get_dbcache_entries(model, field_names)
+
+    queryset = model._default_manager.filter(get_uncached_filter(entries))
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return refresh_dbcache(queryset, fields=field_names, fail_silently=True)
+
+
+class BaseQueue(object):
+    """
+    Base class for queues that recalculate invalidated `dbcache` fields in
+    the background.
+    """
+
+    def enqueue(self, class_path, pks, field_names):
+        """
+        Schedule the recalculation of `dbcache` fields. Called when the
+        transaction that invalidated the fields is committed.
+
+        :param class_path:
+            The `Model` class path.
+        :param pks:
+            A `list` of primary keys of the rows to recalculate, or `None`
+            for all rows.
+        :param field_names:
+            A `list` of field names to recalculate.
+        """
+        raise NotImplementedError
+
+
+class CallableQueue(BaseQueue):
+    """
+    Queue that passes each task to a function, for example to hand it over
+    to a task queue like Celery. The function should eventually call
+    `refresh_task` with the same arguments.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def enqueue(self, class_path, pks, field_names):
+        self.func(class_path, pks, field_names)
+
+
+class ThreadQueue(BaseQueue):
+    """
+    Queue that recalculates `dbcache` fields in background threads of the
+    current process. Tasks that are waiting to be processed are coalesced.
+    Pending tasks are lost when the process exits.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.tasks = TaskSet()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.active = 0
+
+    def enqueue(self, class_path, pks, field_names):
+        with self.condition:
+            self.tasks.add(class_path, pks, field_names)
+            self.start()
+            self.condition.notify()
+
+    def start(self):
+        """
+        Start the worker threads, if they are not running.
+        """
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.run, name='dbcache-queue-{}'.format(len(self.threads)))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.tasks:
+                    self.condition.wait()
+                task = self.tasks.pop()
+                self.active += 1
+
+            try:
+                refresh_task(*task)
+            except Exception:
+                logger.exception('Failed to refresh "%s" (pks=%s): %s.', *task)
+            finally:
+                # Each thread has its own database connection.
+                connection.close()
+                with self.condition:
+                    self.active -= 1
+                    self.condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Wait until all tasks are processed.
+
+        :param timeout:
+            The maximum number of seconds to wait.
+        :return:
+            `True` if all tasks are processed, `False` on timeout.
+        """
+        end = None if timeout is None else default_timer() + timeout
+        with self.condition:
+            while self.tasks or self.active:
+                remaining = None if end is None else end - default_timer()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+
+class DatabaseQueue(BaseQueue):
+    """
+    Queue that stores tasks in the database, to be processed by the
+    `dbcache_worker` management command. Tasks for the same fields on the
+    same model are coalesced when they are processed.
+    """
+
+    def enqueue(self, class_path, pks, field_names):
+        from .models import RefreshTask
+
+        field_names = ','.join(field_names)
+        if pks is None:
+            tasks = [RefreshTask(class_path=class_path, field_names=field_names)]
+        else:
+            tasks = [RefreshTask(class_path=class_path, object_pk=pk, field_names=field_names) for pk in pks]
+        RefreshTask.objects.bulk_create(tasks)
+
+    def process(self, batch_size=100):
+        """
+        Process a batch of stored tasks. Tasks that are processed by another
+        worker at the same time are skipped, if the database supports it.
+
+        :param batch_size:
+            The maximum number of stored tasks to process.
+        :return:
+            The number of stored tasks processed.
+        """
+        from .models import RefreshTask
+
+        using = router.db_for_write(RefreshTask)
+        with transaction.atomic(using=using):
+            skip_locked = connections[using].features.has_select_for_update_skip_locked
+            queryset = RefreshTask.objects.using(using).select_for_update(skip_locked=skip_locked)
+            tasks = list(queryset.order_by('pk')[:batch_size])
+
+            task_set = TaskSet()
+            for task in tasks:
+                pks = None
+                if task.object_pk is not None:
+                    pks = [import_string(task.class_path)._meta.pk.to_python(task.object_pk)]
+                task_set.add(task.class_path, pks, task.field_names.split(','))
+
+            while task_set:
+                task = task_set.pop()
+                try:
+                    # A savepoint, so a database error doesn't abort the
+                    # transaction and the processed tasks are still removed.
+                    with transaction.atomic(using=using):
+                        refresh_task(*task)
+                except Exception:
+                    logger.exception('Failed to refresh "%s" (pks=%s): %s.', *task)
+
+            RefreshTask.objects.using(using).filter(pk__in=[task.pk for task in tasks]).delete()
+        return len(tasks)
+
+
+def get_queue():
+    """
+    Returns the queue configured by the `DBCACHE_FIELDS_QUEUE` setting.
+
+    :return:
+        A `BaseQueue` instance or `None` if no queue is configured.
+    """
+    global _queue
+
+    setting = get_setting('QUEUE')
+    if setting is None:
+        return None
+    if _queue is not None and _queue[0] == setting:
+        return _queue[1]
+
+    backend = import_string(setting) if isinstance(setting, string_types) else setting
+    if isinstance(backend, type) and issubclass(backend, BaseQueue):
+        queue = backend(**get_setting('QUEUE_OPTIONS'))
+    elif callable(backend):
+        queue = CallableQueue(backend)
+    else:
+        raise ImproperlyConfigured(
+            'The DBCACHE_FIELDS_QUEUE setting should refer to a queue class or a callable.')
+
+    _queue = (setting, queue)
+    return queue
+
+
+def schedule_refresh(model, pks, field_names):
+    """
+    Schedule the recalculation of `dbcache` fields in the configured queue,
+    if any. Inside a transaction, the recalculations are coalesced and
+    enqueued when the transaction is committed.
+
+    :param model:
+        The `Model` class.
+    :param pks:
+        The primary keys of the rows to recalculate, or `None` for all rows.
+    :param field_names:
+        The field names to recalculate.
+    """
+    queue = get_queue()
+    if queue is None:
+        return
+
+    using = router.db_for_write(model)
+    if connections[using].in_atomic_block:
+        task_set = get_transaction_buffer(_local, 'transaction_tasks', using, TaskSet)
+        task_set.add(get_class_path(model), pks, field_names)
+    else:
+        queue.enqueue(get_class_path(model), None if pks is None else list(pks), sorted(field_names))
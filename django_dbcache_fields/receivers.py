@@ -1,58 +1,200 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
+import threading
+from timeit import default_timer
 
-from django.db.models.signals import post_save
-from django.utils.module_loading import import_string
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import BooleanField, DateTimeField, Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.utils import timezone
 
-from . import register
-from .utils import get_class_path, get_model_name
+from . import metrics, register
+from .cache import purge_values, store_value
+from .conf import get_setting
+from .profiling import profiled, track
+from .queues import get_queue, schedule_refresh
+from .refresh import DEFAULT_BATCH_SIZE, refresh_dbcache, refresh_dbcache_pks
+from .utils import clear_memo, clears_memo, get_class_path, get_model_name, get_transaction_buffer
+from .writeback import discard_writes
 
 logger = logging.getLogger(__name__)
 
 
-def update_dbcache_fields(sender, instance, **kwargs):
+class ReceiverState(threading.local):
+    # A class attribute avoids a failing attribute lookup on every save when
+    # no batch is active.
+    batch = None
+
+
+_local = ReceiverState()
+
+# The descriptions of the `m2m_changed` actions to log.
+ACTIONS = {
+    'pre_clear': 'Clearing',
+    'post_add': 'Adding',
+    'post_remove': 'Removing',
+    'post_clear': 'Clearing',
+}
+
+
+def calculate_dbcache_fields(instance, entries, created=False):
     """
-    Update all model fields that are used by dbcache methods by calling their
-    original function if flagged as dirty (or no dirty function available).
+    Calculate the values of the given dbcache fields by calling their
+    original function if flagged as dirty (or no dirty function available)
+    and set them on the instance.
+
+    :param instance:
+        The `Model` instance.
+    :param entries:
+        The `list` of register entries to calculate.
+    :param created:
+        Whether the instance is (being) created. A created instance is
+        always considered dirty.
+    :return:
+        A `dict` of the field names and values that changed, including
+        validity fields.
     """
-    instance_class_path = get_class_path(instance)
-    instance_model_name = get_model_name(instance)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    record_metrics = metrics.is_enabled()
+    if debug:
+        instance_model_name = register.get_plan(instance.__class__).model_name
 
     update_kwargs = {}
-    for entry in register.get(instance_class_path):
-        field_name = entry['field_name']
-        func = entry['decorated_method']
-        dirty_func = entry['dirty_func']
+    for entry in entries:
+        field_name = entry.field_name
+        func = entry.decorated_method
+        dirty_func = entry.dirty_func
 
         # Evaluate dirty function, if present. If an object was just created,
         # always assume it's dirty.
-        if dirty_func is not None and not kwargs.get('created', False):
+        if dirty_func is not None and not created:
             is_dirty = dirty_func(instance, field_name)
             if not is_dirty:
-                logger.debug('{}.{} is not marked as dirty.'.format(instance_model_name, field_name))
+                if record_metrics:
+                    metrics.record_dirty_skip(instance, field_name)
+                if debug:
+                    logger.debug('%s.%s is not marked as dirty.', instance_model_name, field_name)
                 continue
-            else:
-                logger.debug('{}.{} is marked as dirty.'.format(instance_model_name, field_name))
+            elif debug:
+                logger.debug('%s.%s is marked as dirty.', instance_model_name, field_name)
 
         old_value = getattr(instance, field_name)
 
         # Update dbcache decorated method field.
         # TODO: Why does this actually not call/use the decorator?
-        value = func(instance)
+        with track('method', instance, func.__name__):
+            if record_metrics:
+                start = default_timer()
+                value = func(instance)
+                metrics.record_recompute(instance, field_name, value, default_timer() - start)
+            else:
+                value = func(instance)
+        if entry.cache is not None and instance.pk:
+            store_value(instance.__class__, instance.pk, field_name, entry.cache, value, ttl=entry.ttl)
 
         if old_value != value:
             setattr(instance, field_name, value)
             update_kwargs[field_name] = value
-            logger.debug('{}.{} updated from "{}" to "{}".'.format(instance_model_name, field_name, old_value, value))
-        else:
-            logger.debug('{}.{} did not change.'.format(instance_model_name, field_name))
+            if debug:
+                logger.debug('%s.%s updated from "%s" to "%s".', instance_model_name, field_name, old_value, value)
+        elif debug:
+            logger.debug('%s.%s did not change.', instance_model_name, field_name)
+
+        # The value is valid now, even if it's `None`.
+        valid_field_name = entry.valid_field_name
+        if valid_field_name is not None and not getattr(instance, valid_field_name):
+            setattr(instance, valid_field_name, True)
+            update_kwargs[valid_field_name] = True
+
+        # The value is no longer stale.
+        stale_field_name = entry.stale_field_name
+        if stale_field_name is not None and getattr(instance, stale_field_name) is not None:
+            setattr(instance, stale_field_name, None)
+            update_kwargs[stale_field_name] = None
+
+        # The value can be used for the `ttl` from now on.
+        computed_field_name = entry.computed_field_name
+        if computed_field_name is not None:
+            computed_at = timezone.now()
+            setattr(instance, computed_field_name, computed_at)
+            update_kwargs[computed_field_name] = computed_at
+
+    return update_kwargs
+
+
+def is_pre_save_entry(entry, update_fields=None):
+    """
+    Returns whether a dbcache field can be calculated before the instance is
+    saved, so it's stored by the save itself.
+
+    :param entry:
+        The register entry.
+    :param update_fields:
+        The `update_fields` passed to `Model.save`, if any.
+    :return:
+        `True` if the field can be calculated before the save.
+    """
+    return not entry.requires_pk and (update_fields is None or entry.field_name in update_fields)
+
+
+def discard_instance_writes(instance):
+    """
+    Remove the deferred writes of an instance that is saved, since they were
+    calculated from the values before the save.
+    """
+    if instance.pk is not None:
+        model = instance.__class__
+        discard_writes(model._base_manager.all(), register.get_plan(model).entries, [instance.pk])
+
+
+def prepare_dbcache_fields(sender, instance, update_fields=None, **kwargs):
+    """
+    Update the model fields that are used by dbcache methods before the
+    instance is saved, if the `DBCACHE_FIELDS_PRE_SAVE` setting is enabled.
+    Fields that require a primary key are left to `update_dbcache_fields`.
+    """
+    discard_instance_writes(instance)
+    if not get_setting('PRE_SAVE') or get_batch() is not None:
+        return
+
+    entries = register.get_plan(instance.__class__).pre_save_entries
+    if update_fields is not None:
+        entries = [entry for entry in entries if entry.field_name in update_fields]
+    if entries:
+        calculate_dbcache_fields(instance, entries, created=instance._state.adding)
+
+
+@profiled('save')
+def update_dbcache_fields(sender, instance, **kwargs):
+    """
+    Update all model fields that are used by dbcache methods by calling their
+    original function if flagged as dirty (or no dirty function available).
+    """
+    # Memoized values and deferred writes are outdated once the instance is
+    # saved.
+    clear_memo(instance)
+    discard_instance_writes(instance)
+
+    batch = get_batch()
+    if batch is not None:
+        batch.add_saved(instance.__class__, [instance.pk])
+        return
+
+    plan = register.get_plan(instance.__class__)
+
+    entries = plan.entries
+    # Fields that were calculated before the save are already stored.
+    if get_setting('PRE_SAVE'):
+        entries = [entry for entry in entries if not is_pre_save_entry(entry, kwargs.get('update_fields'))]
+
+    update_kwargs = calculate_dbcache_fields(instance, entries, created=kwargs.get('created', False))
 
     # If there is something to update, update it in the database.
     if update_kwargs:
-        logger.debug('Updating "{}" (pk={}): {}'.format(
-            instance_model_name, instance.pk, ', '.join(['{}={}'.format(f, v) for f, v in update_kwargs.items()])
-        ))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Updating "%s" (pk=%s): %s', plan.model_name, instance.pk, ', '.join(
+                ['{}={}'.format(f, v) for f, v in update_kwargs.items()]))
 
         instance.__class__.objects.filter(pk=instance.pk).update(**update_kwargs)
 
@@ -60,7 +202,8 @@ def update_dbcache_fields(sender, instance, **kwargs):
 def update_models(sender, **kwargs):
     """
     Update the models that have dbcache methods with the proper model fields.
-    Also connect the pre-save hook to update fields when needed.
+    Also connect the pre-save and post-save hooks to update fields when
+    needed.
     """
     # The sender is the model that was just prepared.
     sender_class_path = get_class_path(sender)
@@ -69,15 +212,24 @@ def update_models(sender, **kwargs):
     if sender_class_path not in register:
         return
 
-    # Connect the model to a post-save hook to update the fields after the
-    # model is saved.
+    # Connect the model to a pre-save and post-save hook to update the fields
+    # before or after the model is saved.
+    pre_save.connect(prepare_dbcache_fields, sender=sender)
     post_save.connect(update_dbcache_fields, sender=sender)
 
+    # Memoized values are outdated once the instance is reloaded.
+    sender.refresh_from_db = clears_memo(sender.refresh_from_db)
+
+    entries = register.get(sender_class_path)
+    # Remove the values of deleted instances from the second cache tier.
+    if any(entry.cache is not None for entry in entries):
+        post_delete.connect(purge_dbcache_values, sender=sender)
+
     # Update the model definition.
     field_names = []
-    for entry in register.get(sender_class_path):
-        field = entry['field']
-        field_name = entry['field_name']
+    for entry in entries:
+        field = entry.field
+        field_name = entry.field_name
 
         # If the field is `None`, the field should already be present on the model.
         if field is not None:
@@ -85,58 +237,495 @@ def update_models(sender, **kwargs):
             field.contribute_to_class(sender, field_name)
             field_names.append(field_name)
 
-    logger.debug('{} model was updated with dbcache decorated fields: {}.'.format(
-        sender_model_name, ', '.join(field_names)))
+        # Store whether the cached value is valid, if `None` is a valid value.
+        valid_field_name = entry.valid_field_name
+        if valid_field_name is not None:
+            BooleanField(default=False, editable=False).contribute_to_class(sender, valid_field_name)
+            field_names.append(valid_field_name)
+
+        # Store since when the cached value is stale, if it can still be used.
+        stale_field_name = entry.stale_field_name
+        if stale_field_name is not None:
+            DateTimeField(blank=True, null=True, editable=False).contribute_to_class(sender, stale_field_name)
+            field_names.append(stale_field_name)
+
+        # Store when the value was calculated, if it expires. The index keeps
+        # finding the expired rows cheap, see `refresh_expired`.
+        computed_field_name = entry.computed_field_name
+        if computed_field_name is not None:
+            DateTimeField(blank=True, null=True, editable=False, db_index=True).contribute_to_class(
+                sender, computed_field_name)
+            field_names.append(computed_field_name)
+
+    logger.debug('%s model was updated with dbcache decorated fields: %s.', sender_model_name, ', '.join(field_names))
+
+
+def purge_dbcache_values(sender, instance, **kwargs):
+    """
+    Remove the values of a deleted instance from the second cache tier.
+    """
+    purge_values(instance.__class__, register.get_plan(instance.__class__).entries, [instance.pk])
+
+
+def get_affected_pks(queryset):
+    """
+    Returns the primary keys of the rows in a `QuerySet` of affected rows.
+
+    :param queryset:
+        The `QuerySet` of affected rows.
+    :return:
+        A `list` of primary keys or `None` if all rows are affected.
+    """
+    if not queryset.query.where:
+        return None
+    return list(queryset.values_list('pk', flat=True))
+
+
+def defer_eager_refresh(instance, queryset, update_kwargs):
+    """
+    Store the recalculation of eager fields to perform after the instance is
+    deleted or its relations are cleared, see `refresh_eager_dbcache_fields`.
+    Recalculating before would still include the instance.
+
+    :param instance:
+        The `Model` instance that is deleted or of which the relations are
+        cleared.
+    :param queryset:
+        The `QuerySet` of affected rows. The rows are determined right away,
+        since they can no longer be found by their relation afterwards.
+    :param update_kwargs:
+        The update query arguments that recalculate the eager fields.
+    """
+    pks = get_affected_pks(queryset)
+    if pks is not None:
+        queryset = queryset.model.objects.filter(pk__in=pks)
+    instance.__dict__.setdefault('_dbcache_eager_refreshes', []).append((queryset, update_kwargs))
+
+
+def refresh_eager_dbcache_fields(sender, instance, **kwargs):
+    """
+    Recalculate the eager fields that were affected by the deletion of an
+    instance or by clearing its relations.
+    """
+    for queryset, update_kwargs in instance.__dict__.pop('_dbcache_eager_refreshes', []):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Refreshing "%s" for fields: %s', get_model_name(queryset.model), ', '.join(update_kwargs))
+        queryset.update(**update_kwargs)
+
+
+def invalidate_queryset(instance, queryset, class_path, field_names, deferred=False):
+    """
+    Invalidate the given fields on all rows in the `QuerySet`. Eager fields
+    are recalculated instead.
+
+    :param instance:
+        The changed `Model` instance.
+    :param queryset:
+        The `QuerySet` of affected rows.
+    :param class_path:
+        The affected `Model` class path.
+    :param field_names:
+        The affected field names.
+    :param deferred:
+        Whether eager fields should be recalculated after the instance is
+        deleted or its relations are cleared.
+    """
+    update_kwargs = register.get_invalidation_kwargs(class_path, field_names, eager=not deferred)
+    entries = [entry for entry in register.get(class_path) if entry.field_name in field_names]
+
+    # Deferred writes of the old values would undo the invalidation.
+    discard_writes(queryset, entries)
+
+    # Remove the cached values from the second cache tier, if any.
+    cached_entries = [entry for entry in entries if entry.cache is not None]
+    if cached_entries:
+        purge_values(queryset.model, cached_entries, get_affected_pks(queryset))
+    if deferred:
+        eager_kwargs = register.get_eager_kwargs(class_path, field_names)
+        if eager_kwargs:
+            defer_eager_refresh(instance, queryset, eager_kwargs)
+
+    if update_kwargs:
+        rows = queryset.update(**update_kwargs)
+        if metrics.is_enabled():
+            metrics.record_invalidation(queryset.model, field_names, rows)
+
+    # Recalculate the invalidated fields in the background, if a queue is
+    # configured. Eager fields are already recalculated.
+    if get_queue() is not None:
+        field_names = [
+            entry.field_name for entry in register.get(class_path)
+            if entry.field_name in field_names and not entry.eager
+        ]
+        if field_names:
+            schedule_refresh(queryset.model, get_affected_pks(queryset), field_names)
 
 
+class InvalidationBuffer(object):
+    """
+    Collects the invalidations within a transaction, to perform them with a
+    single update query per model and set of fields.
+    """
+
+    def __init__(self):
+        self.invalidations = {}
+
+    def add(self, class_path, field_names, lookup=None, values=None):
+        key = (class_path, frozenset(field_names))
+        if key in self.invalidations and self.invalidations[key] is None:
+            return
+        if lookup is None:
+            self.invalidations[key] = None
+        else:
+            self.invalidations.setdefault(key, {}).setdefault(lookup, set()).update(values)
+
+    def __len__(self):
+        return len(self.invalidations)
+
+    def flush(self):
+        """
+        Perform all collected invalidations.
+        """
+        invalidations, self.invalidations = self.invalidations, {}
+        for (class_path, field_names), lookups in invalidations.items():
+            queryset = register.get_model(class_path).objects.all()
+            if lookups is not None:
+                q = Q()
+                for lookup, values in lookups.items():
+                    q |= Q(**{'{}__in'.format(lookup): values})
+                queryset = queryset.filter(q)
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Performing the collected invalidations of "%s" for fields: %s', class_path,
+                             ', '.join(field_names))
+            invalidate_queryset(None, queryset, class_path, field_names)
+
+
+class Batch(object):
+    """
+    Context manager that suspends the `dbcache` receivers in the current
+    thread. The saved instances and the invalidations are collected and, if
+    `replay` is `True`, processed in bulk when the context manager exits
+    without an exception. Use `dbcache.batch` or `dbcache.suspended`.
+    """
+
+    def __init__(self, replay=True, batch_size=DEFAULT_BATCH_SIZE):
+        self.replay = replay
+        self.batch_size = batch_size
+        self.saved = {}
+        self.invalidations = InvalidationBuffer()
+        self.parent = None
+
+    def add_saved(self, model, pks):
+        """
+        Collect saved rows to recalculate, `None` for all rows of the model.
+        """
+        if not self.replay:
+            return
+        class_path = register.get_plan(model).class_path
+        if pks is None:
+            self.saved[class_path] = None
+        elif self.saved.get(class_path, ()) is not None:
+            self.saved.setdefault(class_path, set()).update(pks)
+
+    def __enter__(self):
+        self.parent = get_batch()
+        _local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.batch = self.parent
+        if not self.replay:
+            return
+
+        if exc_type is None:
+            self.flush()
+        elif connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # The saves are discarded if the transaction is rolled back.
+            transaction.on_commit(self.flush)
+        else:
+            # The saves before the exception are stored already.
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to process the dbcache batch after an exception.')
+
+    def flush(self):
+        """
+        Perform all collected invalidations and recalculate the `dbcache`
+        fields of all saved instances.
+        """
+        self.invalidations.flush()
+
+        saved, self.saved = self.saved, {}
+        for class_path, pks in saved.items():
+            model = register.get_model(class_path)
+            if pks is None:
+                logger.debug('Recalculating the dbcache fields of all "%s" rows.', get_model_name(model))
+                refresh_dbcache(model._base_manager.all(), batch_size=self.batch_size)
+                continue
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Recalculating the dbcache fields of %s saved "%s" rows.', len(pks),
+                             get_model_name(model))
+            refresh_dbcache_pks(model, pks, batch_size=self.batch_size)
+
+
+def get_batch():
+    """
+    Returns the active `Batch` of the current thread, if any.
+    """
+    return _local.batch
+
+
+def invalidate_rows(instance, model, class_path, field_names, lookup=None, values=None, deferred=False):
+    """
+    Invalidate the given fields on the affected rows of a model. Eager fields
+    are recalculated instead.
+
+    If the `DBCACHE_FIELDS_COALESCE_INVALIDATIONS` setting is enabled, the
+    invalidations within a transaction are collected and performed when the
+    transaction is committed. Within a `Batch`, the invalidations are
+    collected and performed when the batch ends.
+
+    :param instance:
+        The changed `Model` instance.
+    :param model:
+        The affected `Model` class.
+    :param class_path:
+        The affected `Model` class path.
+    :param field_names:
+        The affected field names.
+    :param lookup:
+        The lookup to find the affected rows with, or `None` if all rows are
+        affected.
+    :param values:
+        The values of the lookup.
+    :param deferred:
+        Whether the instance is deleted or its relations are cleared, so the
+        rows can no longer be found by the lookup afterwards.
+    """
+    queryset = model.objects.all()
+    if lookup is not None:
+        queryset = queryset.filter(**{'{}__in'.format(lookup): values})
+
+    batch = get_batch()
+    using = router.db_for_write(model)
+    if batch is not None:
+        if not batch.replay:
+            return
+        buffer = batch.invalidations
+    elif get_setting('COALESCE_INVALIDATIONS') and connections[using].in_atomic_block:
+        buffer = get_transaction_buffer(_local, 'invalidation_buffers', using, InvalidationBuffer)
+    else:
+        buffer = None
+
+    if buffer is not None:
+        # The affected rows can no longer be found by the lookup later on.
+        if deferred and lookup not in (None, 'pk'):
+            lookup, values = 'pk', get_affected_pks(queryset)
+        buffer.add(class_path, field_names, lookup, values)
+        return
+
+    invalidate_queryset(instance, queryset, class_path, field_names, deferred=deferred)
+
+
+@profiled('invalidation')
+def remember_foreign_keys(sender, instance, **kwargs):
+    """
+    Remember the values of the foreign keys of an instance when it is
+    initialized, so the rows that referenced the instance through the old
+    value are invalidated as well when it is saved, see
+    `invalidate_dbcache_fields_by_fks`. Deferred foreign keys are not
+    remembered.
+    """
+    instance.__dict__['_dbcache_foreign_keys'] = {
+        attname: instance.__dict__[attname]
+        for _, _, _, attname, _ in register.get_plan(instance.__class__).moved_dependents
+        if attname in instance.__dict__
+    }
+
+
+@profiled('invalidation')
 def invalidate_dbcache_fields_by_fks(sender, instance, **kwargs):
     """
-    Empty all fields that are invalidated by the save of a related model as
-    indicated in the dbcache decorator `invalidated_by` argument.
+    Empty all fields that are invalidated by the save or delete of a related
+    model as indicated in the dbcache decorator `invalidated_by` argument.
+
+    If the related model was given as a relation path, only the rows that
+    reference the changed instance are invalidated. Otherwise, all rows are
+    invalidated.
     """
-    instance_model_name = get_model_name(instance)
+    plan = register.get_plan(instance.__class__)
+    if not plan.dependents:
+        return
+
+    deleting = kwargs.get('signal') is pre_delete
+    debug = logger.isEnabledFor(logging.DEBUG)
 
     # One model can affect multiple other models.
-    for class_path, field_names in register.get_related_models(instance_model_name).items():
-        update_kwargs = dict([(field_name, None) for field_name in field_names])
-        assert update_kwargs, 'There should always be some fields to update'
+    for model_class, class_path, lookup, field_names in plan.dependents:
+        if lookup is None:
+            if debug:
+                logger.debug('Saving "%s" (pk=%s) triggered the invalidation of "%s" for fields: %s',
+                             plan.model_name, instance.pk, class_path, ', '.join(field_names))
+            # Set all fields on this model to `None` if they are affected by
+            # the invalidation.
+            invalidate_rows(instance, model_class, class_path, field_names, deferred=deleting)
+        else:
+            if debug:
+                logger.debug('Saving "%s" (pk=%s) triggered the invalidation of "%s" (by "%s") for fields: %s',
+                             plan.model_name, instance.pk, class_path, lookup, ', '.join(field_names))
+            # Set the fields to `None` only on the rows that reference the
+            # changed instance. Django turns this into a single update query
+            # with a subquery if the lookup spans multiple tables.
+            invalidate_rows(
+                instance, model_class, class_path, field_names, lookup, [instance.pk], deferred=deleting)
 
-        model_class = import_string(class_path)
-        logger.debug('Saving "{}" (pk={}) triggered the invalidation of "{}" for fields: {}'.format(
-            instance_model_name, instance.pk, class_path, ', '.join(field_names)
-        ))
-        # Set all fields on this model to `None` if they are affected by
-        # the invalidation.
-        model_class.objects.update(**update_kwargs)
+    # The rows that referenced the instance before its foreign key changed.
+    if plan.moved_dependents and not deleting:
+        old_values = instance.__dict__.setdefault('_dbcache_foreign_keys', {})
+        update_fields = kwargs.get('update_fields')
+        saved_values = {}
+        for model_class, class_path, lookup, attname, field_names in plan.moved_dependents:
+            if attname not in instance.__dict__:
+                continue
+            # The field name or the attribute name can be given.
+            if update_fields is not None and not (
+                    attname in update_fields or instance._meta.get_field(attname).name in update_fields):
+                continue
+            saved_values[attname] = value = instance.__dict__[attname]
+            old_value = old_values.get(attname)
+            if old_value is not None and old_value != value:
+                if debug:
+                    logger.debug('Moving "%s" (pk=%s) triggered the invalidation of "%s" (by "%s") for fields: %s',
+                                 plan.model_name, instance.pk, class_path, lookup, ', '.join(field_names))
+                invalidate_rows(instance, model_class, class_path, field_names, lookup, [old_value])
+        old_values.update(saved_values)
 
 
-def invalidate_dbcache_fields_by_m2m(sender, instance, action, reverse, model, **kwargs):
+def invalidate_dbcache_fields_by_reverse_m2m(sender, instance, action, model, pk_set=None):
+    """
+    Invalidate the rows of the related model that reference the instance by
+    a relation path, when the many-to-many relation was changed from the
+    related model side, see `invalidate_dbcache_fields_by_m2m`.
+    """
+    # Eager fields of the rows that were affected by clearing are
+    # recalculated once the relations are removed.
+    if action == 'post_clear':
+        refresh_eager_dbcache_fields(sender, instance)
+        return
+
+    plan = register.get_plan(instance.__class__)
+    lookups = [
+        (class_path, lookup, field_names) for model_class, class_path, lookup, field_names in plan.dependents
+        if model_class is model and lookup is not None
+    ]
+    if not lookups:
+        return
+
+    class_path = lookups[0][0]
+    # The affected rows are unknown after clearing, so they are
+    # invalidated before the relations are removed.
+    if action == 'pre_clear':
+        affected = [(lookup, [instance.pk]) for _, lookup, _ in lookups]
+    elif action in ('post_add', 'post_remove') and pk_set:
+        affected = [('pk', pk_set)]
+    else:
+        return
+
+    field_names = set().union(*[field_names for _, _, field_names in lookups])
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s "%s" (pk=%s) triggered the invalidation of "%s" for fields: %s',
+                     ACTIONS.get(action, action), plan.model_name, instance.pk, class_path, ', '.join(field_names))
+    for lookup, values in affected:
+        invalidate_rows(
+            instance, model, class_path, field_names, lookup, values, deferred=action == 'pre_clear')
+
+
+@profiled('invalidation')
+def invalidate_dbcache_fields_by_m2m(sender, instance, action, reverse, model, pk_set=None, **kwargs):
     """
     Empty all fields that are invalidated by the save of a related model as
     indicated in the dbcache decorator `invalidated_by` argument.
     """
+    # The relation was changed from the related model side. Rows that
+    # reference the instance by a relation path can be invalidated this way.
+    if reverse:
+        invalidate_dbcache_fields_by_reverse_m2m(sender, instance, action, model, pk_set)
+
     # Only act on post-actions.
     if not action.startswith('post_'):
         return
 
-    actions = {
-        'post_add': 'Adding',
-        'post_remove': 'Removing',
-        'poss_clear': 'Clearing',
-    }
+    plan = register.get_plan(model)
+
+    # One model can affect multiple other models.
+    field_names = set()
+    for model_class, class_path, lookup, related_field_names in plan.dependents:
+        if model_class is instance.__class__:
+            field_names.update(related_field_names)
+
+    if field_names:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s "%s" triggered the invalidation of "%s" (pk=%s) for fields: %s',
+                         ACTIONS.get(action, action), model, plan.model_name, instance.pk, ', '.join(field_names))
+        # Set all fields on this model to `None` if they are affected
+        # by the invalidation.
+        clear_memo(instance, field_names)
+        invalidate_rows(
+            instance, instance.__class__, get_class_path(instance), field_names, 'pk', [instance.pk])
 
-    instance_class_path = get_class_path(instance)
-    model_name = get_model_name(model)
+
+@profiled('bulk')
+def process_bulk_changes(model, pks, fields=None, all_rows=False):
+    """
+    Recalculate the `dbcache` fields of rows that were created or changed
+    without sending signals, like with `QuerySet.update`, and invalidate the
+    `dbcache` fields of related models, like the receivers do for a save.
+
+    :param model:
+        The changed `Model` class.
+    :param pks:
+        The primary keys of the changed rows, or `None` if unknown. If
+        unknown, no fields are recalculated and the related rows are
+        invalidated by their model instead of by their relation.
+    :param fields:
+        A `list` of field names to recalculate. If `None`, all `dbcache`
+        fields of the model are recalculated.
+    :param all_rows:
+        Whether all rows were changed, with `pks` as `None`. All rows are then
+        recalculated in batches and the related rows are invalidated by their
+        model, without fetching all primary keys.
+    """
+    if pks is not None and not pks:
+        return
+
+    plan = register.get_plan(model)
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    batch = get_batch()
+    if batch is not None:
+        if pks is not None or all_rows:
+            batch.add_saved(model, pks)
+    elif (fields is None or fields) and plan.entries:
+        if all_rows:
+            refresh_dbcache(model._base_manager.all(), fields=fields)
+        elif pks is not None:
+            refresh_dbcache_pks(model, pks, fields=fields)
 
     # One model can affect multiple other models.
-    for class_path, field_names in register.get_related_models(model_name).items():
-        if instance_class_path == class_path:
-            update_kwargs = dict([(field_name, None) for field_name in field_names])
-            assert update_kwargs, 'There should always be some fields to update'
-
-            logger.debug('{} "{}" triggered the invalidation of "{}" (pk={}) for fields: {}'.format(
-                actions.get(action, action), model, model_name, instance.pk, ', '.join(field_names)
-            ))
-            # Set all fields on this model to `None` if they are affected
-            # by the invalidation.
-            instance.__class__.objects.filter(pk=instance.pk).update(**update_kwargs)
+    for model_class, class_path, lookup, field_names in plan.dependents:
+        if lookup is None:
+            if debug:
+                logger.debug('Changing "%s" in bulk triggered the invalidation of "%s" for fields: %s',
+                             plan.model_name, class_path, ', '.join(field_names))
+            invalidate_rows(None, model_class, class_path, field_names)
+        else:
+            if debug:
+                logger.debug('Changing "%s" in bulk triggered the invalidation of "%s" (by "%s") for fields: %s',
+                             plan.model_name, class_path, lookup, ', '.join(field_names))
+            if pks is None:
+                invalidate_rows(None, model_class, class_path, field_names)
+            else:
+                invalidate_rows(None, model_class, class_path, field_names, lookup, pks)
@@ -0,0 +1,374 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import multiprocessing
+from timeit import default_timer
+
+from django.apps import apps
+from django.db import connections
+from django.db.models import F, Max, Min, Q
+from django.utils.six import integer_types
+
+from .cache import purge_values
+from .profiling import track
+from .utils import (bulk_update_fields, get_dbcache_entries, get_expired_filter, get_model_name, set_cached_value,
+                    update_bulk_values)
+from .writeback import discard_writes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+
+
+class RefreshResult(object):
+    """
+    Statistics of a `refresh_dbcache` run.
+    """
+
+    def __init__(self, processed=0, updated=0, failed=0, duration=0.0):
+        self.processed = processed
+        self.updated = updated
+        self.failed = failed
+        self.duration = duration
+
+    def add(self, other):
+        """
+        Add the row counts of another `RefreshResult` to this one.
+        """
+        self.processed += other.processed
+        self.updated += other.updated
+        self.failed += other.failed
+
+    @property
+    def rate(self):
+        """
+        The number of rows processed per second.
+        """
+        if not self.duration:
+            return 0.0
+        return self.processed / self.duration
+
+    def __repr__(self):
+        return '<RefreshResult: processed={} updated={} failed={} duration={:.2f}s rate={:.1f}/s>'.format(
+            self.processed, self.updated, self.failed, self.duration, self.rate)
+
+
+def refresh_dbcache(queryset, fields=None, batch_size=DEFAULT_BATCH_SIZE, callback=None, fail_silently=False):
+    """
+    Recalculate the `dbcache` fields for all rows in a `QuerySet` by calling
+    their original methods. The rows are fetched in batches, ordered by
+    primary key, and all changed values in a batch are stored with a single
+    update query. Methods with a `bulk` implementation are recalculated with
+    a single update query per batch instead.
+
+    :param queryset:
+        The `QuerySet` to refresh the `dbcache` fields for.
+    :param fields:
+        A `list` of decorated method names or field names to refresh. If
+        `None`, all `dbcache` fields of the model are refreshed.
+    :param batch_size:
+        The number of rows to fetch and update per query.
+    :param callback:
+        A function that is called after each batch with 2 arguments: The
+        `RefreshResult` so far and the primary key of the last processed row.
+    :param fail_silently:
+        If `True`, rows for which a decorated method raises an exception are
+        skipped and counted as failed instead of aborting the refresh.
+    :return:
+        A `RefreshResult` instance.
+    """
+    model = queryset.model
+    model_name = get_model_name(model)
+    entries = get_dbcache_entries(model, fields)
+
+    result = RefreshResult()
+    if not entries:
+        return result
+
+    # Methods with a `bulk` implementation are recalculated per batch rather
+    # than per instance.
+    method_entries = [entry for entry in entries if entry.bulk is None]
+    bulk_entries = [entry for entry in entries if entry.bulk is not None]
+
+    start = default_timer()
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        # Keyset pagination, so each batch is a cheap index range scan.
+        batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        if method_entries:
+            instances = list(batch_queryset[:batch_size])
+            pks = [instance.pk for instance in instances]
+        else:
+            # No need to fetch the instances if no original method is called.
+            instances = []
+            pks = list(batch_queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+
+        values = {}
+        for instance in instances:
+            try:
+                calculated = []
+                for entry in method_entries:
+                    with track('method', instance, entry.decorated_method.__name__):
+                        calculated.append((entry, entry.decorated_method(instance)))
+            except Exception:
+                if not fail_silently:
+                    raise
+                logger.exception('Failed to refresh "%s" (pk=%s).', model_name, instance.pk)
+                result.failed += 1
+                continue
+
+            row = {}
+            for entry, value in calculated:
+                row.update(set_cached_value(instance, entry, value))
+            if row:
+                values[instance.pk] = row
+
+        updated = bulk_update_fields(model, values)
+        if bulk_entries:
+            try:
+                for entry in bulk_entries:
+                    update_bulk_values(model, entry, pks)
+            except Exception:
+                if not fail_silently:
+                    raise
+                logger.exception('Failed to refresh "%s" (pk=%s to %s).', model_name, pks[0], pks[-1])
+                result.failed += len(pks)
+            else:
+                # All rows are written by the bulk update queries.
+                updated = len(pks)
+        # The values in the second cache tier and deferred writes, if any, are
+        # outdated now.
+        purge_values(model, entries, pks)
+        discard_writes(queryset, entries, pks)
+        result.updated += updated
+        result.processed += len(pks)
+        result.duration = default_timer() - start
+        last_pk = pks[-1]
+
+        logger.info('Refreshed %s rows of "%s" (%s updated, %s failed, %.1f rows/s).',
+                    result.processed, model_name, result.updated, result.failed, result.rate)
+
+        if callback is not None:
+            callback(result, last_pk)
+
+        # A partial batch is the last batch.
+        if len(pks) < batch_size:
+            break
+
+    return result
+
+
+def refresh_dbcache_pks(model, pks, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recalculate the `dbcache` fields for the rows with the given primary keys
+    like `refresh_dbcache`. The primary keys are split in chunks, to keep
+    the queries small.
+
+    :param model:
+        The `Model` class.
+    :param pks:
+        The primary keys of the rows to refresh.
+    :param fields:
+        A `list` of decorated method names or field names to refresh. If
+        `None`, all `dbcache` fields of the model are refreshed.
+    :param batch_size:
+        The number of rows to fetch and update per query.
+    :return:
+        A `RefreshResult` instance.
+    """
+    result = RefreshResult()
+    start = default_timer()
+
+    pks = sorted(pks)
+    for i in range(0, len(pks), batch_size):
+        queryset = model._base_manager.filter(pk__in=pks[i:i + batch_size])
+        result.add(refresh_dbcache(queryset, fields=fields, batch_size=batch_size))
+
+    result.duration = default_timer() - start
+    return result
+
+
+def refresh_expired(queryset, fields=None, batch_size=DEFAULT_BATCH_SIZE, fail_silently=False):
+    """
+    Recalculate the expired values of the `dbcache` fields with a `ttl` for
+    the rows in a `QuerySet`, like `refresh_dbcache`. The rows are processed
+    per field, in the order they expired, using the index on the calculation
+    time field. Rows without a calculation time come first.
+
+    :param queryset:
+        The `QuerySet` to refresh the expired `dbcache` fields for.
+    :param fields:
+        A `list` of decorated method names or field names to refresh. If
+        `None`, all `dbcache` fields with a `ttl` are refreshed. Fields
+        without a `ttl` are ignored.
+    :param batch_size:
+        The number of rows to fetch and update per query.
+    :param fail_silently:
+        If `True`, rows for which a decorated method raises an exception are
+        skipped and counted as failed instead of aborting the refresh.
+    :return:
+        A `RefreshResult` instance.
+    """
+    model = queryset.model
+    result = RefreshResult()
+    start = default_timer()
+
+    for entry in get_dbcache_entries(model, fields):
+        if entry.ttl is None:
+            continue
+
+        column = entry.computed_field_name
+        expired = queryset.filter(get_expired_filter([entry])).order_by(F(column).asc(nulls_first=True), 'pk')
+        last = None
+        while True:
+            # Keyset pagination on the calculation time and primary key, so
+            # rows that failed to refresh are not fetched again.
+            batch_queryset = expired
+            if last is not None:
+                last_computed_at, last_pk = last
+                if last_computed_at is None:
+                    batch_queryset = batch_queryset.filter(
+                        Q(**{'{}__isnull'.format(column): False}) | Q(pk__gt=last_pk))
+                else:
+                    later = Q(**{'{}__gt'.format(column): last_computed_at})
+                    batch_queryset = batch_queryset.filter(later | Q(**{column: last_computed_at, 'pk__gt': last_pk}))
+            rows = list(batch_queryset.values_list(column, 'pk')[:batch_size])
+            if not rows:
+                break
+
+            result.add(refresh_dbcache(
+                model._base_manager.filter(pk__in=[pk for _, pk in rows]), fields=[entry.field_name],
+                batch_size=batch_size, fail_silently=fail_silently))
+
+            # A partial batch is the last batch.
+            if len(rows) < batch_size:
+                break
+            last = rows[-1]
+
+    result.duration = default_timer() - start
+    return result
+
+
+def get_pk_shards(queryset, count):
+    """
+    Split the primary key range of a `QuerySet` in (at most) `count`
+    consecutive ranges of equal size. Only integer primary keys are
+    supported.
+
+    :param queryset:
+        The `QuerySet` to split.
+    :param count:
+        The number of shards.
+    :return:
+        A `list` of `tuple` with the lowest and highest primary key (both
+        inclusive) of each shard.
+    """
+    bounds = queryset.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    min_pk, max_pk = bounds['min_pk'], bounds['max_pk']
+    if min_pk is None:
+        return []
+    if not isinstance(min_pk, integer_types):
+        raise ValueError('Only integer primary keys can be split in shards, "{}" has {}.'.format(
+            get_model_name(queryset.model), type(min_pk).__name__))
+
+    size = -(-(max_pk - min_pk + 1) // count)
+    return [(lower, min(lower + size - 1, max_pk)) for lower in range(min_pk, max_pk + 1, size)]
+
+
+def _init_worker():
+    # With the "spawn" start method, the worker is a fresh interpreter.
+    if not apps.ready:
+        import django
+        django.setup()
+
+    # Each worker should use its own database connections.
+    for connection in connections.all():
+        connection.close()
+
+
+def _refresh_shard(task):
+    model_label, query, fields, batch_size, fail_silently, lower, upper = task
+
+    queryset = apps.get_model(model_label)._default_manager.all()
+    queryset.query = query
+
+    return refresh_dbcache(
+        queryset.filter(pk__gte=lower, pk__lte=upper), fields=fields, batch_size=batch_size,
+        fail_silently=fail_silently)
+
+
+def refresh_dbcache_parallel(queryset, fields=None, batch_size=DEFAULT_BATCH_SIZE, workers=2, shards=None,
+                             callback=None, fail_silently=False):
+    """
+    Recalculate the `dbcache` fields for all rows in a `QuerySet` like
+    `refresh_dbcache` but split the primary key range in shards that are
+    processed by a pool of worker processes, each with its own database
+    connection.
+
+    :param queryset:
+        The `QuerySet` to refresh the `dbcache` fields for. The model should
+        have an integer primary key.
+    :param fields:
+        A `list` of decorated method names or field names to refresh. If
+        `None`, all `dbcache` fields of the model are refreshed.
+    :param batch_size:
+        The number of rows to fetch and update per query in each worker.
+    :param workers:
+        The number of worker processes.
+    :param shards:
+        The number of shards to split the primary key range in. Defaults to
+        4 shards per worker.
+    :param callback:
+        A function that is called after each shard, in primary key order,
+        with 2 arguments: The `RefreshResult` so far and the highest primary
+        key of the shard.
+    :param fail_silently:
+        If `True`, rows for which a decorated method raises an exception are
+        skipped and counted as failed instead of aborting the refresh.
+    :return:
+        A `RefreshResult` instance with the merged results of all shards.
+    """
+    model = queryset.model
+    model_name = get_model_name(model)
+    fields = [entry.field_name for entry in get_dbcache_entries(model, fields)]
+
+    result = RefreshResult()
+    if not fields:
+        return result
+
+    start = default_timer()
+    shard_ranges = get_pk_shards(queryset, shards or workers * 4)
+    tasks = [
+        (model._meta.label, queryset.query, fields, batch_size, fail_silently, lower, upper)
+        for lower, upper in shard_ranges
+    ]
+
+    # Connections can not be shared with the worker processes.
+    for connection in connections.all():
+        connection.close()
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker)
+    try:
+        # The results are returned in shard order, so the callback can be used
+        # to store the progress.
+        for (lower, upper), shard_result in zip(shard_ranges, pool.imap(_refresh_shard, tasks)):
+            result.add(shard_result)
+            result.duration = default_timer() - start
+
+            logger.info('Refreshed %s rows of "%s" (%s updated, %s failed, %.1f rows/s).',
+                        result.processed, model_name, result.updated, result.failed, result.rate)
+
+            if callback is not None:
+                callback(result, upper)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    return result
@@ -0,0 +1,16 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.dispatch import Signal
+
+# Sent when a decorated method is called without a (valid) cached value. Only
+# sent if the `DBCACHE_FIELDS_METRICS` setting is enabled.
+dbcache_miss = Signal(providing_args=['instance', 'field_name'])
+
+# Sent when the value of a `dbcache` field is calculated for an instance, by
+# calling the decorated method or when the instance is saved. Only sent if the
+# `DBCACHE_FIELDS_METRICS` setting is enabled.
+dbcache_recomputed = Signal(providing_args=['instance', 'field_name', 'value', 'duration'])
+
+# Sent when the `dbcache` fields of rows are invalidated (or recalculated, for
+# eager fields). Only sent if the `DBCACHE_FIELDS_METRICS` setting is enabled.
+dbcache_invalidated = Signal(providing_args=['field_names', 'rows'])
@@ -1,6 +1,134 @@
 from __future__ import absolute_import, unicode_literals
 
 import inspect
+from functools import wraps
+
+from django.core.exceptions import FieldError
+from django.db import connections, transaction
+from django.db.models import Case, DateTimeField, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# The annotation name used to calculate the value of a `bulk` expression.
+BULK_ANNOTATION = '_dbcache_bulk_value'
+
+# The instance attribute to memoize the values of decorated methods with.
+MEMO_ATTR = '_dbcache_memo'
+
+
+class RegisterEntry(object):
+    """
+    Information about a `dbcache` decorated method. The information can also
+    be accessed by key, like a `dict`.
+    """
+    __slots__ = (
+        'decorated_method', 'field', 'field_name', 'dirty_func', 'invalidated_by', 'requires_pk',
+        'valid_field_name', 'bulk', 'eager', 'cache', 'stale_field_name', 'max_stale', 'computed_field_name', 'ttl',
+    )
+
+    def __init__(self, decorated_method, field, field_name, dirty_func, invalidated_by, requires_pk=False,
+                 valid_field_name=None, bulk=None, eager=False, cache=None, stale_field_name=None, max_stale=None,
+                 computed_field_name=None, ttl=None):
+        self.decorated_method = decorated_method
+        self.field = field
+        self.field_name = field_name
+        self.dirty_func = dirty_func
+        self.invalidated_by = invalidated_by
+        self.requires_pk = requires_pk
+        self.valid_field_name = valid_field_name
+        self.bulk = bulk
+        self.eager = eager
+        self.cache = cache
+        self.stale_field_name = stale_field_name
+        self.max_stale = max_stale
+        self.computed_field_name = computed_field_name
+        self.ttl = ttl
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return '<RegisterEntry: {}>'.format(self.field_name)
+
+
+class ModelPlan(object):
+    """
+    Everything the receivers need to know about a `Model` class, resolved
+    once so handling a signal doesn't require any string building, imports
+    or scans of the register. See `Register.get_plan`.
+    """
+    __slots__ = ('model', 'class_path', 'model_name', 'entries', 'pre_save_entries', 'dependents', 'moved_dependents')
+
+    def __init__(self, register, model):
+        self.model = model
+        self.class_path = get_class_path(model)
+        self.model_name = get_model_name(model)
+
+        # The entries of the `dbcache` decorated methods of the model itself.
+        self.entries = tuple(register.get(self.class_path))
+        self.pre_save_entries = tuple(entry for entry in self.entries if not entry.requires_pk)
+
+        # The models with `dbcache` fields that are invalidated by changes to
+        # this model, as a `tuple` of the affected `Model` class, its class
+        # path, the lookup to find the affected rows (or `None` if all rows
+        # are affected) and the affected field names.
+        dependents = []
+        for class_path, field_names in register.get_related_models(self.model_name).items():
+            dependents.append((register.get_model(class_path), class_path, None, frozenset(field_names)))
+        for class_path, lookups in register.get_related_lookups(self.model_name).items():
+            for lookup, field_names in lookups.items():
+                dependents.append((register.get_model(class_path), class_path, lookup, frozenset(field_names)))
+        self.dependents = tuple(dependents)
+
+        # The dependents that reference this model through a foreign key of
+        # this model, as a `tuple` of the affected `Model` class, its class
+        # path, the lookup to find the affected rows by a value of the
+        # foreign key, the foreign key attribute name and the affected field
+        # names. Changing the foreign key also affects the rows that
+        # referenced the instance before.
+        moved_dependents = []
+        for model_class, class_path, lookup, field_names in self.dependents:
+            if lookup is None:
+                continue
+            parts = lookup.split('__')
+            related_model = model_class
+            for part in parts[:-1]:
+                related_model = related_model._meta.get_field(part).related_model
+            for field in model._meta.concrete_fields:
+                if not (field.many_to_one or field.one_to_one) or field.related_model is not related_model:
+                    continue
+                if field.related_query_name() == parts[-1]:
+                    moved_lookup = '__'.join(parts[:-1] + [field.target_field.name])
+                    moved_dependents.append((model_class, class_path, moved_lookup, field.attname, field_names))
+        self.moved_dependents = tuple(moved_dependents)
+
+    def get_through_models(self):
+        """
+        Returns the intermediate models of the many-to-many relations of the
+        dependent models to this model. Changing these relations (from either
+        side) invalidates the dependent models.
+
+        :return:
+            A `list` of intermediate `Model` classes.
+        """
+        through_models = []
+        for model_class, class_path, lookup, field_names in self.dependents:
+            # The relations can be declared on either model.
+            fields = [field for field in model_class._meta.many_to_many if field.related_model is self.model]
+            fields.extend(field for field in self.model._meta.many_to_many if field.related_model is model_class)
+            for field in fields:
+                through = field.remote_field.through
+                if through not in through_models:
+                    through_models.append(through)
+        return through_models
 
 
 class Register(object):
@@ -10,28 +138,45 @@ class Register(object):
     def __init__(self):
         self._model_store = {}
         self._invalidation_model_store = {}
+        self._invalidation_relation_store = {}
+        self._unresolved_relations = []
+        self._models = {}
+        self._plans = {}
+
+    def add(self, class_path, decorated_method, field, field_name, dirty_func, invalidated_by, requires_pk=False,
+            valid_field_name=None, bulk=None, eager=False, cache=None, stale_field_name=None, max_stale=None,
+            computed_field_name=None, ttl=None):
+        """
+        Register a `dbcache` decorated method.
 
-    def add(self, class_path, decorated_method, field, field_name, dirty_func, invalidated_by):
+        :return:
+            The new `RegisterEntry`.
+        """
         if class_path not in self._model_store:
             self._model_store[class_path] = []
 
-        entry = {
-            'decorated_method': decorated_method,
-            'field': field,
-            'field_name': field_name,
-            'dirty_func': dirty_func,
-            'invalidated_by': invalidated_by,
-        }
+        entry = RegisterEntry(
+            decorated_method, field, field_name, dirty_func, invalidated_by, requires_pk=requires_pk,
+            valid_field_name=valid_field_name, bulk=bulk, eager=eager, cache=cache,
+            stale_field_name=stale_field_name, max_stale=max_stale, computed_field_name=computed_field_name, ttl=ttl)
         self._model_store[class_path].append(entry)
+        self._plans.clear()
 
         # Store reverse relations for models that invalidate this model.
         if invalidated_by:
             for model in invalidated_by:
+                # Relation paths can only be resolved once all models are
+                # loaded. See `resolve_relations`.
+                if is_relation_path(model):
+                    self._unresolved_relations.append((class_path, model, field_name))
+                    continue
+
                 if model not in self._invalidation_model_store:
                     self._invalidation_model_store[model] = {class_path: set()}
                 elif class_path not in self._invalidation_model_store[model]:
                     self._invalidation_model_store[model][class_path] = set()
                 self._invalidation_model_store[model][class_path].add(field_name)
+        return entry
 
     def get(self, class_path):
         """
@@ -40,15 +185,107 @@ class Register(object):
         :param class_path:
             The `Model` class path.
         :return:
-            A `list` of `dict` with the following keys:
+            A `list` of `RegisterEntry` instances with the following
+            attributes (or keys):
                 - decorated_method
                 - field
                 - field_name
                 - dirty_func
                 - invalidated_by
+                - requires_pk
+                - valid_field_name
+                - bulk
+                - eager
+                - cache
+                - stale_field_name
+                - max_stale
+                - computed_field_name
+                - ttl
         """
         return self._model_store.get(class_path, [])
 
+    def get_model(self, class_path):
+        """
+        Returns the `Model` class of a class path. The class is imported only
+        once.
+
+        :param class_path:
+            The `Model` class path.
+        :return:
+            The `Model` class.
+        """
+        model = self._models.get(class_path)
+        if model is None:
+            model = self._models[class_path] = import_string(class_path)
+        return model
+
+    def get_plan(self, model):
+        """
+        Returns the `ModelPlan` of a `Model` class. The plan is created once
+        and kept until the register changes.
+
+        :param model:
+            The `Model` class.
+        :return:
+            A `ModelPlan` instance.
+        """
+        plan = self._plans.get(model)
+        if plan is None:
+            plan = self._plans[model] = ModelPlan(self, model)
+        return plan
+
+    def get_invalidation_kwargs(self, class_path, field_names, eager=True):
+        """
+        Returns the update query arguments to invalidate `dbcache` fields.
+
+        :param class_path:
+            The `Model` class path.
+        :param field_names:
+            The field names to invalidate.
+        :param eager:
+            Whether to include eager fields, see `get_eager_kwargs`.
+        :return:
+            A `dict` of field names and values that invalidate the fields.
+            Either the field itself is set to `None` or, if `None` is a valid
+            cached value, the validity field is set to `False`. Fields with a
+            `max_stale` keep their value and get the time they became stale
+            instead. Eager fields are recalculated instead.
+        """
+        update_kwargs = {}
+        for entry in self.get(class_path):
+            if entry.field_name in field_names and not entry.eager:
+                if entry.stale_field_name is not None:
+                    # Keep the time of the first invalidation, since the value
+                    # was calculated.
+                    update_kwargs[entry.stale_field_name] = Coalesce(
+                        F(entry.stale_field_name), Value(timezone.now(), output_field=DateTimeField()))
+                elif entry.valid_field_name is None:
+                    update_kwargs[entry.field_name] = None
+                else:
+                    update_kwargs[entry.valid_field_name] = False
+
+        if eager:
+            update_kwargs.update(self.get_eager_kwargs(class_path, field_names))
+        return update_kwargs
+
+    def get_eager_kwargs(self, class_path, field_names):
+        """
+        Returns the update query arguments to recalculate eager `dbcache`
+        fields in the database, using their `bulk` expression.
+
+        :param class_path:
+            The `Model` class path.
+        :param field_names:
+            The field names to recalculate, other fields are ignored.
+        :return:
+            A `dict` of field names and expressions.
+        """
+        update_kwargs = {}
+        for entry in self.get(class_path):
+            if entry.field_name in field_names and entry.eager:
+                update_kwargs.update(get_bulk_update_kwargs(self.get_model(class_path), entry))
+        return update_kwargs
+
     def get_related_models(self, model):
         """
         Returns a `dict` of models related to the `dbcache` decorated method.
@@ -63,6 +300,37 @@ class Register(object):
         """
         return self._invalidation_model_store.get(model, {})
 
+    def get_related_lookups(self, model):
+        """
+        Returns a `dict` of models related to the `dbcache` decorated method
+        by a relation path. Typically used to see which rows of which models
+        should be invalidated when a related model instance is changed.
+
+        :param model:
+            The model name in the form `{app label}.{model name}`.
+        :return:
+            A `dict` where each key is the affected model class path. The
+            value is a `dict` with the lookup (relative to the affected
+            model) as key and a `set` of affected field names as value.
+        """
+        return self._invalidation_relation_store.get(model, {})
+
+    def resolve_relations(self):
+        """
+        Resolve all relation paths given in the `dbcache` decorator
+        `invalidated_by` argument to the related model and lookup. Should be
+        called when all models are loaded.
+        """
+        while self._unresolved_relations:
+            class_path, relation, field_name = self._unresolved_relations.pop(0)
+
+            related_model, lookup = resolve_relation_path(self.get_model(class_path), relation)
+            related_model_name = get_model_name(related_model)
+
+            lookups = self._invalidation_relation_store.setdefault(related_model_name, {}).setdefault(class_path, {})
+            lookups.setdefault(lookup, set()).add(field_name)
+            self._plans.clear()
+
     def __contains__(self, class_path):
         return class_path in self._model_store
 
@@ -93,3 +361,401 @@ def get_model_name(instance):
     return '{}.{}'.format(
         instance._meta.app_label,
         instance.__name__ if inspect.isclass(instance) else instance.__class__.__name__)
+
+
+def is_relation_path(value):
+    """
+    Returns whether the value is a relation path (like `ingredients` or
+    `wrap__ingredients`) rather than a model name in the form
+    `{app label}.{model name}`.
+
+    :param value:
+        The `invalidated_by` value.
+    :return:
+        `True` if the value is a relation path, `False` otherwise.
+    """
+    return '.' not in value
+
+
+def resolve_relation_path(model, relation):
+    """
+    Resolves a relation path to the related model and the lookup that can be
+    used to filter the `model` on instances of that related model.
+
+    Each part of the relation path can be a relation field name (`wrap_type`)
+    or a reverse relation accessor name (`wrappromo_set`), separated by
+    `__`.
+
+    :param model:
+        The `Model` class to start from.
+    :param relation:
+        The relation path.
+    :return:
+        A `tuple` of the related `Model` class and the lookup.
+    """
+    lookup_parts = []
+    related_model = model
+    for part in relation.split('__'):
+        for field in related_model._meta.get_fields():
+            if not field.is_relation or field.related_model is None:
+                continue
+            if field.name == part or (field.auto_created and not field.concrete and field.get_accessor_name() == part):
+                break
+        else:
+            raise FieldError('The relation "{}" in "{}" does not refer to a relation on {}.'.format(
+                part, relation, get_model_name(related_model)))
+
+        lookup_parts.append(field.name)
+        related_model = field.related_model
+
+    return related_model, '__'.join(lookup_parts)
+
+
+def get_dbcache_entries(model, fields=None):
+    """
+    Returns the information about `dbcache` decorated methods of a `Model`.
+
+    :param model:
+        A `Model` class.
+    :param fields:
+        A `list` of decorated method names or field names to return the
+        information for. If `None`, all entries are returned.
+    :return:
+        A `list` of `RegisterEntry` instances, see `Register.get`.
+    """
+    from . import register
+
+    entries = register.get_plan(model).entries
+    if fields is None:
+        return list(entries)
+
+    result = []
+    for name in fields:
+        for entry in entries:
+            if name in (entry.decorated_method.__name__, entry.field_name):
+                result.append(entry)
+                break
+        else:
+            raise ValueError('"{}" is not a dbcache decorated method or field on {}.'.format(
+                name, get_model_name(model)))
+    return result
+
+
+def is_cached(instance, entry):
+    """
+    Returns whether an instance has a (valid) cached value for a `dbcache`
+    field.
+
+    :param instance:
+        The `Model` instance.
+    :param entry:
+        The register entry.
+    :return:
+        `True` if the cached value can be used. A stale value can be used
+        until it has been stale for longer than `max_stale`.
+    """
+    if entry.ttl is not None and is_expired(getattr(instance, entry.computed_field_name), entry.ttl):
+        return False
+    if entry.stale_field_name is not None:
+        stale_since = getattr(instance, entry.stale_field_name)
+        if stale_since is not None and timezone.now() - stale_since > entry.max_stale:
+            return False
+    if entry.valid_field_name is None:
+        return getattr(instance, entry.field_name) is not None
+    return getattr(instance, entry.valid_field_name)
+
+
+def is_expired(computed_at, ttl):
+    """
+    Returns whether a cached value with a `ttl` is expired.
+
+    :param computed_at:
+        The time the value was calculated, or `None` if unknown.
+    :param ttl:
+        The `timedelta` a value can be used for.
+    :return:
+        `True` if the value should be calculated again.
+    """
+    return computed_at is None or timezone.now() - computed_at > ttl
+
+
+def get_expired_filter(entries):
+    """
+    Returns a filter for rows where any of the given `dbcache` fields with a
+    `ttl` is expired, or was calculated at an unknown time.
+
+    :param entries:
+        A `list` of register entries, entries without a `ttl` are ignored.
+    :return:
+        A `Q` instance.
+    """
+    now = timezone.now()
+    q = Q()
+    for entry in entries:
+        if entry.ttl is not None:
+            q |= Q(**{'{}__isnull'.format(entry.computed_field_name): True})
+            q |= Q(**{'{}__lt'.format(entry.computed_field_name): now - entry.ttl})
+    return q
+
+
+def set_cached_value(instance, entry, value):
+    """
+    Set a calculated value of a `dbcache` field on an instance and mark it
+    as valid.
+
+    :param instance:
+        The `Model` instance.
+    :param entry:
+        The register entry.
+    :param value:
+        The calculated value.
+    :return:
+        A `dict` of the field names and values that changed, including
+        validity, staleness and calculation time fields.
+    """
+    changed = {}
+    if value != getattr(instance, entry.field_name):
+        changed[entry.field_name] = value
+    if entry.valid_field_name is not None and not getattr(instance, entry.valid_field_name):
+        changed[entry.valid_field_name] = True
+    if entry.stale_field_name is not None and getattr(instance, entry.stale_field_name) is not None:
+        changed[entry.stale_field_name] = None
+    if entry.computed_field_name is not None:
+        changed[entry.computed_field_name] = timezone.now()
+
+    for field_name, new_value in changed.items():
+        setattr(instance, field_name, new_value)
+    clear_memo(instance, [entry.field_name])
+    return changed
+
+
+def clear_memo(instance, field_names=None):
+    """
+    Remove the memoized values of decorated methods from an instance, see
+    `dbcache`.
+
+    :param instance:
+        The `Model` instance.
+    :param field_names:
+        The field names to remove the values of, or `None` to remove all
+        values.
+    """
+    memo = instance.__dict__.get(MEMO_ATTR)
+    if not memo:
+        return
+
+    if field_names is None:
+        del instance.__dict__[MEMO_ATTR]
+    else:
+        # A copy of the instance may share the memo, so it's replaced instead
+        # of changed.
+        instance.__dict__[MEMO_ATTR] = dict(
+            (field_name, value) for field_name, value in memo.items() if field_name not in field_names)
+
+
+def clears_memo(refresh_from_db):
+    """
+    Decorator for `Model.refresh_from_db` that removes the memoized values of
+    an instance before it's reloaded.
+    """
+    if getattr(refresh_from_db, 'clears_memo', False):
+        return refresh_from_db
+
+    @wraps(refresh_from_db)
+    def wrapper(instance, *args, **kwargs):
+        clear_memo(instance)
+        return refresh_from_db(instance, *args, **kwargs)
+    wrapper.clears_memo = True
+    return wrapper
+
+
+def get_uncached_filter(entries):
+    """
+    Returns a filter for rows where any of the given `dbcache` fields has no
+    (valid) cached value or a stale cached value.
+
+    :param entries:
+        A `list` of register entries.
+    :return:
+        A `Q` instance.
+    """
+    q = Q()
+    for entry in entries:
+        if entry.valid_field_name is None:
+            q |= Q(**{'{}__isnull'.format(entry.field_name): True})
+        else:
+            q |= Q(**{entry.valid_field_name: False})
+        if entry.stale_field_name is not None:
+            q |= Q(**{'{}__isnull'.format(entry.stale_field_name): False})
+    return q
+
+
+def bulk_update_fields(model, values, using=None):
+    """
+    Update different values for different rows in a single update query.
+
+    :param model:
+        A `Model` class.
+    :param values:
+        A `dict` where each key is a primary key and each value is a `dict`
+        of field names and their new values.
+    :param using:
+        The database alias to use. Defaults to the router's choice.
+    :return:
+        The number of rows updated.
+    """
+    if not values:
+        return 0
+
+    field_names = set()
+    for row in values.values():
+        field_names.update(row)
+
+    update_kwargs = {}
+    for field_name in field_names:
+        field = model._meta.get_field(field_name)
+        update_kwargs[field_name] = Case(
+            *[When(pk=pk, then=Value(row[field_name], output_field=field))
+              for pk, row in values.items() if field_name in row],
+            default=F(field_name),
+            output_field=field
+        )
+
+    # Bypass triggers by using update.
+    return model._base_manager.using(using).filter(pk__in=list(values)).update(**update_kwargs)
+
+
+def is_expression(value):
+    """
+    Returns whether the value is an ORM expression (like `F('price')` or
+    `Sum('ingredients__price')`) rather than a callable.
+
+    :param value:
+        The `bulk` value.
+    :return:
+        `True` if the value is an expression, `False` otherwise.
+    """
+    return hasattr(value, 'resolve_expression')
+
+
+def get_bulk_update_kwargs(model, entry):
+    """
+    Returns the update query arguments to recalculate a `dbcache` field in
+    the database, using the `bulk` expression of the decorated method.
+
+    :param model:
+        A `Model` class.
+    :param entry:
+        The register entry, that should have a `bulk` expression.
+    :return:
+        A `dict` of field names and values, including the validity,
+        staleness and calculation time fields.
+    """
+    value = model._base_manager.filter(pk=OuterRef('pk')).annotate(
+        **{BULK_ANNOTATION: entry.bulk}).values(BULK_ANNOTATION)[:1]
+
+    update_kwargs = {entry.field_name: Subquery(value, output_field=model._meta.get_field(entry.field_name))}
+    if entry.valid_field_name is not None:
+        update_kwargs[entry.valid_field_name] = True
+    if entry.stale_field_name is not None:
+        update_kwargs[entry.stale_field_name] = None
+    if entry.computed_field_name is not None:
+        update_kwargs[entry.computed_field_name] = timezone.now()
+    return update_kwargs
+
+
+def calculate_bulk_values(model, entry, pks, using=None):
+    """
+    Calculate the values of a `dbcache` field for many rows at once, using
+    the `bulk` implementation of the decorated method.
+
+    :param model:
+        A `Model` class.
+    :param entry:
+        The register entry, that should have a `bulk` implementation.
+    :param pks:
+        A `list` of primary keys.
+    :param using:
+        The database alias to use. Defaults to the router's choice.
+    :return:
+        A `dict` where each key is a primary key and each value is the
+        calculated value. Rows that are missing from the result of a `bulk`
+        callable get the value `None`.
+    """
+    queryset = model._base_manager.using(using).filter(pk__in=pks)
+    bulk = entry.bulk
+    if is_expression(bulk):
+        values = dict(queryset.annotate(**{BULK_ANNOTATION: bulk}).values_list('pk', BULK_ANNOTATION))
+    else:
+        values = bulk(queryset)
+    return dict((pk, values.get(pk)) for pk in pks)
+
+
+def update_bulk_values(model, entry, pks, using=None):
+    """
+    Recalculate and store the values of a `dbcache` field for many rows in a
+    single update query, using the `bulk` implementation of the decorated
+    method. An expression is calculated by the database as part of the update
+    query, without fetching any rows.
+
+    :param model:
+        A `Model` class.
+    :param entry:
+        The register entry, that should have a `bulk` implementation.
+    :param pks:
+        A `list` of primary keys.
+    :param using:
+        The database alias to use. Defaults to the router's choice.
+    :return:
+        The number of rows updated.
+    """
+    if not pks:
+        return 0
+
+    if is_expression(entry.bulk):
+        # Bypass triggers by using update.
+        return model._base_manager.using(using).filter(pk__in=pks).update(**get_bulk_update_kwargs(model, entry))
+
+    values = {}
+    now = timezone.now()
+    for pk, value in calculate_bulk_values(model, entry, pks, using=using).items():
+        values[pk] = {entry.field_name: value}
+        if entry.valid_field_name is not None:
+            values[pk][entry.valid_field_name] = True
+        if entry.stale_field_name is not None:
+            values[pk][entry.stale_field_name] = None
+        if entry.computed_field_name is not None:
+            values[pk][entry.computed_field_name] = now
+    return bulk_update_fields(model, values, using=using)
+
+
+def get_transaction_buffer(local, name, using, factory):
+    """
+    Returns a buffer for the current transaction of the database, stored on
+    a thread local. The `flush` method of the buffer is called when the
+    transaction is committed and the buffer is discarded when it is rolled
+    back.
+
+    :param local:
+        The `threading.local` instance to store the buffers on.
+    :param name:
+        The attribute name to store the buffers with.
+    :param using:
+        The database alias.
+    :param factory:
+        A callable that returns a new buffer.
+    :return:
+        The buffer.
+    """
+    buffers = getattr(local, name, None)
+    if buffers is None:
+        buffers = {}
+        setattr(local, name, buffers)
+
+    buffer = buffers.get(using)
+    # Once the transaction is committed or rolled back, the flush is no
+    # longer pending and a new transaction needs a new buffer.
+    if buffer is None or not any(entry[1] == buffer.flush for entry in connections[using].run_on_commit):
+        buffer = buffers[using] = factory()
+        transaction.on_commit(buffer.flush, using=using)
+    return buffer
@@ -0,0 +1,216 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connections, router
+
+from .conf import WRITE_MODE_DEFERRED, WRITE_MODE_IMMEDIATE, WRITE_MODE_READONLY, get_setting
+from .utils import bulk_update_fields, get_model_name, get_transaction_buffer
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class WriteBuffer(object):
+    """
+    Collects cached values that should be written to the database, to store
+    them with a single update query per model.
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, model, pk, values, using):
+        self.rows.setdefault((using, model), {}).setdefault(pk, {}).update(values)
+
+    def discard(self, model, field_names, pks=None):
+        """
+        Remove collected values of a model, so they are not written.
+
+        :param model:
+            The `Model` class.
+        :param field_names:
+            The field names to remove the values of.
+        :param pks:
+            The primary keys of the rows, or `None` for all rows.
+        """
+        for (using, row_model), rows in self.rows.items():
+            if row_model is not model:
+                continue
+            for pk in list(rows) if pks is None else pks:
+                values = rows.get(pk)
+                if values is None:
+                    continue
+                for field_name in field_names:
+                    values.pop(field_name, None)
+                if not values:
+                    del rows[pk]
+
+    def has_rows(self, model):
+        return any(rows for (using, row_model), rows in self.rows.items() if row_model is model)
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+    def flush(self):
+        """
+        Write all collected values to the database.
+        """
+        rows, self.rows = self.rows, {}
+        for (using, model), values in rows.items():
+            logger.debug('Writing deferred dbcache fields of %s "%s" rows.', len(values), get_model_name(model))
+            bulk_update_fields(model, values, using=using)
+
+
+def _get_request_buffer():
+    buffer = getattr(_local, 'request_buffer', None)
+    if buffer is None:
+        buffer = _local.request_buffer = WriteBuffer()
+    return buffer
+
+
+def defer_write(model, pk, values):
+    """
+    Collect cached values to write to the database later. Inside a
+    transaction, the values are written when the transaction is committed.
+    Otherwise, the values are written at the end of the request, when
+    `flush` is called or when too many values are collected.
+
+    :param model:
+        The `Model` class.
+    :param pk:
+        The primary key of the row.
+    :param values:
+        A `dict` of field names and their new values.
+    """
+    using = router.db_for_write(model)
+    if connections[using].in_atomic_block:
+        get_transaction_buffer(_local, 'transaction_buffers', using, WriteBuffer).add(model, pk, values, using)
+    else:
+        buffer = _get_request_buffer()
+        buffer.add(model, pk, values, using)
+        if len(buffer) >= get_setting('WRITE_BUFFER_SIZE'):
+            buffer.flush()
+
+
+def discard_writes(queryset, entries, pks=None):
+    """
+    Remove the deferred values of invalidated or recalculated rows, that
+    were collected by the current thread, so an outdated value is not
+    written afterwards.
+
+    :param queryset:
+        The `QuerySet` of invalidated rows.
+    :param entries:
+        The register entries of the invalidated fields.
+    :param pks:
+        The primary keys of the invalidated rows, if known. Otherwise, they
+        are fetched if needed.
+    """
+    buffers = list(getattr(_local, 'transaction_buffers', {}).values())
+    buffers.append(getattr(_local, 'request_buffer', None))
+    buffers = [buffer for buffer in buffers if buffer is not None and buffer.has_rows(queryset.model)]
+    if not buffers:
+        return
+
+    field_names = set()
+    for entry in entries:
+        field_names.update(
+            name for name in (entry.field_name, entry.valid_field_name, entry.stale_field_name,
+                              entry.computed_field_name)
+            if name is not None
+        )
+
+    if pks is None and queryset.query.where:
+        pks = list(queryset.values_list('pk', flat=True))
+    for buffer in buffers:
+        buffer.discard(queryset.model, field_names, pks)
+
+
+def get_write_mode():
+    """
+    Returns the `DBCACHE_FIELDS_WRITE_MODE` setting.
+    """
+    write_mode = get_setting('WRITE_MODE')
+    if write_mode not in (WRITE_MODE_IMMEDIATE, WRITE_MODE_DEFERRED, WRITE_MODE_READONLY):
+        raise ImproperlyConfigured('The DBCACHE_FIELDS_WRITE_MODE setting should be one of: {}.'.format(
+            ', '.join([WRITE_MODE_IMMEDIATE, WRITE_MODE_DEFERRED, WRITE_MODE_READONLY])))
+    return write_mode
+
+
+def write_values(instance, values, conditions=None):
+    """
+    Store (re)calculated cached values of an instance in the database,
+    according to the `DBCACHE_FIELDS_WRITE_MODE` setting.
+
+    :param instance:
+        The `Model` instance, that should have a primary key.
+    :param values:
+        A `dict` of field names and their new values.
+    :param conditions:
+        Optional filter arguments that the row should still match to store
+        the values, so values that were stored concurrently are not
+        overwritten. Only used by the `immediate` write mode.
+    :return:
+        `True` if the values are (or will be) stored, `False` otherwise.
+    """
+    write_mode = get_write_mode()
+    if write_mode == WRITE_MODE_IMMEDIATE:
+        # Bypass triggers by using update
+        queryset = instance.__class__.objects.filter(pk=instance.pk)
+        if conditions:
+            return queryset.filter(**conditions).update(**values) > 0
+        queryset.update(**values)
+    elif write_mode == WRITE_MODE_DEFERRED:
+        defer_write(instance.__class__, instance.pk, values)
+    else:
+        return False
+    return True
+
+
+def write_rows(model, rows, using=None):
+    """
+    Store (re)calculated cached values of many rows in the database,
+    according to the `DBCACHE_FIELDS_WRITE_MODE` setting.
+
+    :param model:
+        The `Model` class.
+    :param rows:
+        A `dict` where each key is a primary key and each value is a `dict`
+        of field names and their new values.
+    :param using:
+        The database alias to use. Defaults to the router's choice.
+    """
+    if not rows:
+        return
+
+    write_mode = get_write_mode()
+    if write_mode == WRITE_MODE_IMMEDIATE:
+        bulk_update_fields(model, rows, using=using)
+    elif write_mode == WRITE_MODE_DEFERRED:
+        for pk, values in rows.items():
+            defer_write(model, pk, values)
+
+
+def flush():
+    """
+    Write all deferred cached values that were collected outside of a
+    transaction to the database.
+    """
+    buffer = getattr(_local, 'request_buffer', None)
+    if buffer:
+        buffer.flush()
+
+
+def flush_on_request_finished(sender, **kwargs):
+    """
+    Write all deferred cached values at the end of a request.
+    """
+    buffer = getattr(_local, 'request_buffer', None)
+    if buffer:
+        buffer.flush()
+        # The connection could be closed already at the end of the request.
+        close_old_connections()
@@ -45,13 +45,13 @@ classes = """
     Programming Language :: Python :: 3.4
     Programming Language :: Python :: 3.5
     Programming Language :: Python :: 3.6
+    Programming Language :: Python :: 3.7
     Programming Language :: Python :: Implementation :: CPython
     Framework :: Django
-    Framework :: Django :: 1.8
-    Framework :: Django :: 1.9
-    Framework :: Django :: 1.10
     Framework :: Django :: 1.11
     Framework :: Django :: 2.0
+    Framework :: Django :: 2.1
+    Framework :: Django :: 2.2
     Operating System :: OS Independent
     Topic :: Communications
     Topic :: System :: Distributed Computing
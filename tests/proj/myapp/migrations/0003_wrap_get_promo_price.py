@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0002_auto_20171101_1733'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wrap',
+            name='_get_promo_price_cached',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True),
+        ),
+        migrations.AddField(
+            model_name='wrap',
+            name='_get_promo_price_cached_valid',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
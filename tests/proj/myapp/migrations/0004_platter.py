@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_wrap_get_promo_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Platter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('base_price', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('_get_price_cached', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('ingredients', models.ManyToManyField(to='myapp.Ingredient')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_soup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sauce',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=4)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Taco',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('base_price', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('_get_price_cached', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('_get_price_cached_stale_since', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('ingredients', models.ManyToManyField(to='myapp.Ingredient')),
+                ('sauce', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='myapp.Sauce')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -1,17 +1,23 @@
 from __future__ import absolute_import, unicode_literals
 
+from datetime import timedelta
 from decimal import Decimal
 
 from django.db import models
-from django.db.models import Sum
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
 
 from django_dbcache_fields.decorators import dbcache
+from django_dbcache_fields.managers import DBCacheManager
 
 
 class Ingredient(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=4, decimal_places=2)
 
+    # Invalidate the related dbcache fields on bulk changes as well.
+    objects = DBCacheManager()
+
 
 class BaseDish(models.Model):
     name = models.CharField(max_length=100)
@@ -27,6 +33,8 @@ class Drink(models.Model):
     name = models.CharField(max_length=100)
     base_price = models.DecimalField(max_digits=5, decimal_places=2)
 
+    objects = DBCacheManager()
+
     @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True))
     def get_price(self):
         return self.base_price
@@ -39,8 +47,9 @@ class Drink(models.Model):
 
 # Basic use
 class Pizza(BaseDish):
+    objects = DBCacheManager()
 
-    @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True))
+    @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True), requires_pk=True)
     def get_price(self):
         ingredients_price = self.ingredients.aggregate(total=Sum('price'))['total'] or Decimal()
         return self.base_price + ingredients_price
@@ -61,7 +70,7 @@ class Lasagna(BaseDish):
         self._old_base_price = self.base_price
 
     @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True),
-             dirty_func=is_base_price_changed)
+             dirty_func=is_base_price_changed, requires_pk=True)
     def get_price(self):
         ingredients_price = self.ingredients.aggregate(total=Sum('price'))['total'] or Decimal()
         return self.base_price + ingredients_price
@@ -76,9 +85,11 @@ class WrapType(models.Model):
 class Wrap(BaseDish):
     wrap_type = models.ForeignKey(WrapType, null=True, on_delete=models.SET_NULL)
 
-    # Also intentionally added WrapDemo twice.
+    objects = DBCacheManager()
+
+    # Also intentionally added wrappromo_set twice.
     @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True),
-             invalidated_by=['myapp.Ingredient', 'myapp.WrapType', 'myapp.WrapPromo', 'myapp.WrapPromo'])
+             invalidated_by=['ingredients', 'wrap_type', 'wrappromo_set', 'wrappromo_set'], requires_pk=True)
     def get_price(self):
         promo = self.wrappromo_set.first()
         if promo:
@@ -90,13 +101,20 @@ class Wrap(BaseDish):
 
     # Multiple dbcache fields using the same invalidated by model.
     @dbcache(models.CharField(max_length=100, blank=True, null=True),
-             invalidated_by=['myapp.WrapPromo', ])
+             invalidated_by=['wrappromo_set', ], requires_pk=True)
     def get_promo_text(self):
         promo = self.wrappromo_set.first()
         if not promo:
             return 'Awwww, no promotion at this time'
         return 'Now, only EUR {:.2f}'.format(promo.promo_price)
 
+    # None is a valid value to cache.
+    @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True),
+             invalidated_by=['wrappromo_set', ], requires_pk=True, cache_none=True)
+    def get_promo_price(self):
+        promo = self.wrappromo_set.first()
+        return promo.promo_price if promo else None
+
 
 class WrapPromo(models.Model):
     wrap = models.ForeignKey(Wrap, on_delete=models.CASCADE)
@@ -104,19 +122,87 @@ class WrapPromo(models.Model):
 
 
 class WrapDeluxe(BaseDish):
+    objects = DBCacheManager()
+
     # Same invalidated_by model on different models.
     @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True),
-             invalidated_by=['myapp.Ingredient', ])
+             invalidated_by=['myapp.Ingredient', ], requires_pk=True,
+             bulk=F('base_price') + Coalesce(Sum('ingredients__price'), Value(Decimal())))
     def get_price(self):
         ingredients_price = self.ingredients.aggregate(total=Sum('price'))['total'] or Decimal()
         return self.base_price + ingredients_price
 
 
+# Recalculated in the database on invalidation.
+class Platter(BaseDish):
+    @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True),
+             invalidated_by=['ingredients'], requires_pk=True, eager=True,
+             bulk=F('base_price') + Coalesce(Sum('ingredients__price'), Value(Decimal())))
+    def get_price(self):
+        ingredients_price = self.ingredients.aggregate(total=Sum('price'))['total'] or Decimal()
+        return self.base_price + ingredients_price
+
+
+def get_salad_prices(queryset):
+    prices = queryset.annotate(ingredients_price=Sum('ingredients__price')).values_list(
+        'pk', 'base_price', 'ingredients_price')
+    return dict((pk, base_price + (ingredients_price or Decimal())) for pk, base_price, ingredients_price in prices)
+
+
 # Use with existing field
 class Salad(BaseDish):
     price = models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True)
 
-    @dbcache('price')
+    objects = DBCacheManager()
+
+    @dbcache('price', requires_pk=True, bulk=get_salad_prices)
     def get_price(self):
         ingredients_price = self.ingredients.aggregate(total=Sum('price'))['total'] or Decimal()
         return self.base_price + ingredients_price
+
+
+# Use with a second cache tier
+class Soup(BaseDish):
+    objects = DBCacheManager()
+
+    @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True),
+             invalidated_by=['ingredients'], requires_pk=True, cache='default', single_flight=True)
+    def get_price(self):
+        ingredients_price = self.ingredients.aggregate(total=Sum('price'))['total'] or Decimal()
+        return self.base_price + ingredients_price
+
+
+# Use with max_stale
+class Sauce(models.Model):
+    name = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=4, decimal_places=2)
+
+
+class Taco(BaseDish):
+    sauce = models.ForeignKey(Sauce, null=True, on_delete=models.SET_NULL)
+
+    @dbcache(models.DecimalField(max_digits=6, decimal_places=2, blank=True, null=True),
+             invalidated_by=['sauce'], max_stale=60)
+    def get_price(self):
+        sauce_price = self.sauce.price if self.sauce else Decimal()
+        return self.base_price + sauce_price
+
+    # Use with ttl, like methods that depend on the time.
+    @dbcache(models.CharField(max_length=100, blank=True, null=True), ttl=timedelta(minutes=5))
+    def get_label(self):
+        return '{} taco'.format(self.name)
+
+
+# Use with invalidated_by, by a model with a many-to-many relation to this
+# model.
+class Combo(models.Model):
+    name = models.CharField(max_length=100)
+
+    @dbcache(models.PositiveIntegerField(blank=True, null=True), invalidated_by=['myapp.Menu'], requires_pk=True)
+    def get_menu_count(self):
+        return self.menu_set.count()
+
+
+class Menu(models.Model):
+    name = models.CharField(max_length=100)
+    combos = models.ManyToManyField(Combo, blank=True)
@@ -0,0 +1,111 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.db import models, transaction
+from django.test import TransactionTestCase
+
+from django_dbcache_fields.cache import get_cached_value, get_version, make_key, purge_values
+from django_dbcache_fields.decorators import dbcache
+from django_dbcache_fields.refresh import refresh_dbcache
+from django_dbcache_fields.utils import get_dbcache_entries
+from tests.proj.myapp.models import Ingredient, Soup
+
+
+class CacheTests(TransactionTestCase):
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+        self.tomato = Ingredient.objects.create(name='tomato', price=Decimal('0.75'))
+        self.soup = Soup.objects.create(name='tomato', base_price=Decimal('4.00'))
+        self.soup.ingredients.add(self.tomato)
+        self.soup.save()
+
+    def get_cached(self, soup):
+        version = get_version(self.cache, 'myapp.Soup', '_get_price_cached')
+        return self.cache.get(make_key('myapp.Soup', '_get_price_cached', version, soup.pk))
+
+    def test_store_on_save(self):
+        self.assertEqual(self.get_cached(self.soup), (Decimal('4.75'),))
+
+    def test_store_on_miss(self):
+        self.cache.clear()
+        Soup.objects.update(_get_price_cached=None)
+        soup = Soup.objects.get(pk=self.soup.pk)
+
+        self.assertEqual(soup.get_price(), Decimal('4.75'))
+        self.assertEqual(self.get_cached(soup), (Decimal('4.75'),))
+
+    def test_store_on_commit(self):
+        with transaction.atomic():
+            self.soup.base_price = Decimal('5.00')
+            self.soup.save()
+            self.assertEqual(self.get_cached(self.soup), (Decimal('4.75'),))
+
+        self.assertEqual(self.get_cached(self.soup), (Decimal('5.75'),))
+
+    def test_get_cached_value(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cached_value(Soup, self.soup.pk, 'get_price'), Decimal('4.75'))
+
+    def test_get_cached_value_missing(self):
+        self.cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cached_value(Soup, self.soup.pk, 'get_price'), Decimal('4.75'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cached_value(Soup, self.soup.pk, '_get_price_cached'), Decimal('4.75'))
+
+    def test_get_cached_value_does_not_exist(self):
+        with self.assertRaises(Soup.DoesNotExist):
+            get_cached_value(Soup, self.soup.pk + 1, 'get_price')
+
+    def test_purge_on_invalidation(self):
+        other = Soup.objects.create(name='plain', base_price=Decimal('3.00'))
+
+        self.tomato.price = Decimal('1.00')
+        self.tomato.save()
+
+        self.assertIsNone(self.get_cached(self.soup))
+        self.assertEqual(self.get_cached(other), (Decimal('3.00'),))
+        self.assertEqual(get_cached_value(Soup, self.soup.pk, 'get_price'), Decimal('5.00'))
+
+    def test_purge_on_delete(self):
+        self.soup.delete()
+
+        self.assertIsNone(self.get_cached(self.soup))
+
+    def test_purge_on_refresh(self):
+        Soup.objects.update(base_price=Decimal('6.00'))
+
+        refresh_dbcache(Soup.objects.all())
+
+        self.assertIsNone(self.get_cached(self.soup))
+        self.assertEqual(get_cached_value(Soup, self.soup.pk, 'get_price'), Decimal('6.75'))
+
+    def test_purge_all(self):
+        other = Soup.objects.create(name='plain', base_price=Decimal('3.00'))
+
+        purge_values(Soup, get_dbcache_entries(Soup))
+
+        self.assertIsNone(self.get_cached(self.soup))
+        self.assertIsNone(self.get_cached(other))
+
+    def test_purge_all_on_commit(self):
+        with transaction.atomic():
+            purge_values(Soup, get_dbcache_entries(Soup))
+            # Another process stores a value before the commit.
+            version = get_version(self.cache, 'myapp.Soup', '_get_price_cached')
+            self.cache.set(make_key('myapp.Soup', '_get_price_cached', version, self.soup.pk), (Decimal('4.75'),))
+
+        self.assertIsNone(self.get_cached(self.soup))
+
+    def test_unknown_cache(self):
+        with self.assertRaises(ValueError):
+            dbcache(models.IntegerField(blank=True, null=True), cache='unknown')
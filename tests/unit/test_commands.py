@@ -0,0 +1,125 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from tests.proj.myapp.models import Drink, Pizza, Taco
+
+
+class DBCacheRebuildCommandTests(TestCase):
+    def setUp(self):
+        self.drinks = [
+            Drink.objects.create(name='drink {}'.format(i), base_price=Decimal(i)) for i in range(5)
+        ]
+        Drink.objects.update(_get_price_cached=None, _get_name_cached=None)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmp_dir, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def call_command(self, *args, **kwargs):
+        out = StringIO()
+        call_command('dbcache_rebuild', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_rebuild_all(self):
+        Pizza.objects.create(name='margarita', base_price=Decimal('10.00'))
+        Pizza.objects.update(_get_price_cached=None)
+
+        output = self.call_command()
+
+        self.assertIn('Rebuilt "myapp.Drink"', output)
+        self.assertIn('Rebuilt "myapp.Pizza"', output)
+        self.assertFalse(Drink.objects.filter(_get_price_cached__isnull=True).exists())
+        self.assertFalse(Drink.objects.filter(_get_name_cached__isnull=True).exists())
+        self.assertFalse(Pizza.objects.filter(_get_price_cached__isnull=True).exists())
+
+    def test_rebuild_model(self):
+        self.call_command('myapp.Drink')
+
+        self.assertFalse(Drink.objects.filter(_get_price_cached__isnull=True).exists())
+        self.assertFalse(Drink.objects.filter(_get_name_cached__isnull=True).exists())
+
+    def test_rebuild_method(self):
+        self.call_command('myapp.Drink.get_name')
+
+        self.assertFalse(Drink.objects.filter(_get_name_cached__isnull=True).exists())
+        self.assertEqual(Drink.objects.filter(_get_price_cached__isnull=True).count(), 5)
+
+    def test_rebuild_only_null(self):
+        Drink.objects.filter(pk=self.drinks[0].pk).update(_get_price_cached=Decimal('9.00'))
+
+        output = self.call_command('myapp.Drink.get_price', only_null=True)
+
+        self.assertIn('4 rows processed', output)
+        self.assertEqual(Drink.objects.get(pk=self.drinks[0].pk)._get_price_cached, Decimal('9.00'))
+
+    def test_rebuild_expired(self):
+        tacos = [Taco.objects.create(name='taco {}'.format(i), base_price=Decimal('2.00')) for i in range(3)]
+        Taco.objects.update(name='crispy', _get_price_cached=None)
+        Taco.objects.filter(pk=tacos[0].pk).update(_get_label_cached_computed_at=timezone.now() - timedelta(hours=1))
+
+        output = self.call_command(expired=True)
+
+        self.assertIn('Rebuilt expired "myapp.Taco": 1 rows processed', output)
+        self.assertNotIn('myapp.Drink', output)
+        self.assertEqual(list(Taco.objects.order_by('pk').values_list('_get_label_cached', flat=True)), [
+            'crispy taco', 'taco 1 taco', 'taco 2 taco',
+        ])
+        # Fields without a ttl are not rebuilt.
+        self.assertEqual(Taco.objects.filter(_get_price_cached__isnull=True).count(), 3)
+
+    def test_rebuild_expired_workers(self):
+        self.assertRaises(CommandError, self.call_command, expired=True, workers=2)
+
+    def test_rebuild_resumes_from_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'myapp.Drink': self.drinks[2].pk}, f)
+
+        output = self.call_command('myapp.Drink', checkpoint=self.checkpoint, batch_size=1)
+
+        self.assertIn('Resuming "myapp.Drink" after pk {}'.format(self.drinks[2].pk), output)
+        self.assertIn('2 rows processed', output)
+        self.assertEqual(
+            list(Drink.objects.filter(_get_price_cached__isnull=False).values_list('pk', flat=True)),
+            [d.pk for d in self.drinks[3:]])
+        # The checkpoint is removed when the rebuild is completed.
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_rebuild_stores_checkpoint(self):
+        def get_name(instance):
+            if instance.pk == self.drinks[3].pk:
+                raise RuntimeError()
+            return instance.name
+
+        from django_dbcache_fields import register
+        entry = register.get('tests.proj.myapp.models.Drink')[1]
+        original = entry['decorated_method']
+        entry['decorated_method'] = get_name
+        try:
+            self.assertRaises(RuntimeError, self.call_command, 'myapp.Drink.get_name',
+                              checkpoint=self.checkpoint, batch_size=2)
+        finally:
+            entry['decorated_method'] = original
+
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {'myapp.Drink.get_name': self.drinks[1].pk})
+
+    def test_raise_exc_for_invalid_label(self):
+        self.assertRaises(CommandError, self.call_command, 'myapp')
+        self.assertRaises(CommandError, self.call_command, 'myapp.Foo')
+        self.assertRaises(CommandError, self.call_command, 'myapp.Ingredient')
+        self.assertRaises(CommandError, self.call_command, 'myapp.Drink.get_foo')
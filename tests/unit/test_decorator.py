@@ -4,6 +4,7 @@ from __future__ import absolute_import, unicode_literals
 
 from django.core.exceptions import FieldError
 from django.db import models
+from django.db.models import F
 from django.test import TestCase
 
 from django_dbcache_fields.decorators import dbcache
@@ -23,3 +24,11 @@ class DecoratorTestCase(TestCase):
 
     def test_raise_exc_for_invalid_dirty_func(self):
         self.assertRaises(TypeError, dbcache, 'foo', dirty_func=lambda x: True)
+
+    def test_raise_exc_for_invalid_bulk(self):
+        self.assertRaises(TypeError, dbcache, 'foo', bulk='bar')
+
+    def test_raise_exc_for_eager_without_expression(self):
+        self.assertRaises(ValueError, dbcache, 'foo', eager=True)
+        self.assertRaises(ValueError, dbcache, 'foo', eager=True, bulk=lambda queryset: {})
+        dbcache('foo', eager=True, bulk=F('bar'))
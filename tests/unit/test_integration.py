@@ -4,10 +4,16 @@ from __future__ import absolute_import, unicode_literals
 
 from decimal import Decimal
 
+from django.db import connection, transaction
 from django.db.models import Sum
-from django.test import TestCase
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from tests.proj.myapp.models import Drink, Ingredient, Lasagna, Pizza, Salad, Wrap, WrapPromo, WrapType
+from django_dbcache_fields.decorators import dbcache
+from django_dbcache_fields.receivers import invalidate_dbcache_fields_by_fks, invalidate_dbcache_fields_by_m2m
+from tests.proj.myapp.models import (Combo, Drink, Ingredient, Lasagna, Menu, Pizza, Platter, Salad, Wrap, WrapDeluxe,
+                                     WrapPromo, WrapType)
 
 
 class BaseDecoratorTestCase(TestCase):
@@ -20,6 +26,21 @@ class BaseDecoratorTestCase(TestCase):
         self.beef = Ingredient.objects.create(name='beef', price=Decimal('2.50'))
 
 
+class ConnectedReceiversTests(TestCase):
+    def test_fks_receiver(self):
+        for signal in (post_save, pre_delete):
+            self.assertIn(invalidate_dbcache_fields_by_fks, signal._live_receivers(WrapType))
+            self.assertIn(invalidate_dbcache_fields_by_fks, signal._live_receivers(Ingredient))
+            # Nothing is invalidated by these models.
+            self.assertNotIn(invalidate_dbcache_fields_by_fks, signal._live_receivers(Wrap))
+            self.assertNotIn(invalidate_dbcache_fields_by_fks, signal._live_receivers(Drink))
+
+    def test_m2m_receiver(self):
+        self.assertIn(invalidate_dbcache_fields_by_m2m, m2m_changed._live_receivers(Wrap.ingredients.through))
+        # Nothing is invalidated by the ingredients of a pizza.
+        self.assertNotIn(invalidate_dbcache_fields_by_m2m, m2m_changed._live_receivers(Pizza.ingredients.through))
+
+
 class DecoratorBasicTests(BaseDecoratorTestCase):
     def setUp(self):
         super(DecoratorBasicTests, self).setUp()
@@ -368,3 +389,622 @@ class DecoratorInvalidatedByTests(BaseDecoratorTestCase):
 
         self.assertIsNone(self.dish._get_price_cached)
         self.assertEqual(self.dish.get_price(), Decimal('11.25'))
+
+    def test_saving_m2m_model_in_invalidated_by_only_affects_related_rows(self):
+        other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        other.ingredients.add(self.basil)
+        other.save()
+        self.dish.save()
+
+        with self.assertNumQueries(6):
+            # 1 query for the save,
+            # 1 query to invalidate all deluxe wraps (by model name),
+            # 1 query to invalidate the wraps with this ingredient,
+            # 1 query to recalculate the platters with this ingredient,
+            # 2 queries to invalidate the soups with this ingredient (and
+            # purge their cached values).
+            self.beef.save()
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+
+        other.refresh_from_db()
+        self.assertEqual(other._get_price_cached, Decimal('5.50'))
+
+    def test_change_fk_model_in_invalidated_by_only_affects_related_rows(self):
+        other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        self.dish.save()
+
+        self.wrap_type.save()
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+
+        other.refresh_from_db()
+        self.assertEqual(other._get_price_cached, Decimal('5.00'))
+
+    def test_change_reverse_fk_model_in_invalidated_by_only_affects_related_rows(self):
+        other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        self.dish.save()
+
+        WrapPromo.objects.create(wrap=self.dish, promo_price=Decimal('5.00'))
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+        self.assertIsNone(self.dish._get_promo_text_cached)
+
+        other.refresh_from_db()
+        self.assertEqual(other._get_price_cached, Decimal('5.00'))
+        self.assertEqual(other._get_promo_text_cached, 'Awwww, no promotion at this time')
+
+    def test_move_reverse_fk_model_in_invalidated_by(self):
+        other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        wrap_promo = WrapPromo.objects.create(wrap=self.dish, promo_price=Decimal('1.00'))
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.get_price(), Decimal('1.00'))
+
+        with self.assertNumQueries(3):
+            # 1 query for the save,
+            # 1 query to invalidate the wrap the promo moved to,
+            # 1 query to invalidate the wrap the promo moved from.
+            wrap_promo.wrap = other
+            wrap_promo.save()
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+        self.assertEqual(self.dish.get_price(), Decimal('11.25'))
+
+        other.refresh_from_db()
+        self.assertIsNone(other._get_price_cached)
+        self.assertEqual(other.get_price(), Decimal('1.00'))
+
+    def test_move_loaded_reverse_fk_model_twice(self):
+        other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        wrap_promo = WrapPromo.objects.get(pk=WrapPromo.objects.create(wrap=self.dish, promo_price=Decimal('1.00')).pk)
+        wrap_promo.wrap = other
+        wrap_promo.save()
+
+        # The foreign key is remembered again after the save.
+        self.dish.refresh_from_db()
+        self.dish.get_price()
+        other.refresh_from_db()
+        self.assertEqual(other.get_price(), Decimal('1.00'))
+        wrap_promo.wrap = self.dish
+        wrap_promo.save()
+
+        other.refresh_from_db()
+        self.assertIsNone(other._get_price_cached)
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+
+    def test_save_reverse_fk_model_with_update_fields(self):
+        wrap_promo = WrapPromo.objects.create(wrap=self.dish, promo_price=Decimal('1.00'))
+
+        with self.assertNumQueries(2):
+            # 1 query for the save,
+            # 1 query to invalidate the wrap of the promo.
+            wrap_promo.promo_price = Decimal('2.00')
+            wrap_promo.save(update_fields=['promo_price'])
+
+    def test_adding_reverse_m2m_model_in_invalidated_by(self):
+        other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        self.dish.save()
+
+        self.basil.wrap_set.add(other)
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_price_cached, Decimal('11.25'))
+
+        other.refresh_from_db()
+        self.assertIsNone(other._get_price_cached)
+        self.assertEqual(other.get_price(), Decimal('5.50'))
+
+    def test_clearing_reverse_m2m_model_in_invalidated_by(self):
+        self.dish.save()
+
+        self.beef.wrap_set.clear()
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+        self.assertEqual(self.dish.get_price(), Decimal('8.75'))
+
+    def test_delete_m2m_model_in_invalidated_by(self):
+        self.dish.save()
+
+        self.beef.delete()
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+        self.assertEqual(self.dish.get_price(), Decimal('8.75'))
+
+
+class DecoratorInvalidatedByModelNameTests(BaseDecoratorTestCase):
+    def setUp(self):
+        super(DecoratorInvalidatedByModelNameTests, self).setUp()
+
+        self.dish = WrapDeluxe.objects.create(name='deluxe', base_price=Decimal('8.00'))
+        self.other = WrapDeluxe.objects.create(name='veggie', base_price=Decimal('5.00'))
+
+    def test_saving_model_in_invalidated_by_affects_all_rows(self):
+        self.assertEqual(self.dish._get_price_cached, Decimal('8.00'))
+
+        self.beef.save()
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached)
+
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other._get_price_cached)
+
+    def test_adding_m2m_declared_on_model_in_invalidated_by(self):
+        combo = Combo.objects.create(name='lunch')
+        menu = Menu.objects.create(name='summer')
+        self.assertEqual(combo._get_menu_count_cached, 0)
+
+        combo.menu_set.add(menu)
+
+        combo.refresh_from_db()
+        self.assertIsNone(combo._get_menu_count_cached)
+        self.assertEqual(combo.get_menu_count(), 1)
+
+    def test_clearing_m2m_declared_on_model_in_invalidated_by(self):
+        combo = Combo.objects.create(name='lunch')
+        menu = Menu.objects.create(name='summer')
+        combo.menu_set.add(menu)
+        combo.refresh_from_db()
+        self.assertEqual(combo.get_menu_count(), 1)
+
+        combo.menu_set.clear()
+
+        combo.refresh_from_db()
+        self.assertIsNone(combo._get_menu_count_cached)
+        self.assertEqual(combo.get_menu_count(), 0)
+
+
+@override_settings(DBCACHE_FIELDS_PRE_SAVE=True)
+class DecoratorPreSaveTests(BaseDecoratorTestCase):
+    def test_create(self):
+        with self.assertNumQueries(1):
+            # 1 query for the create, including the cached fields.
+            drink = Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+
+        drink.refresh_from_db()
+        self.assertEqual(drink._get_price_cached, Decimal('2.00'))
+        self.assertEqual(drink._get_name_cached, 'cola')
+
+    def test_save(self):
+        drink = Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+        drink.base_price = Decimal('2.50')
+
+        with self.assertNumQueries(1):
+            # 1 query for the save, including the cached fields.
+            drink.save()
+
+        drink.refresh_from_db()
+        self.assertEqual(drink._get_price_cached, Decimal('2.50'))
+
+    def test_save_with_update_fields(self):
+        drink = Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+        drink.name = 'coke'
+        drink.base_price = Decimal('2.50')
+
+        with self.assertNumQueries(2):
+            # 1 query for the save, including the cached name,
+            # 1 query for the update of the cached price, which was not
+            # included in the update fields.
+            drink.save(update_fields=['name', 'base_price', '_get_name_cached'])
+
+        drink.refresh_from_db()
+        self.assertEqual(drink._get_price_cached, Decimal('2.50'))
+        self.assertEqual(drink._get_name_cached, 'coke')
+
+    def test_create_requires_pk(self):
+        with self.assertNumQueries(3):
+            # 1 call for the create,
+            # 1 for the calculating _get_price_cached value after the create,
+            # 1 for storing the value in the database.
+            pizza = Pizza.objects.create(name='hawaii', base_price=Decimal('10.00'))
+
+        pizza.refresh_from_db()
+        self.assertEqual(pizza._get_price_cached, Decimal('10.00'))
+
+    def test_save_when_not_dirty(self):
+        lasagna = Lasagna.objects.create(name='classic', base_price=Decimal('8.00'))
+        lasagna = Lasagna.objects.get(pk=lasagna.pk)
+        lasagna.name = 'original'
+
+        with self.assertNumQueries(1):
+            # 1 query for the save.
+            lasagna.save()
+
+
+class DecoratorCacheNoneTests(BaseDecoratorTestCase):
+    def setUp(self):
+        super(DecoratorCacheNoneTests, self).setUp()
+
+        wrap = Wrap.objects.create(name='classic', base_price=Decimal('6.00'))
+        self.dish = Wrap.objects.get(pk=wrap.pk)
+
+    def test_initial(self):
+        self.assertIsNone(self.dish._get_promo_price_cached)
+        self.assertTrue(self.dish._get_promo_price_cached_valid)
+
+    def test_call_method_when_cached_none(self):
+        with self.assertNumQueries(0):
+            result = self.dish.get_promo_price()
+
+        self.assertIsNone(result)
+
+    def test_call_method_when_invalid(self):
+        self.dish._get_promo_price_cached_valid = False
+
+        with self.assertNumQueries(2):
+            # 1 query for the promo within the get_promo_price function,
+            # 1 query to mark the cached value as valid.
+            result = self.dish.get_promo_price()
+
+        self.assertIsNone(result)
+
+        with self.assertNumQueries(0):
+            self.dish.get_promo_price()
+
+        self.dish.refresh_from_db()
+        self.assertTrue(self.dish._get_promo_price_cached_valid)
+
+    def test_invalidation_keeps_value(self):
+        WrapPromo.objects.create(wrap=self.dish, promo_price=Decimal('5.00'))
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.get_promo_price(), Decimal('5.00'))
+
+        WrapPromo.objects.update(promo_price=Decimal('4.00'))
+        WrapPromo.objects.get().save()
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_promo_price_cached, Decimal('5.00'))
+        self.assertFalse(self.dish._get_promo_price_cached_valid)
+        self.assertEqual(self.dish.get_promo_price(), Decimal('4.00'))
+
+    def test_save_marks_valid(self):
+        Wrap.objects.update(_get_promo_price_cached_valid=False)
+        self.dish.refresh_from_db()
+
+        self.dish.save()
+
+        self.dish.refresh_from_db()
+        self.assertTrue(self.dish._get_promo_price_cached_valid)
+
+
+class DecoratorEagerTests(BaseDecoratorTestCase):
+    def setUp(self):
+        super(DecoratorEagerTests, self).setUp()
+
+        self.dish = Platter.objects.create(name='mixed', base_price=Decimal('10.00'))
+        self.dish.ingredients.add(self.tomato, self.beef)
+        self.other = Platter.objects.create(name='veggie', base_price=Decimal('8.00'))
+        self.other.ingredients.add(self.tomato)
+
+    def get_prices(self):
+        return list(Platter.objects.order_by('pk').values_list('_get_price_cached', flat=True))
+
+    def test_initial(self):
+        self.assertEqual(self.get_prices(), [Decimal('13.25'), Decimal('8.75')])
+
+    def test_saving_related_model_recalculates(self):
+        self.beef.price = Decimal('3.00')
+
+        with self.assertNumQueries(6):
+            # 1 query for the save,
+            # 1 query to invalidate all deluxe wraps (by model name),
+            # 1 query to invalidate the wraps with this ingredient,
+            # 1 query to recalculate the platters with this ingredient,
+            # 2 queries to invalidate the soups with this ingredient (and
+            # purge their cached values).
+            self.beef.save()
+
+        self.assertEqual(self.get_prices(), [Decimal('13.75'), Decimal('8.75')])
+
+    def test_deleting_related_model_recalculates(self):
+        self.tomato.delete()
+
+        self.assertEqual(self.get_prices(), [Decimal('12.50'), Decimal('8.00')])
+
+    def test_changing_m2m_recalculates(self):
+        self.dish.ingredients.remove(self.beef)
+        self.assertEqual(self.get_prices(), [Decimal('10.75'), Decimal('8.75')])
+
+        self.dish.ingredients.clear()
+        self.assertEqual(self.get_prices(), [Decimal('10.00'), Decimal('8.75')])
+
+    def test_changing_reverse_m2m_recalculates(self):
+        self.basil.platter_set.add(self.other)
+        self.assertEqual(self.get_prices(), [Decimal('13.25'), Decimal('9.25')])
+
+        self.tomato.platter_set.clear()
+        self.assertEqual(self.get_prices(), [Decimal('12.50'), Decimal('8.50')])
+
+    def test_recalculated_value_is_used(self):
+        self.beef.delete()
+
+        dish = Platter.objects.get(pk=self.dish.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(dish.get_price(), Decimal('10.75'))
+
+
+class DecoratorMemoTests(BaseDecoratorTestCase):
+    def setUp(self):
+        super(DecoratorMemoTests, self).setUp()
+
+        self.dish = Wrap.objects.create(name='classic', base_price=Decimal('6.00'))
+        self.dish.ingredients.add(self.tomato)
+        self.dish = Wrap.objects.get(pk=self.dish.pk)
+
+    def test_use_dbcache_false(self):
+        with self.assertNumQueries(3):
+            # 1 query for the promotion and 1 for the aggregate within the
+            # get_price function,
+            # 1 query for the update of the cached field.
+            self.assertEqual(self.dish.get_price(use_dbcache=False), Decimal('6.75'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.dish.get_price(use_dbcache=False), Decimal('6.75'))
+
+    def test_save_clears_memo(self):
+        self.dish.get_price(use_dbcache=False)
+
+        self.dish.base_price = Decimal('7.00')
+        self.dish.save()
+
+        self.assertEqual(self.dish.get_price(use_dbcache=False), Decimal('7.75'))
+
+    def test_refresh_from_db_clears_memo(self):
+        self.dish.get_price(use_dbcache=False)
+        Wrap.objects.filter(pk=self.dish.pk).update(base_price=Decimal('7.00'))
+
+        self.dish.refresh_from_db()
+
+        self.assertEqual(self.dish.get_price(use_dbcache=False), Decimal('7.75'))
+
+    def test_invalidation_clears_memo(self):
+        self.dish.get_price(use_dbcache=False)
+
+        self.dish.ingredients.add(self.basil)
+
+        self.assertEqual(self.dish.get_price(use_dbcache=False), Decimal('7.25'))
+
+    def test_memo_is_per_instance(self):
+        self.dish.get_price(use_dbcache=False)
+
+        other = Wrap.objects.get(pk=self.dish.pk)
+        with self.assertNumQueries(2):
+            # 1 query for the promotion and 1 for the aggregate within the
+            # get_price function, the cached field did not change.
+            other.get_price(use_dbcache=False)
+
+
+@override_settings(DBCACHE_FIELDS_COALESCE_INVALIDATIONS=True)
+class CoalesceInvalidationsTests(TransactionTestCase):
+    def setUp(self):
+        self.wrap = Wrap.objects.create(name='classic', base_price=Decimal('6.00'))
+        self.other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        self.tomato = Ingredient.objects.create(name='tomato', price=Decimal('0.75'))
+        self.platter = Platter.objects.create(name='mixed', base_price=Decimal('10.00'))
+        self.platter.ingredients.add(self.tomato)
+
+    def count_updates(self, queries, table):
+        return len([q for q in queries if q['sql'].startswith('UPDATE "{}"'.format(table))])
+
+    def test_single_update_on_commit(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                for i in range(5):
+                    WrapPromo.objects.create(wrap=self.wrap, promo_price=Decimal(i))
+
+                self.assertEqual(self.count_updates(queries, 'myapp_wrap'), 0)
+                self.wrap.refresh_from_db()
+                self.assertEqual(self.wrap._get_price_cached, Decimal('6.00'))
+
+        self.assertEqual(self.count_updates(queries, 'myapp_wrap'), 1)
+
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+        self.assertIsNone(self.wrap._get_promo_text_cached)
+        self.assertFalse(self.wrap._get_promo_price_cached_valid)
+
+        self.other.refresh_from_db()
+        self.assertEqual(self.other._get_price_cached, Decimal('5.00'))
+
+    def test_delete(self):
+        promo = WrapPromo.objects.create(wrap=self.wrap, promo_price=Decimal('4.00'))
+        Wrap.objects.update(_get_price_cached=Decimal('1.00'))
+
+        with transaction.atomic():
+            promo.delete()
+
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other._get_price_cached, Decimal('1.00'))
+
+    def test_eager_after_delete(self):
+        with transaction.atomic():
+            self.tomato.price = Decimal('1.00')
+            self.tomato.save()
+            self.tomato.delete()
+
+        self.platter.refresh_from_db()
+        self.assertEqual(self.platter._get_price_cached, Decimal('10.00'))
+
+    def test_discard_on_rollback(self):
+        try:
+            with transaction.atomic():
+                WrapPromo.objects.create(wrap=self.wrap, promo_price=Decimal('4.00'))
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        self.wrap.refresh_from_db()
+        self.assertEqual(self.wrap._get_price_cached, Decimal('6.00'))
+
+    def test_immediate_outside_transaction(self):
+        WrapPromo.objects.create(wrap=self.wrap, promo_price=Decimal('4.00'))
+
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+
+
+class BatchTests(BaseDecoratorTestCase):
+    def setUp(self):
+        super(BatchTests, self).setUp()
+
+        self.wrap = Wrap.objects.create(name='classic', base_price=Decimal('6.00'))
+        self.wrap.ingredients.add(self.beef)
+        self.wrap.save()
+        self.other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+
+    def test_recalculate_saved_instances(self):
+        with self.assertNumQueries(3):
+            # 1 query per create, without calculating the cached fields.
+            with dbcache.batch() as batch:
+                drinks = [Drink.objects.create(name='drink {}'.format(i), base_price=Decimal(i)) for i in range(3)]
+                self.assertEqual(len(batch.saved['tests.proj.myapp.models.Drink']), 3)
+
+                # Leave the batch, without the recalculation.
+                batch.replay = False
+
+        self.assertEqual(Drink.objects.filter(_get_price_cached__isnull=True).count(), 3)
+
+        with dbcache.batch():
+            for drink in drinks:
+                drink.save()
+
+        self.assertEqual(list(Drink.objects.order_by('pk').values_list('_get_price_cached', '_get_name_cached')), [
+            (Decimal('0.00'), 'drink 0'), (Decimal('1.00'), 'drink 1'), (Decimal('2.00'), 'drink 2')
+        ])
+
+    def test_recalculate_in_bulk(self):
+        drinks = [Drink.objects.create(name='drink {}'.format(i), base_price=Decimal(i)) for i in range(3)]
+
+        with dbcache.batch() as batch:
+            for drink in drinks:
+                drink.name = 'new {}'.format(drink.name)
+                drink.save()
+            batch.replay = False
+
+        with self.assertNumQueries(2):
+            # 1 query to fetch the saved drinks,
+            # 1 query to update their cached fields.
+            batch.flush()
+
+        self.assertFalse(Drink.objects.exclude(_get_name_cached__startswith='new').exists())
+
+    def test_single_invalidation(self):
+        with self.assertNumQueries(3):
+            # 1 query per save, without invalidation.
+            with dbcache.batch() as batch:
+                for i in range(3):
+                    self.beef.save()
+                batch.replay = False
+
+        self.wrap.refresh_from_db()
+        self.assertIsNotNone(self.wrap._get_price_cached)
+
+        with CaptureQueriesContext(connection) as queries:
+            with dbcache.batch():
+                for i in range(3):
+                    self.beef.save()
+
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "myapp_wrap"')]), 1)
+
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+        self.other.refresh_from_db()
+        self.assertIsNotNone(self.other._get_price_cached)
+
+    def test_delete(self):
+        with dbcache.batch():
+            self.beef.delete()
+
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+        self.assertEqual(self.wrap.get_price(), Decimal('6.00'))
+
+    def test_no_recalculation_on_exception_in_transaction(self):
+        try:
+            with dbcache.batch():
+                drink = Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        drink.refresh_from_db()
+        self.assertIsNone(drink._get_price_cached)
+
+    def test_suspended(self):
+        with dbcache.suspended() as batch:
+            drink = Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+            self.beef.save()
+
+        self.assertEqual(batch.saved, {})
+        self.assertEqual(len(batch.invalidations), 0)
+
+        drink.refresh_from_db()
+        self.assertIsNone(drink._get_price_cached)
+        self.wrap.refresh_from_db()
+        self.assertIsNotNone(self.wrap._get_price_cached)
+
+    def test_nested(self):
+        with dbcache.batch():
+            with dbcache.suspended():
+                Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+            Drink.objects.create(name='tea', base_price=Decimal('1.00'))
+
+        self.assertEqual(list(Drink.objects.filter(_get_name_cached__isnull=False).values_list('name', flat=True)),
+                         ['tea'])
+
+
+class BatchExceptionTests(TransactionTestCase):
+    def setUp(self):
+        self.beef = Ingredient.objects.create(name='beef', price=Decimal('2.00'))
+        self.dish = WrapDeluxe.objects.create(name='deluxe', base_price=Decimal('0.00'))
+        self.dish.ingredients.add(self.beef)
+        self.dish.save()
+
+    def change_price(self):
+        with dbcache.batch():
+            self.beef.price = Decimal('3.00')
+            self.beef.save()
+            Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+            raise RuntimeError()
+
+    def assertProcessed(self, processed):
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_price_cached is None, processed)
+        self.assertEqual(Drink.objects.filter(_get_price_cached=Decimal('2.00')).exists(), processed)
+
+    def test_exception(self):
+        self.assertEqual(self.dish._get_price_cached, Decimal('2.00'))
+
+        with self.assertRaises(RuntimeError):
+            self.change_price()
+
+        # The saves before the exception are stored, so they are processed.
+        self.assertProcessed(True)
+        self.assertEqual(self.dish.get_price(), Decimal('3.00'))
+
+    def test_exception_rolled_back(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.change_price()
+
+        self.assertProcessed(False)
+        self.assertEqual(Ingredient.objects.get().price, Decimal('2.00'))
+
+    def test_exception_committed(self):
+        with transaction.atomic():
+            try:
+                self.change_price()
+            except RuntimeError:
+                pass
+            self.assertProcessed(False)
+
+        self.assertProcessed(True)
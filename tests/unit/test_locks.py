@@ -0,0 +1,143 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+from timeit import default_timer
+
+from django.core.cache import caches
+from django.test import TransactionTestCase, override_settings
+
+from django_dbcache_fields.locks import acquire_lock, get_lock_key, release_lock, wait_for_value
+from django_dbcache_fields.metrics import registry
+from django_dbcache_fields.utils import get_dbcache_entries
+from django_dbcache_fields.writeback import write_values
+from tests.proj.myapp.models import Ingredient, Soup
+
+
+class LockTests(TransactionTestCase):
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+        self.tomato = Ingredient.objects.create(name='tomato', price=Decimal('0.75'))
+        self.soup = Soup.objects.create(name='tomato', base_price=Decimal('4.00'))
+        self.soup.ingredients.add(self.tomato)
+        self.soup.save()
+
+        # The value is missing when the soup is fetched.
+        Soup.objects.update(_get_price_cached=None)
+        self.soup = Soup.objects.get(pk=self.soup.pk)
+
+    def acquire(self):
+        lock = acquire_lock(Soup, self.soup.pk, '_get_price_cached', 'default')
+        self.addCleanup(release_lock, lock)
+        return lock
+
+    def test_acquire_release(self):
+        lock = self.acquire()
+        self.assertIsNotNone(lock)
+        self.assertIsNone(acquire_lock(Soup, self.soup.pk, '_get_price_cached'))
+
+        release_lock(lock)
+        self.assertIsNotNone(self.acquire())
+
+    def test_release_other_lock(self):
+        lock = self.acquire()
+        self.cache.set(get_lock_key(Soup, self.soup.pk, '_get_price_cached'), 'other')
+
+        release_lock(lock)
+
+        self.assertEqual(self.cache.get(get_lock_key(Soup, self.soup.pk, '_get_price_cached')), 'other')
+
+    def test_miss(self):
+        with self.assertNumQueries(2):
+            # 1 query for the ingredients within the get_price function,
+            # 1 query for the update of the cached field.
+            self.assertEqual(self.soup.get_price(), Decimal('4.75'))
+
+        self.soup.refresh_from_db()
+        self.assertEqual(self.soup._get_price_cached, Decimal('4.75'))
+        # The lock is released.
+        self.assertIsNotNone(self.acquire())
+
+    def test_wait_for_value(self):
+        self.acquire()
+        # Another process stores the value while it holds the lock.
+        Soup.objects.update(_get_price_cached=Decimal('4.75'))
+
+        with self.assertNumQueries(1):
+            # 1 query to check whether the value is stored.
+            self.assertEqual(self.soup.get_price(), Decimal('4.75'))
+
+    @override_settings(DBCACHE_FIELDS_SINGLE_FLIGHT_WAIT=0)
+    def test_wait_timeout(self):
+        self.acquire()
+
+        with self.assertNumQueries(1):
+            # 1 query for the ingredients within the get_price function.
+            self.assertEqual(self.soup.get_price(), Decimal('4.75'))
+
+        # The value is left to the process that holds the lock.
+        self.assertIsNone(Soup.objects.get(pk=self.soup.pk)._get_price_cached)
+
+    def test_wait_for_deleted_row(self):
+        entry = get_dbcache_entries(Soup, ['get_price'])[0]
+        Soup.objects.all().delete()
+
+        self.assertFalse(wait_for_value(self.soup, entry, 1))
+
+    @override_settings(DBCACHE_FIELDS_SINGLE_FLIGHT_WAIT=10)
+    def test_wait_for_released_lock(self):
+        entry = get_dbcache_entries(Soup, ['get_price'])[0]
+        # The process that held the lock did not store the value.
+        start = default_timer()
+        self.assertFalse(wait_for_value(self.soup, entry, 10))
+        self.assertLess(default_timer() - start, 1)
+
+    @override_settings(DBCACHE_FIELDS_SINGLE_FLIGHT_WAIT=10, DBCACHE_FIELDS_WRITE_MODE='readonly')
+    def test_readonly(self):
+        self.acquire()
+
+        start = default_timer()
+        with self.assertNumQueries(1):
+            # 1 query for the ingredients within the get_price function.
+            self.assertEqual(self.soup.get_price(), Decimal('4.75'))
+        # The lock is ignored, since the value is not stored.
+        self.assertLess(default_timer() - start, 1)
+
+    @override_settings(DBCACHE_FIELDS_SINGLE_FLIGHT_WAIT=10, DBCACHE_FIELDS_WRITE_MODE='deferred')
+    def test_deferred(self):
+        self.acquire()
+
+        start = default_timer()
+        with self.assertNumQueries(1):
+            # 1 query for the ingredients within the get_price function.
+            self.assertEqual(self.soup.get_price(), Decimal('4.75'))
+        self.assertLess(default_timer() - start, 1)
+
+    def test_concurrent_store(self):
+        # Another process stores a value after the soup was fetched.
+        Soup.objects.update(_get_price_cached=Decimal('9.99'))
+
+        self.assertEqual(self.soup.get_price(), Decimal('4.75'))
+
+        self.assertEqual(Soup.objects.get(pk=self.soup.pk)._get_price_cached, Decimal('9.99'))
+
+    def test_write_values_conditions(self):
+        self.assertFalse(write_values(self.soup, {'name': 'plain'}, {'_get_price_cached': Decimal('9.99')}))
+        self.assertTrue(write_values(self.soup, {'name': 'plain'}, {'_get_price_cached': None}))
+
+        self.assertEqual(Soup.objects.get(pk=self.soup.pk).name, 'plain')
+
+    @override_settings(DBCACHE_FIELDS_METRICS=True)
+    def test_metrics(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.acquire()
+        Soup.objects.update(_get_price_cached=Decimal('4.75'))
+
+        self.soup.get_price()
+
+        self.assertEqual(registry.get('myapp.Soup', '_get_price_cached'), {'lock_waits': 1})
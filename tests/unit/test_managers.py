@@ -0,0 +1,258 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings, skipIfDBFeature
+
+from django_dbcache_fields.decorators import dbcache
+from tests.proj.myapp.models import Drink, Ingredient, Pizza, Platter, Salad, Wrap, WrapDeluxe
+
+
+class WithDBCacheTests(TestCase):
+    def setUp(self):
+        tomato = Ingredient.objects.create(name='tomato', price=Decimal('0.75'))
+        for i in range(3):
+            pizza = Pizza.objects.create(name='pizza {}'.format(i), base_price=Decimal(10 + i))
+            pizza.ingredients.add(tomato)
+        Pizza.objects.update(_get_price_cached=None)
+
+    def test_calculate_missing_values(self):
+        with self.assertNumQueries(5):
+            # 1 query to fetch the pizza's,
+            # 1 query per pizza for the aggregate within the get_price function,
+            # 1 query to update all cached fields.
+            pizzas = list(Pizza.objects.with_dbcache('get_price'))
+
+        with self.assertNumQueries(0):
+            prices = [pizza.get_price() for pizza in pizzas]
+
+        self.assertEqual(prices, [Decimal('10.75'), Decimal('11.75'), Decimal('12.75')])
+        self.assertFalse(Pizza.objects.filter(_get_price_cached__isnull=True).exists())
+
+    def test_only_missing_values(self):
+        Pizza.objects.filter(name='pizza 0').update(_get_price_cached=Decimal('1.00'))
+
+        with self.assertNumQueries(4):
+            # 1 query to fetch the pizza's,
+            # 1 query per uncached pizza for the aggregate,
+            # 1 query to update all cached fields.
+            pizzas = list(Pizza.objects.with_dbcache())
+
+        self.assertEqual(pizzas[0].get_price(), Decimal('1.00'))
+
+    def test_nothing_missing(self):
+        list(Pizza.objects.with_dbcache())
+
+        with self.assertNumQueries(1):
+            list(Pizza.objects.with_dbcache())
+
+    def test_undefer_cached_fields(self):
+        with self.assertNumQueries(5):
+            # 1 query to fetch the pizza's, including the cached field,
+            # 1 query per pizza for the aggregate within the get_price function,
+            # 1 query to update all cached fields.
+            pizzas = list(Pizza.objects.only('name', 'base_price').with_dbcache('get_price'))
+
+        with self.assertNumQueries(0):
+            [pizza.get_price() for pizza in pizzas]
+
+        with self.assertNumQueries(1):
+            pizzas = list(Pizza.objects.defer('_get_price_cached').with_dbcache('get_price'))
+
+        with self.assertNumQueries(0):
+            [pizza._get_price_cached for pizza in pizzas]
+
+    def test_undefer_after_with_dbcache(self):
+        list(Pizza.objects.with_dbcache())
+
+        with self.assertNumQueries(1):
+            pizzas = list(Pizza.objects.with_dbcache('get_price').only('name'))
+
+        with self.assertNumQueries(0):
+            [pizza.get_price() for pizza in pizzas]
+
+    def test_chained(self):
+        queryset = Pizza.objects.with_dbcache('get_price').filter(name='pizza 1')
+
+        with self.assertNumQueries(3):
+            pizzas = list(queryset)
+
+        self.assertEqual(pizzas[0]._get_price_cached, Decimal('11.75'))
+
+    def test_values_are_not_affected(self):
+        with self.assertNumQueries(1):
+            names = list(Pizza.objects.with_dbcache('get_price').values_list('name', flat=True))
+
+        self.assertEqual(len(names), 3)
+
+    @override_settings(DBCACHE_FIELDS_WRITE_MODE='readonly')
+    def test_readonly_write_mode(self):
+        with self.assertNumQueries(4):
+            # 1 query to fetch the pizza's,
+            # 1 query per pizza for the aggregate within the get_price function.
+            pizzas = list(Pizza.objects.with_dbcache('get_price'))
+
+        self.assertEqual(pizzas[0]._get_price_cached, Decimal('10.75'))
+        self.assertEqual(Pizza.objects.filter(_get_price_cached__isnull=True).count(), 3)
+
+    def test_cache_none(self):
+        Wrap.objects.create(name='classic', base_price=Decimal('6.00'))
+        Wrap.objects.update(_get_promo_price_cached_valid=False)
+
+        wraps = list(Wrap.objects.with_dbcache('get_promo_price'))
+
+        self.assertTrue(wraps[0]._get_promo_price_cached_valid)
+        self.assertTrue(Wrap.objects.get()._get_promo_price_cached_valid)
+
+    def test_raise_exc_for_unknown_field(self):
+        self.assertRaises(ValueError, Drink.objects.with_dbcache, 'get_foo')
+
+
+class WithDBCacheBulkTests(TestCase):
+    def setUp(self):
+        tomato = Ingredient.objects.create(name='tomato', price=Decimal('0.75'))
+        for i in range(3):
+            WrapDeluxe.objects.create(name='wrap {}'.format(i), base_price=Decimal(10 + i)).ingredients.add(tomato)
+            Salad.objects.create(name='salad {}'.format(i), base_price=Decimal(10 + i)).ingredients.add(tomato)
+        WrapDeluxe.objects.update(_get_price_cached=None)
+        Salad.objects.update(price=None)
+
+    def test_calculate_expression(self):
+        with self.assertNumQueries(3):
+            # 1 query to fetch the wraps,
+            # 1 query to calculate the prices of all wraps,
+            # 1 query to update all cached fields.
+            wraps = list(WrapDeluxe.objects.with_dbcache('get_price'))
+
+        with self.assertNumQueries(0):
+            prices = [wrap.get_price() for wrap in wraps]
+
+        self.assertEqual(prices, [Decimal('10.75'), Decimal('11.75'), Decimal('12.75')])
+        self.assertFalse(WrapDeluxe.objects.filter(_get_price_cached__isnull=True).exists())
+
+    def test_calculate_callable(self):
+        with self.assertNumQueries(3):
+            # 1 query to fetch the salads,
+            # 1 query to calculate the prices of all salads,
+            # 1 query to update all cached fields.
+            salads = list(Salad.objects.with_dbcache())
+
+        self.assertEqual([salad.price for salad in salads], [Decimal('10.75'), Decimal('11.75'), Decimal('12.75')])
+        self.assertFalse(Salad.objects.filter(price__isnull=True).exists())
+
+
+class BulkChangesTests(TestCase):
+    def setUp(self):
+        self.drinks = [Drink.objects.create(name='drink {}'.format(i), base_price=Decimal(i)) for i in range(3)]
+
+        self.tomato = Ingredient.objects.create(name='tomato', price=Decimal('0.75'))
+        self.wrap = Wrap.objects.create(name='classic', base_price=Decimal('6.00'))
+        self.wrap.ingredients.add(self.tomato)
+        self.wrap.save()
+        self.other = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        self.platter = Platter.objects.create(name='mixed', base_price=Decimal('10.00'))
+        self.platter.ingredients.add(self.tomato)
+
+    def test_update_recalculates(self):
+        with self.assertNumQueries(4):
+            # 1 query to fetch the affected primary keys,
+            # 1 query for the update,
+            # 1 query to fetch the updated rows,
+            # 1 query to update their cached fields.
+            Drink.objects.filter(base_price__gte=1).update(base_price=Decimal('5.00'))
+
+        self.assertEqual(list(Drink.objects.order_by('pk').values_list('_get_price_cached', flat=True)), [
+            Decimal('0.00'), Decimal('5.00'), Decimal('5.00')
+        ])
+
+    def test_update_all_rows(self):
+        with self.assertNumQueries(3):
+            # 1 query for the update,
+            # 1 query to fetch the updated rows,
+            # 1 query to update their cached fields.
+            Drink.objects.update(base_price=Decimal('5.00'))
+
+        self.assertEqual(Drink.objects.filter(_get_price_cached=Decimal('5.00')).count(), 3)
+
+    def test_update_all_rows_invalidates_related(self):
+        Ingredient.objects.update(price=Decimal('1.00'))
+
+        # Without primary keys, all related rows are invalidated.
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other._get_price_cached)
+
+    def test_update_cached_fields(self):
+        with self.assertNumQueries(1):
+            # 1 query for the update.
+            Drink.objects.update(_get_price_cached=None)
+
+    def test_update_invalidates_related(self):
+        WrapDeluxe.objects.create(name='deluxe', base_price=Decimal('8.00'))
+
+        Ingredient.objects.filter(pk=self.tomato.pk).update(price=Decimal('1.00'))
+
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other._get_price_cached, Decimal('5.00'))
+        self.platter.refresh_from_db()
+        self.assertEqual(self.platter._get_price_cached, Decimal('11.00'))
+        self.assertIsNone(WrapDeluxe.objects.get()._get_price_cached)
+
+    def test_bulk_create(self):
+        with self.assertNumQueries(1):
+            # 1 query for the create, including the cached fields.
+            Drink.objects.bulk_create([Drink(name='cola', base_price=Decimal('2.00'))])
+
+        drink = Drink.objects.get(name='cola')
+        self.assertEqual(drink._get_price_cached, Decimal('2.00'))
+        self.assertEqual(drink._get_name_cached, 'cola')
+
+    @skipIfDBFeature('can_return_ids_from_bulk_insert')
+    def test_bulk_create_requires_pk(self):
+        with self.assertNumQueries(1):
+            # 1 query for the create. Without primary keys, the fields that
+            # require one can't be calculated.
+            Pizza.objects.bulk_create([Pizza(name='margherita', base_price=Decimal('7.00'))])
+
+        pizza = Pizza.objects.get(name='margherita')
+        self.assertIsNone(pizza._get_price_cached)
+        self.assertEqual(pizza.get_price(), Decimal('7.00'))
+
+    @skipIfDBFeature('can_return_ids_from_bulk_insert')
+    def test_bulk_create_invalidates_related(self):
+        Ingredient.objects.bulk_create([Ingredient(name='basil', price=Decimal('0.50'))])
+
+        # Without primary keys, all related rows are invalidated.
+        self.wrap.refresh_from_db()
+        self.assertIsNone(self.wrap._get_price_cached)
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other._get_price_cached)
+
+    @skipUnless(hasattr(QuerySet, 'bulk_update'), 'QuerySet.bulk_update requires Django 2.2 or later.')
+    def test_bulk_update(self):
+        for drink in self.drinks:
+            drink.base_price += 1
+
+        Drink.objects.bulk_update(self.drinks, ['base_price'])
+
+        self.assertEqual(list(Drink.objects.order_by('pk').values_list('_get_price_cached', flat=True)), [
+            Decimal('1.00'), Decimal('2.00'), Decimal('3.00')
+        ])
+
+    def test_update_in_batch(self):
+        with dbcache.batch() as batch:
+            Drink.objects.filter(base_price__gte=1).update(base_price=Decimal('7.00'))
+            self.assertEqual(batch.saved['tests.proj.myapp.models.Drink'], set(d.pk for d in self.drinks[1:]))
+            Drink.objects.update(base_price=Decimal('7.00'))
+            # All rows are recalculated, without fetching their primary keys.
+            self.assertIsNone(batch.saved['tests.proj.myapp.models.Drink'])
+            self.assertEqual(Drink.objects.filter(_get_price_cached=Decimal('7.00')).count(), 0)
+
+        self.assertEqual(Drink.objects.filter(_get_price_cached=Decimal('7.00')).count(), 3)
@@ -0,0 +1,116 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+
+from django_dbcache_fields.metrics import BUCKETS, Histogram, registry
+from django_dbcache_fields.signals import dbcache_invalidated, dbcache_miss, dbcache_recomputed
+from tests.proj.myapp.models import Drink, Lasagna, Wrap, WrapType
+
+
+class HistogramTests(TestCase):
+    def test_observe(self):
+        histogram = Histogram()
+        histogram.observe(0.002)
+        histogram.observe(0.003)
+        histogram.observe(10)
+
+        result = histogram.as_dict()
+        self.assertEqual(result['count'], 3)
+        self.assertAlmostEqual(result['total'], 10.005)
+        self.assertEqual(result['buckets'][BUCKETS[0]], 0)
+        self.assertEqual(result['buckets'][0.005], 2)
+        self.assertEqual(result['buckets'][float('inf')], 3)
+
+
+@override_settings(DBCACHE_FIELDS_METRICS=True)
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.drink = Drink.objects.create(name='coffee', base_price=Decimal('2.00'))
+        registry.reset()
+
+        self.signals = []
+        for signal in (dbcache_miss, dbcache_recomputed, dbcache_invalidated):
+            signal.connect(self.receive, dispatch_uid='test_metrics')
+            self.addCleanup(signal.disconnect, dispatch_uid='test_metrics')
+
+    def tearDown(self):
+        registry.reset()
+
+    def receive(self, signal, sender, **kwargs):
+        self.signals.append((signal, sender, kwargs.get('field_name'), kwargs.get('field_names')))
+
+    def test_hit(self):
+        self.drink.get_price()
+        self.drink.get_price()
+
+        self.assertEqual(registry.get('myapp.Drink', '_get_price_cached'), {'hits': 2})
+        self.assertEqual(self.signals, [])
+
+    def test_miss(self):
+        self.drink._get_price_cached = None
+        self.drink.get_price()
+
+        metrics = registry.get('myapp.Drink', '_get_price_cached')
+        self.assertEqual(metrics['misses'], 1)
+        self.assertEqual(metrics['recomputes'], 1)
+        self.assertEqual(metrics['write_backs'], 1)
+        self.assertEqual(metrics['recompute_duration']['count'], 1)
+        self.assertEqual(self.signals, [
+            (dbcache_miss, Drink, '_get_price_cached', None),
+            (dbcache_recomputed, Drink, '_get_price_cached', None),
+        ])
+
+    def test_memo_hit(self):
+        self.drink.get_price(use_dbcache=False)
+        self.drink.get_price(use_dbcache=False)
+
+        metrics = registry.get('myapp.Drink', '_get_price_cached')
+        self.assertEqual(metrics['recomputes'], 1)
+        self.assertEqual(metrics['memo_hits'], 1)
+
+    @override_settings(DBCACHE_FIELDS_WRITE_MODE='readonly')
+    def test_miss_without_write_back(self):
+        self.drink._get_price_cached = None
+        self.drink.get_price()
+
+        self.assertNotIn('write_backs', registry.get('myapp.Drink', '_get_price_cached'))
+
+    def test_save(self):
+        self.drink.save()
+
+        self.assertEqual(registry.get('myapp.Drink', '_get_price_cached')['recomputes'], 1)
+        self.assertEqual(registry.get('myapp.Drink', '_get_name_cached')['recomputes'], 1)
+
+    def test_dirty_skip(self):
+        lasagna = Lasagna.objects.create(name='classic', base_price=Decimal('8.00'))
+        registry.reset()
+
+        lasagna.save()
+
+        self.assertEqual(registry.get('myapp.Lasagna', '_get_price_cached'), {'dirty_skips': 1})
+
+    def test_invalidation(self):
+        wrap_type = WrapType.objects.create(type_name='hot', price=Decimal('1.00'))
+        Wrap.objects.create(name='classic', base_price=Decimal('5.00'), wrap_type=wrap_type)
+        Wrap.objects.create(name='deluxe', base_price=Decimal('7.00'), wrap_type=wrap_type)
+        Wrap.objects.create(name='plain', base_price=Decimal('4.00'))
+        del self.signals[:]
+
+        wrap_type.save()
+
+        self.assertEqual(registry.get('myapp.Wrap', '_get_price_cached')['invalidated_rows'], 2)
+        self.assertEqual(self.signals, [(dbcache_invalidated, Wrap, None, frozenset(['_get_price_cached']))])
+
+    @override_settings(DBCACHE_FIELDS_METRICS=False)
+    def test_disabled(self):
+        self.drink._get_price_cached = None
+        self.drink.get_price()
+        self.drink.get_price()
+        self.drink.save()
+
+        self.assertEqual(registry.snapshot(), {})
+        self.assertEqual(self.signals, [])
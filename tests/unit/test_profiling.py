@@ -0,0 +1,78 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+from unittest import skipUnless
+
+from django import VERSION as DJANGO_VERSION
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from django_dbcache_fields.profiling import get_profiler, profile
+from tests.proj.myapp.models import Drink, Ingredient, Pizza, Wrap, WrapType
+
+
+@skipUnless(DJANGO_VERSION >= (2, 0), 'Profiling requires Django 2.0 or later.')
+class ProfileTests(TestCase):
+    def setUp(self):
+        self.pizza = Pizza.objects.create(name='margarita', base_price=Decimal('10.00'))
+        self.pizza.ingredients.add(Ingredient.objects.create(name='tomato', price=Decimal('0.75')))
+
+    def test_method(self):
+        Pizza.objects.update(_get_price_cached=None)
+        pizza = Pizza.objects.get(pk=self.pizza.pk)
+
+        with profile() as profiler:
+            self.assertIs(get_profiler(), profiler)
+            pizza.get_price()
+            # Other queries are not attributed to anything.
+            Pizza.objects.count()
+            pizza.get_price()
+
+        self.assertIsNone(get_profiler())
+        stats = profiler.get('method', 'myapp.Pizza.get_price')
+        # 1 query for the aggregate within the get_price function,
+        # 1 query to store the cached value.
+        self.assertEqual((stats['calls'], stats['queries']), (1, 2))
+        self.assertEqual(len(profiler.stats), 1)
+
+    def test_save(self):
+        with profile() as profiler:
+            self.pizza.save()
+
+        self.assertEqual(profiler.get('save', 'myapp.Pizza')['queries'], 1)
+        self.assertEqual(profiler.get('method', 'myapp.Pizza.get_price')['queries'], 1)
+
+    def test_invalidation(self):
+        wrap_type = WrapType.objects.create(type_name='hot', price=Decimal('1.00'))
+        Wrap.objects.create(name='classic', base_price=Decimal('5.00'), wrap_type=wrap_type)
+
+        with profile() as profiler:
+            wrap_type.save()
+            Drink.objects.filter(pk=0).update(base_price=Decimal('1.00'))
+
+        self.assertEqual(profiler.get('invalidation', 'myapp.WrapType')['queries'], 1)
+        self.assertEqual(profiler.get('bulk', 'myapp.Drink')['queries'], 0)
+        self.assertEqual(profiler.get('bulk', 'myapp.Drink')['calls'], 1)
+
+    def test_report(self):
+        with profile() as profiler:
+            self.pizza.save()
+
+        lines = profiler.report()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('myapp.Pizza.get_price', ''.join(lines))
+
+    def test_command(self):
+        Pizza.objects.update(_get_price_cached=None)
+        out = StringIO()
+
+        call_command('dbcache_profile', 'dbcache_rebuild', 'myapp.Pizza', stdout=out)
+
+        lines = [line for line in out.getvalue().splitlines() if 'myapp.Pizza.get_price' in line]
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('method '))
+        self.assertIn('calls=1 ', lines[0])
+        self.assertIn('queries=1 ', lines[0])
@@ -0,0 +1,204 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.six import StringIO
+
+from django_dbcache_fields.models import RefreshTask
+from django_dbcache_fields.queues import (CallableQueue, DatabaseQueue, TaskSet, ThreadQueue, get_queue, refresh_task,
+                                          schedule_refresh)
+from tests.proj.myapp.models import Wrap, WrapType
+
+WRAP = 'tests.proj.myapp.models.Wrap'
+
+enqueued = []
+
+
+def enqueue(class_path, pks, field_names):
+    enqueued.append((class_path, pks, field_names))
+
+
+class TaskSetTests(TestCase):
+    def test_coalesce(self):
+        tasks = TaskSet()
+        tasks.add(WRAP, [1, 2], ['_get_price_cached'])
+        tasks.add(WRAP, [2, 3], ['_get_price_cached'])
+        tasks.add(WRAP, [1], ['_get_price_cached', '_get_promo_text_cached'])
+
+        self.assertEqual(len(tasks), 2)
+        self.assertEqual(sorted([tasks.pop(), tasks.pop()]), [
+            (WRAP, [1], ['_get_price_cached', '_get_promo_text_cached']),
+            (WRAP, [1, 2, 3], ['_get_price_cached']),
+        ])
+
+    def test_coalesce_all_rows(self):
+        tasks = TaskSet()
+        tasks.add(WRAP, [1, 2], ['_get_price_cached'])
+        tasks.add(WRAP, None, ['_get_price_cached'])
+        tasks.add(WRAP, [3], ['_get_price_cached'])
+
+        self.assertEqual(tasks.pop(), (WRAP, None, ['_get_price_cached']))
+        self.assertEqual(len(tasks), 0)
+
+
+class GetQueueTests(TestCase):
+    def test_no_queue(self):
+        self.assertIsNone(get_queue())
+
+    @override_settings(
+        DBCACHE_FIELDS_QUEUE='django_dbcache_fields.queues.ThreadQueue', DBCACHE_FIELDS_QUEUE_OPTIONS={'workers': 2})
+    def test_queue_class(self):
+        queue = get_queue()
+
+        self.assertIsInstance(queue, ThreadQueue)
+        self.assertEqual(queue.workers, 2)
+        self.assertIs(get_queue(), queue)
+
+    @override_settings(DBCACHE_FIELDS_QUEUE='tests.unit.test_queues.enqueue')
+    def test_callable(self):
+        queue = get_queue()
+
+        self.assertIsInstance(queue, CallableQueue)
+        self.assertIs(queue.func, enqueue)
+
+    @override_settings(DBCACHE_FIELDS_QUEUE='tests.unit.test_queues.WRAP')
+    def test_invalid(self):
+        self.assertRaises(ImproperlyConfigured, get_queue)
+
+
+class RefreshTaskTests(TestCase):
+    def setUp(self):
+        self.wraps = [Wrap.objects.create(name='wrap {}'.format(i), base_price=Decimal(5 + i)) for i in range(3)]
+        Wrap.objects.update(_get_price_cached=None)
+
+    def test_refresh_task(self):
+        result = refresh_task(WRAP, [self.wraps[0].pk, self.wraps[1].pk], ['_get_price_cached'])
+
+        self.assertEqual(result.processed, 2)
+        self.assertEqual(Wrap.objects.filter(_get_price_cached__isnull=True).get(), self.wraps[2])
+
+    def test_skip_cached_rows(self):
+        Wrap.objects.filter(pk=self.wraps[0].pk).update(_get_price_cached=Decimal('1.00'))
+
+        result = refresh_task(WRAP, None, ['_get_price_cached'])
+
+        self.assertEqual(result.processed, 2)
+        self.assertEqual(Wrap.objects.get(pk=self.wraps[0].pk)._get_price_cached, Decimal('1.00'))
+
+
+@override_settings(DBCACHE_FIELDS_QUEUE='tests.unit.test_queues.enqueue')
+class ScheduleRefreshTests(TransactionTestCase):
+    def setUp(self):
+        del enqueued[:]
+        self.wrap_type = WrapType.objects.create(type_name='hot', price=Decimal('1.00'))
+        self.wrap = Wrap.objects.create(name='classic', base_price=Decimal('5.00'), wrap_type=self.wrap_type)
+        Wrap.objects.create(name='plain', base_price=Decimal('4.00'))
+        del enqueued[:]
+
+    def test_enqueue_on_invalidation(self):
+        self.wrap_type.save()
+
+        self.assertEqual(enqueued, [(WRAP, [self.wrap.pk], ['_get_price_cached'])])
+
+    def test_coalesce_in_transaction(self):
+        with transaction.atomic():
+            self.wrap_type.save()
+            self.wrap_type.save()
+            schedule_refresh(Wrap, [self.wrap.pk], ['_get_promo_text_cached'])
+            self.assertEqual(enqueued, [])
+
+        self.assertEqual(sorted(enqueued), [
+            (WRAP, [self.wrap.pk], ['_get_price_cached']),
+            (WRAP, [self.wrap.pk], ['_get_promo_text_cached']),
+        ])
+
+    def test_discard_on_rollback(self):
+        try:
+            with transaction.atomic():
+                self.wrap_type.save()
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        self.assertEqual(enqueued, [])
+
+    @override_settings(DBCACHE_FIELDS_QUEUE=None)
+    def test_no_queue(self):
+        self.wrap_type.save()
+
+        self.assertEqual(enqueued, [])
+
+
+@override_settings(DBCACHE_FIELDS_QUEUE='django_dbcache_fields.queues.ThreadQueue')
+class ThreadQueueTests(TransactionTestCase):
+    def test_refresh_in_thread(self):
+        wrap_type = WrapType.objects.create(type_name='hot', price=Decimal('1.00'))
+        wrap = Wrap.objects.create(name='classic', base_price=Decimal('5.00'), wrap_type=wrap_type)
+
+        WrapType.objects.update(price=Decimal('2.00'))
+        wrap_type.refresh_from_db()
+        wrap_type.save()
+
+        self.assertTrue(get_queue().join(timeout=10))
+        wrap.refresh_from_db()
+        self.assertEqual(wrap._get_price_cached, Decimal('7.00'))
+
+
+@override_settings(DBCACHE_FIELDS_QUEUE='django_dbcache_fields.queues.DatabaseQueue')
+class DatabaseQueueTests(TestCase):
+    def setUp(self):
+        self.wraps = [Wrap.objects.create(name='wrap {}'.format(i), base_price=Decimal(5 + i)) for i in range(3)]
+        Wrap.objects.update(_get_price_cached=None)
+
+    def test_enqueue(self):
+        DatabaseQueue().enqueue(WRAP, [self.wraps[0].pk, self.wraps[1].pk], ['_get_price_cached'])
+        DatabaseQueue().enqueue(WRAP, None, ['_get_price_cached', '_get_promo_text_cached'])
+
+        self.assertEqual(list(RefreshTask.objects.order_by('pk').values_list('object_pk', 'field_names')), [
+            (str(self.wraps[0].pk), '_get_price_cached'),
+            (str(self.wraps[1].pk), '_get_price_cached'),
+            (None, '_get_price_cached,_get_promo_text_cached'),
+        ])
+
+    def test_process(self):
+        DatabaseQueue().enqueue(WRAP, [self.wraps[0].pk, self.wraps[1].pk], ['_get_price_cached'])
+        DatabaseQueue().enqueue(WRAP, [self.wraps[1].pk], ['_get_price_cached'])
+
+        with self.assertNumQueries(12):
+            # 2 queries for the savepoint,
+            # 1 query to fetch the queued tasks,
+            # 2 queries for the savepoint of the coalesced task,
+            # 1 query to fetch the rows of the coalesced task,
+            # 2 queries per row within the get_price function,
+            # 1 query to update the rows,
+            # 1 query to remove the processed tasks.
+            self.assertEqual(DatabaseQueue().process(), 3)
+
+        self.assertEqual(Wrap.objects.filter(_get_price_cached__isnull=True).get(), self.wraps[2])
+        self.assertFalse(RefreshTask.objects.exists())
+
+    def test_process_failed_task(self):
+        DatabaseQueue().enqueue(WRAP, [self.wraps[0].pk], ['_unknown'])
+        DatabaseQueue().enqueue(WRAP, [self.wraps[1].pk], ['_get_price_cached'])
+
+        self.assertEqual(DatabaseQueue().process(), 2)
+
+        self.assertEqual(Wrap.objects.filter(_get_price_cached__isnull=False).get(), self.wraps[1])
+        self.assertFalse(RefreshTask.objects.exists())
+
+    def test_worker_command(self):
+        for wrap in self.wraps:
+            DatabaseQueue().enqueue(WRAP, [wrap.pk], ['_get_price_cached'])
+
+        out = StringIO()
+        call_command('dbcache_worker', once=True, batch_size=2, stdout=out)
+
+        self.assertIn('Processed 3 queued tasks in total.', out.getvalue())
+        self.assertFalse(Wrap.objects.filter(_get_price_cached__isnull=True).exists())
+        self.assertFalse(RefreshTask.objects.exists())
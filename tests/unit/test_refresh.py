@@ -0,0 +1,226 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+
+from django.test import TestCase
+
+from django_dbcache_fields import register
+from django_dbcache_fields.refresh import RefreshResult, _refresh_shard, get_pk_shards, refresh_dbcache
+from django_dbcache_fields.utils import bulk_update_fields
+from tests.proj.myapp.models import Drink, Ingredient, Pizza, Salad, Wrap, WrapDeluxe
+
+
+class RefreshDBCacheTests(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Drink.objects.create(name='drink {}'.format(i), base_price=Decimal(i))
+        Drink.objects.update(_get_price_cached=None, _get_name_cached=None)
+
+    def test_refresh_all_fields(self):
+        with self.assertNumQueries(4):
+            # 2 queries to fetch the batches of 3 and 2 rows,
+            # 2 queries to update them (1 query per batch).
+            result = refresh_dbcache(Drink.objects.all(), batch_size=3)
+
+        self.assertEqual(result.processed, 5)
+        self.assertEqual(result.updated, 5)
+        for drink in Drink.objects.all():
+            self.assertEqual(drink._get_price_cached, drink.base_price)
+            self.assertEqual(drink._get_name_cached, drink.name)
+
+    def test_refresh_some_fields(self):
+        result = refresh_dbcache(Drink.objects.filter(base_price__gte=3), fields=['get_name'])
+
+        self.assertEqual(result.processed, 2)
+        self.assertEqual(list(Drink.objects.filter(_get_name_cached__isnull=False).values_list('name', flat=True)),
+                         ['drink 3', 'drink 4'])
+        self.assertFalse(Drink.objects.filter(_get_price_cached__isnull=False).exists())
+
+    def test_refresh_by_field_name(self):
+        refresh_dbcache(Drink.objects.all(), fields=['_get_price_cached'])
+
+        self.assertFalse(Drink.objects.filter(_get_price_cached__isnull=True).exists())
+        self.assertFalse(Drink.objects.filter(_get_name_cached__isnull=False).exists())
+
+    def test_refresh_unchanged(self):
+        refresh_dbcache(Drink.objects.all())
+
+        with self.assertNumQueries(1):
+            # 1 query to fetch the rows, nothing changed so no update.
+            result = refresh_dbcache(Drink.objects.all())
+
+        self.assertEqual(result.processed, 5)
+        self.assertEqual(result.updated, 0)
+
+    def test_refresh_calls_original_method(self):
+        pizza = Pizza.objects.create(name='margarita', base_price=Decimal('10.00'))
+        Pizza.objects.update(_get_price_cached=Decimal('1.00'))
+
+        refresh_dbcache(Pizza.objects.all())
+
+        pizza.refresh_from_db()
+        self.assertEqual(pizza._get_price_cached, Decimal('10.00'))
+
+    def test_refresh_marks_valid(self):
+        wrap = Wrap.objects.create(name='classic', base_price=Decimal('6.00'))
+        Wrap.objects.update(_get_promo_price_cached_valid=False)
+
+        result = refresh_dbcache(Wrap.objects.all(), fields=['get_promo_price'])
+
+        self.assertEqual(result.updated, 1)
+        wrap.refresh_from_db()
+        self.assertIsNone(wrap._get_promo_price_cached)
+        self.assertTrue(wrap._get_promo_price_cached_valid)
+
+    def test_raise_exc_for_unknown_field(self):
+        self.assertRaises(ValueError, refresh_dbcache, Drink.objects.all(), fields=['get_foo'])
+
+    def test_refresh_fail_silently(self):
+        failing_pk = Drink.objects.order_by('pk')[1].pk
+
+        def get_name(instance):
+            if instance.pk == failing_pk:
+                raise RuntimeError()
+            return instance.name
+
+        entry = register.get('tests.proj.myapp.models.Drink')[1]
+        original = entry['decorated_method']
+        entry['decorated_method'] = get_name
+        try:
+            self.assertRaises(RuntimeError, refresh_dbcache, Drink.objects.all(), fields=['get_name'])
+
+            result = refresh_dbcache(Drink.objects.all(), fields=['get_name'], fail_silently=True)
+        finally:
+            entry['decorated_method'] = original
+
+        self.assertEqual(result.processed, 5)
+        self.assertEqual(result.updated, 4)
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(list(Drink.objects.filter(_get_name_cached__isnull=True).values_list('pk', flat=True)),
+                         [failing_pk])
+
+    def test_rate(self):
+        self.assertEqual(RefreshResult(processed=10, duration=2.0).rate, 5.0)
+        self.assertEqual(RefreshResult(processed=10).rate, 0.0)
+
+    def test_add(self):
+        result = RefreshResult(processed=10, updated=5, failed=1, duration=2.0)
+        result.add(RefreshResult(processed=3, updated=2, failed=1, duration=1.0))
+
+        self.assertEqual((result.processed, result.updated, result.failed, result.duration), (13, 7, 2, 2.0))
+
+
+class BulkRefreshTests(TestCase):
+    def setUp(self):
+        tomato = Ingredient.objects.create(name='tomato', price=Decimal('0.75'))
+        for i in range(5):
+            wrap = WrapDeluxe.objects.create(name='wrap {}'.format(i), base_price=Decimal(5 + i))
+            salad = Salad.objects.create(name='salad {}'.format(i), base_price=Decimal(5 + i))
+            if i % 2:
+                wrap.ingredients.add(tomato)
+                salad.ingredients.add(tomato)
+        WrapDeluxe.objects.update(_get_price_cached=None)
+        Salad.objects.update(price=None)
+
+    def test_refresh_expression(self):
+        with self.assertNumQueries(4):
+            # 2 queries to fetch the primary keys of the batches of 3 and 2 rows,
+            # 2 queries to calculate and update them (1 query per batch).
+            result = refresh_dbcache(WrapDeluxe.objects.all(), batch_size=3)
+
+        self.assertEqual(result.processed, 5)
+        self.assertEqual(result.updated, 5)
+        self.assertEqual(list(WrapDeluxe.objects.order_by('pk').values_list('_get_price_cached', flat=True)), [
+            Decimal('5.00'), Decimal('6.75'), Decimal('7.00'), Decimal('8.75'), Decimal('9.00')
+        ])
+
+    def test_refresh_callable(self):
+        with self.assertNumQueries(3):
+            # 1 query to fetch the primary keys,
+            # 1 query to calculate the values,
+            # 1 query to update them.
+            result = refresh_dbcache(Salad.objects.all())
+
+        self.assertEqual(result.processed, 5)
+        self.assertEqual(list(Salad.objects.order_by('pk').values_list('price', flat=True)), [
+            Decimal('5.00'), Decimal('6.75'), Decimal('7.00'), Decimal('8.75'), Decimal('9.00')
+        ])
+
+    def test_bulk_matches_original_method(self):
+        refresh_dbcache(WrapDeluxe.objects.all())
+        refresh_dbcache(Salad.objects.all())
+
+        for dish in list(WrapDeluxe.objects.all()) + list(Salad.objects.all()):
+            self.assertEqual(dish.get_price(use_dbcache=False), dish.get_price())
+
+    def test_refresh_bulk_fail_silently(self):
+        entry = register.get('tests.proj.myapp.models.Salad')[0]
+        original = entry['bulk']
+        entry['bulk'] = lambda queryset: 1 / 0
+        try:
+            self.assertRaises(ZeroDivisionError, refresh_dbcache, Salad.objects.all())
+
+            result = refresh_dbcache(Salad.objects.all(), batch_size=3, fail_silently=True)
+        finally:
+            entry['bulk'] = original
+
+        self.assertEqual(result.processed, 5)
+        self.assertEqual(result.updated, 0)
+        self.assertEqual(result.failed, 5)
+
+
+class ParallelRefreshTests(TestCase):
+    def setUp(self):
+        self.drinks = [
+            Drink.objects.create(name='drink {}'.format(i), base_price=Decimal(i)) for i in range(10)
+        ]
+        Drink.objects.update(_get_price_cached=None, _get_name_cached=None)
+
+    def test_get_pk_shards(self):
+        first, last = self.drinks[0].pk, self.drinks[-1].pk
+
+        self.assertEqual(get_pk_shards(Drink.objects.all(), 3), [
+            (first, first + 3), (first + 4, first + 7), (first + 8, last)
+        ])
+        self.assertEqual(get_pk_shards(Drink.objects.all(), 1), [(first, last)])
+        self.assertEqual(len(get_pk_shards(Drink.objects.all(), 20)), 10)
+        self.assertEqual(get_pk_shards(Drink.objects.none(), 3), [])
+
+    def test_refresh_shard(self):
+        queryset = Drink.objects.filter(base_price__gte=2)
+        lower, upper = self.drinks[0].pk, self.drinks[4].pk
+
+        result = _refresh_shard(('myapp.Drink', queryset.query, ['_get_price_cached'], 2, False, lower, upper))
+
+        self.assertEqual(result.processed, 3)
+        self.assertEqual(result.updated, 3)
+        self.assertEqual(list(Drink.objects.filter(_get_price_cached__isnull=False).values_list('pk', flat=True)),
+                         [d.pk for d in self.drinks[2:5]])
+
+
+class BulkUpdateFieldsTests(TestCase):
+    def test_update_different_values(self):
+        drink1 = Drink.objects.create(name='cola', base_price=Decimal('2.00'))
+        drink2 = Drink.objects.create(name='tea', base_price=Decimal('1.00'))
+
+        with self.assertNumQueries(1):
+            updated = bulk_update_fields(Drink, {
+                drink1.pk: {'_get_price_cached': Decimal('3.00'), '_get_name_cached': 'coke'},
+                drink2.pk: {'_get_price_cached': None},
+            })
+
+        self.assertEqual(updated, 2)
+
+        drink1.refresh_from_db()
+        self.assertEqual(drink1._get_price_cached, Decimal('3.00'))
+        self.assertEqual(drink1._get_name_cached, 'coke')
+
+        drink2.refresh_from_db()
+        self.assertIsNone(drink2._get_price_cached)
+        self.assertEqual(drink2._get_name_cached, 'tea')
+
+    def test_nothing_to_update(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(bulk_update_fields(Drink, {}), 0)
@@ -0,0 +1,160 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import F, Sum
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from django_dbcache_fields.decorators import dbcache
+from django_dbcache_fields.queues import refresh_task
+from django_dbcache_fields.refresh import refresh_dbcache
+from django_dbcache_fields.utils import get_dbcache_entries, get_uncached_filter, is_cached
+from tests.proj.myapp.models import Sauce, Taco
+
+TACO = 'tests.proj.myapp.models.Taco'
+
+enqueued = []
+
+
+def enqueue(class_path, pks, field_names):
+    enqueued.append((class_path, pks, field_names))
+
+
+class MaxStaleTests(TransactionTestCase):
+    def setUp(self):
+        self.salsa = Sauce.objects.create(name='salsa', price=Decimal('0.50'))
+        self.dish = Taco.objects.create(name='classic', base_price=Decimal('3.00'), sauce=self.salsa)
+        self.other = Taco.objects.create(name='plain', base_price=Decimal('2.00'))
+
+        del enqueued[:]
+        self.addCleanup(enqueued.__delitem__, slice(None))
+
+    def change_sauce(self):
+        self.salsa.price = Decimal('1.00')
+        self.salsa.save()
+        self.dish.refresh_from_db()
+
+    def test_initial(self):
+        self.assertEqual(self.dish._get_price_cached, Decimal('3.50'))
+        self.assertIsNone(self.dish._get_price_cached_stale_since)
+
+    def test_invalidation_keeps_value(self):
+        with self.assertNumQueries(2):
+            # 1 query for the save,
+            # 1 query to mark the tacos with this sauce as stale.
+            self.salsa.save()
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_price_cached, Decimal('3.50'))
+        self.assertIsNotNone(self.dish._get_price_cached_stale_since)
+
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other._get_price_cached_stale_since)
+
+    def test_invalidation_keeps_stale_since(self):
+        stale_since = timezone.now() - timedelta(seconds=30)
+        Taco.objects.update(_get_price_cached_stale_since=stale_since)
+
+        self.change_sauce()
+
+        self.assertEqual(self.dish._get_price_cached_stale_since, stale_since)
+
+    def test_stale_value(self):
+        self.change_sauce()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.dish.get_price(), Decimal('3.50'))
+
+    @override_settings(DBCACHE_FIELDS_QUEUE=enqueue)
+    def test_stale_value_schedules_refresh(self):
+        self.change_sauce()
+        del enqueued[:]
+
+        self.dish.get_price()
+        self.dish.get_price()
+
+        self.assertEqual(enqueued, [(TACO, [self.dish.pk], ['_get_price_cached'])])
+
+        refresh_task(*enqueued[0])
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_price_cached, Decimal('4.00'))
+        self.assertIsNone(self.dish._get_price_cached_stale_since)
+
+    def test_expired_value(self):
+        self.change_sauce()
+        Taco.objects.update(_get_price_cached_stale_since=timezone.now() - timedelta(seconds=61))
+        self.dish.refresh_from_db()
+
+        with self.assertNumQueries(2):
+            # 1 query for the sauce within the get_price function,
+            # 1 query for the update of the cached fields.
+            self.assertEqual(self.dish.get_price(), Decimal('4.00'))
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_price_cached, Decimal('4.00'))
+        self.assertIsNone(self.dish._get_price_cached_stale_since)
+
+    def test_expired_memoized_value(self):
+        Taco.objects.update(_get_price_cached=None)
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.get_price(), Decimal('3.50'))
+
+        self.dish.base_price = Decimal('4.00')
+        self.dish._get_price_cached_stale_since = timezone.now() - timedelta(seconds=61)
+
+        self.assertEqual(self.dish.get_price(), Decimal('4.50'))
+
+    def test_is_cached(self):
+        entry = get_dbcache_entries(Taco, ['get_price'])[0]
+        self.change_sauce()
+        self.assertTrue(is_cached(self.dish, entry))
+
+        self.dish._get_price_cached_stale_since = timezone.now() - timedelta(seconds=61)
+        self.assertFalse(is_cached(self.dish, entry))
+
+    def test_use_dbcache_false(self):
+        self.change_sauce()
+
+        self.assertEqual(self.dish.get_price(use_dbcache=False), Decimal('4.00'))
+
+        self.dish.refresh_from_db()
+        self.assertIsNone(self.dish._get_price_cached_stale_since)
+
+    def test_save(self):
+        self.change_sauce()
+
+        self.dish.save()
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_price_cached, Decimal('4.00'))
+        self.assertIsNone(self.dish._get_price_cached_stale_since)
+
+    def test_refresh(self):
+        self.change_sauce()
+        entries = get_dbcache_entries(Taco)
+
+        self.assertEqual(list(Taco.objects.filter(get_uncached_filter(entries))), [self.dish])
+
+        refresh_dbcache(Taco.objects.all())
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_price_cached, Decimal('4.00'))
+        self.assertIsNone(self.dish._get_price_cached_stale_since)
+        self.assertEqual(list(Taco.objects.filter(get_uncached_filter(entries))), [])
+
+    def test_seconds(self):
+        self.assertEqual(get_dbcache_entries(Taco)[0].max_stale, timedelta(seconds=60))
+
+    def test_invalid_max_stale(self):
+        with self.assertRaises(TypeError):
+            dbcache(models.IntegerField(blank=True, null=True), max_stale='1 minute')
+
+        with self.assertRaises(ValueError):
+            dbcache(models.IntegerField(blank=True, null=True), eager=True, bulk=F('price') + Sum('price'),
+                    max_stale=60)
@@ -0,0 +1,128 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import models
+from django.test import TestCase
+from django.utils import timezone
+
+from django_dbcache_fields import register
+from django_dbcache_fields.decorators import dbcache
+from django_dbcache_fields.refresh import refresh_expired
+from django_dbcache_fields.utils import get_dbcache_entries, get_expired_filter, is_cached
+from tests.proj.myapp.models import Taco
+
+
+class TTLTests(TestCase):
+    def setUp(self):
+        self.dish = Taco.objects.create(name='classic', base_price=Decimal('3.00'))
+        self.expired = timezone.now() - timedelta(minutes=6)
+
+    def expire(self):
+        Taco.objects.update(_get_label_cached_computed_at=self.expired)
+        self.dish.refresh_from_db()
+
+    def test_computed_at(self):
+        self.assertEqual(self.dish._get_label_cached, 'classic taco')
+        self.assertIsNotNone(self.dish._get_label_cached_computed_at)
+
+    def test_cached_value(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.dish.get_label(), 'classic taco')
+
+    def test_expired_value(self):
+        Taco.objects.update(name='crispy')
+        self.expire()
+
+        with self.assertNumQueries(1):
+            # 1 query for the update of the cached fields.
+            self.assertEqual(self.dish.get_label(), 'crispy taco')
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish._get_label_cached, 'crispy taco')
+        self.assertGreater(self.dish._get_label_cached_computed_at, self.expired)
+
+    def test_expired_memoized_value(self):
+        self.dish.name = 'crispy'
+        self.dish._get_label_cached = None
+        self.assertEqual(self.dish.get_label(), 'crispy taco')
+
+        self.dish.name = 'soft'
+        self.dish._get_label_cached_computed_at = self.expired
+
+        self.assertEqual(self.dish.get_label(), 'soft taco')
+
+    def test_unknown_computed_at(self):
+        Taco.objects.update(_get_label_cached_computed_at=None)
+        self.dish.refresh_from_db()
+
+        entry = get_dbcache_entries(Taco, ['get_label'])[0]
+        self.assertFalse(is_cached(self.dish, entry))
+
+    def test_save(self):
+        self.expire()
+
+        self.dish.save()
+
+        self.dish.refresh_from_db()
+        self.assertGreater(self.dish._get_label_cached_computed_at, self.expired)
+
+    def test_expired_filter(self):
+        other = Taco.objects.create(name='plain', base_price=Decimal('2.00'))
+        Taco.objects.filter(pk=self.dish.pk).update(_get_label_cached_computed_at=self.expired)
+        entries = get_dbcache_entries(Taco)
+
+        self.assertEqual(list(Taco.objects.filter(get_expired_filter(entries))), [self.dish])
+
+        Taco.objects.filter(pk=other.pk).update(_get_label_cached_computed_at=None)
+        self.assertEqual(list(Taco.objects.filter(get_expired_filter(entries)).order_by('pk')), [self.dish, other])
+
+    def test_refresh_expired(self):
+        tacos = [self.dish] + [
+            Taco.objects.create(name='taco {}'.format(i), base_price=Decimal('2.00')) for i in range(4)
+        ]
+        Taco.objects.update(name='crispy')
+        Taco.objects.filter(pk__in=[tacos[0].pk, tacos[2].pk]).update(_get_label_cached_computed_at=self.expired)
+        Taco.objects.filter(pk=tacos[3].pk).update(_get_label_cached_computed_at=None)
+
+        with self.assertNumQueries(7):
+            # Per batch: 1 query for the expired rows, 1 query to fetch the
+            # instances and 1 query to update them. A full batch takes
+            # another query to find out there are no more instances.
+            result = refresh_expired(Taco.objects.all(), batch_size=2)
+
+        self.assertEqual(result.processed, 3)
+        self.assertEqual(result.updated, 3)
+        self.assertEqual(list(Taco.objects.order_by('pk').values_list('_get_label_cached', flat=True)), [
+            'crispy taco', 'taco 0 taco', 'crispy taco', 'crispy taco', 'taco 3 taco',
+        ])
+        self.assertEqual(Taco.objects.filter(get_expired_filter(get_dbcache_entries(Taco))).count(), 0)
+
+    def test_refresh_expired_fail_silently(self):
+        Taco.objects.create(name='plain', base_price=Decimal('2.00'))
+        self.expire()
+
+        entry = register.get('tests.proj.myapp.models.Taco')[1]
+        original = entry['decorated_method']
+        entry['decorated_method'] = lambda instance: 1 / 0
+        try:
+            result = refresh_expired(Taco.objects.all(), batch_size=1, fail_silently=True)
+        finally:
+            entry['decorated_method'] = original
+
+        self.assertEqual(result.processed, 2)
+        self.assertEqual(result.failed, 2)
+
+    def test_refresh_expired_without_ttl(self):
+        self.expire()
+
+        result = refresh_expired(Taco.objects.all(), fields=['get_price'])
+
+        self.assertEqual(result.processed, 0)
+
+    def test_invalid_ttl(self):
+        with self.assertRaises(TypeError):
+            dbcache(models.IntegerField(blank=True, null=True), ttl='5 minutes')
@@ -0,0 +1,70 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from django.core.exceptions import FieldError
+from django.test import TestCase
+
+from django_dbcache_fields import register
+from django_dbcache_fields.utils import is_relation_path, resolve_relation_path
+from tests.proj.myapp.models import Drink, Ingredient, Menu, Platter, Soup, Wrap, WrapDeluxe, WrapPromo, WrapType
+
+
+class ResolveRelationPathTests(TestCase):
+    def test_is_relation_path(self):
+        self.assertTrue(is_relation_path('ingredients'))
+        self.assertTrue(is_relation_path('wrap__ingredients'))
+        self.assertFalse(is_relation_path('myapp.Ingredient'))
+
+    def test_m2m_field(self):
+        self.assertEqual(resolve_relation_path(Wrap, 'ingredients'), (Ingredient, 'ingredients'))
+
+    def test_fk_field(self):
+        self.assertEqual(resolve_relation_path(Wrap, 'wrap_type'), (WrapType, 'wrap_type'))
+
+    def test_reverse_fk_accessor(self):
+        self.assertEqual(resolve_relation_path(Wrap, 'wrappromo_set'), (WrapPromo, 'wrappromo'))
+
+    def test_nested_path(self):
+        self.assertEqual(resolve_relation_path(WrapPromo, 'wrap__ingredients'), (Ingredient, 'wrap__ingredients'))
+
+    def test_raise_exc_for_unknown_relation(self):
+        self.assertRaises(FieldError, resolve_relation_path, Wrap, 'name')
+        self.assertRaises(FieldError, resolve_relation_path, Wrap, 'foo')
+
+
+class ModelPlanTests(TestCase):
+    def test_get_plan(self):
+        plan = register.get_plan(Drink)
+
+        self.assertIs(register.get_plan(Drink), plan)
+        self.assertEqual(plan.class_path, 'tests.proj.myapp.models.Drink')
+        self.assertEqual(plan.model_name, 'myapp.Drink')
+        self.assertEqual(plan.entries, tuple(register.get('tests.proj.myapp.models.Drink')))
+        self.assertEqual(plan.pre_save_entries, plan.entries)
+        self.assertEqual(plan.dependents, ())
+
+    def test_dependents(self):
+        plan = register.get_plan(WrapType)
+
+        self.assertEqual(plan.entries, ())
+        self.assertEqual(plan.dependents, (
+            (Wrap, 'tests.proj.myapp.models.Wrap', 'wrap_type', frozenset(['_get_price_cached'])),
+        ))
+
+    def test_get_through_models(self):
+        self.assertEqual(set(register.get_plan(Ingredient).get_through_models()), set([
+            Wrap.ingredients.through, WrapDeluxe.ingredients.through, Platter.ingredients.through,
+            Soup.ingredients.through,
+        ]))
+        self.assertEqual(register.get_plan(WrapType).get_through_models(), [])
+
+    def test_get_through_models_declared_on_model(self):
+        self.assertEqual(register.get_plan(Menu).get_through_models(), [Menu.combos.through])
+
+    def test_entry_keys(self):
+        entry = register.get_plan(Drink).entries[0]
+
+        self.assertIs(entry['field_name'], entry.field_name)
+        self.assertRaises(KeyError, entry.__getitem__, 'foo')
+        self.assertRaises(KeyError, entry.__setitem__, 'foo', None)
@@ -0,0 +1,173 @@
+# encoding: utf-8
+
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_finished
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from django_dbcache_fields import writeback
+from tests.proj.myapp.models import Drink, Wrap, WrapPromo
+
+
+class WriteBackTestMixin(object):
+    def setUp(self):
+        super(WriteBackTestMixin, self).setUp()
+        for i in range(3):
+            Drink.objects.create(name='drink {}'.format(i), base_price=Decimal(i))
+        Drink.objects.update(_get_price_cached=None, _get_name_cached=None)
+
+    def call_methods(self):
+        for drink in Drink.objects.all():
+            drink.get_price()
+            drink.get_name()
+
+    def assertCached(self, count):
+        self.assertEqual(Drink.objects.filter(_get_price_cached__isnull=False).count(), count)
+        self.assertEqual(Drink.objects.filter(_get_name_cached__isnull=False).count(), count)
+
+
+class ImmediateWriteModeTests(WriteBackTestMixin, TestCase):
+    def test_write_per_call(self):
+        with self.assertNumQueries(7):
+            # 1 query to fetch the drinks,
+            # 1 query per call to update the cached field.
+            self.call_methods()
+
+        self.assertCached(3)
+
+
+@override_settings(DBCACHE_FIELDS_WRITE_MODE='readonly')
+class ReadOnlyWriteModeTests(WriteBackTestMixin, TestCase):
+    def test_no_write(self):
+        with self.assertNumQueries(1):
+            # 1 query to fetch the drinks.
+            self.call_methods()
+
+        self.assertCached(0)
+
+    def test_value_is_kept_on_instance(self):
+        drink = Drink.objects.first()
+
+        with self.assertNumQueries(0):
+            drink.get_price()
+            drink.get_price()
+
+        self.assertEqual(drink._get_price_cached, drink.base_price)
+
+
+@override_settings(DBCACHE_FIELDS_WRITE_MODE='deferred')
+class DeferredWriteModeTests(WriteBackTestMixin, TransactionTestCase):
+    def tearDown(self):
+        writeback.flush()
+        super(DeferredWriteModeTests, self).tearDown()
+
+    def test_write_on_request_finished(self):
+        with self.assertNumQueries(1):
+            # 1 query to fetch the drinks.
+            self.call_methods()
+
+        self.assertCached(0)
+
+        with self.assertNumQueries(1):
+            # 1 query to update all cached fields.
+            request_finished.send(sender=self.__class__)
+
+        self.assertCached(3)
+
+    def test_write_on_flush(self):
+        self.call_methods()
+
+        with self.assertNumQueries(1):
+            writeback.flush()
+
+        self.assertCached(3)
+
+    def test_write_on_commit(self):
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                self.call_methods()
+                self.assertCached(0)
+
+        # 1 query to update all cached fields on commit.
+        self.assertEqual(len([q for q in context.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+
+        self.assertCached(3)
+
+    def test_no_write_on_rollback(self):
+        try:
+            with transaction.atomic():
+                self.call_methods()
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        with transaction.atomic():
+            Drink.objects.first().get_price()
+
+        self.assertEqual(Drink.objects.filter(_get_price_cached__isnull=False).count(), 1)
+        self.assertEqual(Drink.objects.filter(_get_name_cached__isnull=False).count(), 0)
+
+    @override_settings(DBCACHE_FIELDS_WRITE_BUFFER_SIZE=2)
+    def test_write_when_buffer_is_full(self):
+        with self.assertNumQueries(2):
+            # 1 query to fetch the drinks,
+            # 1 query to update the cached fields of the first 2 drinks.
+            for drink in Drink.objects.all():
+                drink.get_price()
+
+        self.assertEqual(Drink.objects.filter(_get_price_cached__isnull=False).count(), 2)
+
+    def test_no_write_after_invalidation(self):
+        wrap = Wrap.objects.create(name='veggie', base_price=Decimal('5.00'))
+        other = Wrap.objects.create(name='plain', base_price=Decimal('3.00'))
+        Wrap._base_manager.update(_get_price_cached=None)
+        wrap, other = Wrap.objects.order_by('pk')
+
+        self.assertEqual(wrap.get_price(), Decimal('5.00'))
+        self.assertEqual(other.get_price(), Decimal('3.00'))
+        WrapPromo.objects.create(wrap=wrap, promo_price=Decimal('1.00'))
+        writeback.flush()
+
+        self.assertIsNone(Wrap.objects.get(pk=wrap.pk)._get_price_cached)
+        self.assertEqual(Wrap.objects.get(pk=other.pk)._get_price_cached, Decimal('3.00'))
+
+    def test_no_write_after_save(self):
+        drink = Drink.objects.first()
+        self.assertEqual(drink.get_price(), Decimal('0.00'))
+
+        drink.base_price = Decimal('5.00')
+        drink.save()
+        writeback.flush()
+
+        drink.refresh_from_db()
+        self.assertEqual(drink._get_price_cached, Decimal('5.00'))
+
+    @override_settings(DBCACHE_FIELDS_PRE_SAVE=True)
+    def test_no_write_after_save_pre_save(self):
+        drink = Drink.objects.first()
+        self.assertEqual(drink.get_price(), Decimal('0.00'))
+
+        drink.base_price = Decimal('5.00')
+        drink.save()
+        writeback.flush()
+
+        drink.refresh_from_db()
+        self.assertEqual(drink._get_price_cached, Decimal('5.00'))
+
+    def test_no_write_after_invalidation_on_commit(self):
+        with transaction.atomic():
+            self.call_methods()
+            Drink.objects.update(base_price=Decimal('9.00'))
+
+        self.assertEqual(list(Drink.objects.values_list('_get_price_cached', flat=True).distinct()), [Decimal('9.00')])
+
+
+@override_settings(DBCACHE_FIELDS_WRITE_MODE='foo')
+class InvalidWriteModeTests(WriteBackTestMixin, TestCase):
+    def test_raise_exc_for_invalid_write_mode(self):
+        self.assertRaises(ImproperlyConfigured, Drink.objects.first().get_price)